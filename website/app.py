@@ -1,20 +1,27 @@
-import base64
+import hashlib
 import os
 import secrets
 import smtplib
+import uuid
 from datetime import datetime, timedelta
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from functools import wraps
 
+import click
 from argon2 import PasswordHasher, exceptions
 from dotenv import load_dotenv
 from firebase_admin import auth
-from flask import Flask, flash, jsonify, redirect, render_template, request, url_for
+from flask import Flask, Response, abort, flash, jsonify, redirect, render_template, request, url_for
 from flask_login import LoginManager, current_user, login_required, login_user, logout_user
 
+from lib.agregados import RESOLUCOES, AgregadorLeituras, consultar
+from lib.arquivo import ARQUIVO_ANTES_RETENCAO, ArquivoColunar
 from lib.firebase import initialize_firebase
+from lib.imagens import ArmazemImagens, tipo_imagem
+from lib.miniaturas import TAMANHOS_IMAGEM
 from lib.models import (
+    AgregadoLeitura,
     CondicaoIdeal,
     Cultura,
     DadoPeriodico,
@@ -22,7 +29,9 @@ from lib.models import (
     FertilizanteCultura,
     Fertilizante,
     Grupo,
+    InteresseSessao,
     Log,
+    NotificacaoUsuario,
     Sessao,
     SessaoIrrigacao,
     SessaoUsuario,
@@ -32,8 +41,13 @@ from lib.models import (
     StatusDispositivo,
     ComandoDispositivo,
     StatusMQTT,
+    UltimoDadoSessao,
     db,
 )
+from lib.notificacoes import marcar_lidas
+from lib.particoes import GerenciadorParticoes
+from lib.retencao import RETENCAO_POLITICAS, MotorRetencao, ler_politicas
+from lib.ultimos import recalcular as recalcular_ultimos_dados
 
 ph = PasswordHasher()
 
@@ -48,6 +62,9 @@ app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key")
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///siia.db")
 db.init_app(app)
 
+# Imagens da câmera gravadas em disco pelo cliente MQTT
+armazem_imagens = ArmazemImagens()
+
 # Inicializar MQTT Client
 try:
     from lib.mqtt_new import mqtt_client
@@ -88,6 +105,24 @@ def admin_required(nivel_minimo=2):
     return decorator
 
 
+def invalidar_sessoes_mqtt(sessao_removida=None):
+    """Invalida o registro de sessões ativas do cliente MQTT após alterações nas sessões"""
+    if not mqtt_client:
+        return
+    if sessao_removida is not None:
+        mqtt_client.esquecer_sessao(sessao_removida)
+    else:
+        mqtt_client.sessoes.invalidar()
+
+
+def form_bool(nome, padrao=True):
+    """Lê um checkbox acompanhado de um campo oculto com valor "0" (último valor enviado vence)"""
+    valores = request.form.getlist(nome)
+    if not valores:
+        return padrao
+    return valores[-1] in ("1", "on", "true")
+
+
 def log_admin_action(action, detalhes=""):
     """Registra ações administrativas no log"""
     try:
@@ -102,29 +137,15 @@ def log_admin_action(action, detalhes=""):
 def index():
     sessoes_info = []
 
-    # Consulta todas as sessões
-    sessoes = Sessao.query.all()
-
-    for sessao in sessoes:
-        # Último dado periódicos da sessão
-        ultimo_dado = DadoPeriodico.query.filter_by(sessao_id=sessao.id).order_by(DadoPeriodico.data_hora.desc()).first()
-
-        # Verifica a cultura associada
-        cultura = Cultura.query.get(sessao.cultura_id)
-
-        # Verifica se a sessão está sendo irrigada
-        irrigacao = SessaoIrrigacao.query.filter_by(sessao_id=sessao.id).order_by(SessaoIrrigacao.data_inicio.desc()).first()
-        esta_irrigando = irrigacao.status if irrigacao else False
+    # Sessões com a cultura e o último dado (leitura e irrigação) em uma única consulta
+    for sessao, cultura, ultimo in consultar_sessoes_painel():
+        ultimo_dado = ultimo if ultimo and ultimo.data_hora else None
+        esta_irrigando = ultimo.esta_irrigando if ultimo else False
 
         # Cálculo de tempo de cultivo (considerando a data de início da irrigação como início do cultivo)
         tempo_cultivo = None
-        if irrigacao and irrigacao.data_inicio:
-            tempo_cultivo = (datetime.now() - irrigacao.data_inicio).days
-
-        # Prepara a imagem em base64
-        imagem_base64 = None
-        if ultimo_dado and ultimo_dado.imagem:
-            imagem_base64 = base64.b64encode(ultimo_dado.imagem).decode("utf-8")
+        if ultimo and ultimo.irrigacao_inicio:
+            tempo_cultivo = (datetime.now() - ultimo.irrigacao_inicio).days
 
         # Adiciona as informações de cada sessão
         sessoes_info.append(
@@ -137,7 +158,7 @@ def index():
                 "temperatura": ultimo_dado.temperatura if ultimo_dado else "N/A",
                 "umidade_ar": ultimo_dado.umidade_ar if ultimo_dado else "N/A",
                 "umidade_solo": ultimo_dado.umidade_solo if ultimo_dado else "N/A",
-                "imagem_base64": imagem_base64,
+                "imagem_url": url_imagem_sessao(sessao.id, ultimo_dado, "media"),
             }
         )
 
@@ -378,6 +399,22 @@ def alterar_senha():
         return jsonify({"success": False, "message": "Erro interno do servidor"})
 
 
+@app.route("/notificacoes/lidas", methods=["POST"])
+@login_required
+def notificacoes_lidas():
+    """Marca como lidas as notificações do usuário logado (todas ou as informadas em ids)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        lidas = marcar_lidas(db.session, current_user.id, data.get("ids"))
+        db.session.commit()
+        return jsonify({"success": True, "lidas": lidas})
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao marcar notificações: {e}")
+        return jsonify({"success": False, "message": "Erro interno do servidor"}), 500
+
+
 @app.route("/esqueci_senha", methods=["GET", "POST"])
 def esqueci_senha():
     if request.method == "POST":
@@ -668,8 +705,11 @@ def admin_cultura_delete(id):
     try:
         # Remove sessões e seus dados relacionados (irrigação e dados periódicos)
         sessoes = Sessao.query.filter_by(cultura_id=id).all()
+        sessoes_removidas = [sessao.id for sessao in sessoes]
         for sessao in sessoes:
             DadoPeriodico.query.filter_by(sessao_id=sessao.id).delete()
+            AgregadoLeitura.query.filter_by(sessao_id=sessao.id).delete()
+            UltimoDadoSessao.query.filter_by(sessao_id=sessao.id).delete()
             SessaoIrrigacao.query.filter_by(sessao_id=sessao.id).delete()
             db.session.delete(sessao)
 
@@ -689,6 +729,9 @@ def admin_cultura_delete(id):
         db.session.delete(cultura)
         db.session.commit()
 
+        for sessao_id in sessoes_removidas:
+            invalidar_sessoes_mqtt(sessao_id)
+
         log_admin_action("Cultura deletada", f"ID: {id}, Nome: {nome}")
         flash("Cultura deletada com sucesso!", "success")
         return redirect(url_for("admin_culturas_list"))
@@ -1007,9 +1050,10 @@ def admin_sessao_create():
             flash("Já existe uma sessão com este nome", "error")
             return render_template("admin/sessoes/create.html")
 
-        sessao = Sessao(nome=nome, cultura_id=cultura_id)
+        sessao = Sessao(nome=nome, cultura_id=cultura_id, ativa=form_bool("ativa"))
         db.session.add(sessao)
         db.session.commit()
+        invalidar_sessoes_mqtt()
 
         cultura = Cultura.query.get(cultura_id)
         log_admin_action("Sessão criada", f"Nome: {nome}, Cultura: {cultura.nome}")
@@ -1055,7 +1099,9 @@ def admin_sessao_edit(id):
 
         sessao.nome = nome
         sessao.cultura_id = cultura_id
+        sessao.ativa = form_bool("ativa", sessao.ativa)
         db.session.commit()
+        invalidar_sessoes_mqtt()
 
         cultura_nova = Cultura.query.get(cultura_id)
         log_admin_action(
@@ -1079,10 +1125,14 @@ def admin_sessao_delete(id):
 
     # Remove dados relacionados
     DadoPeriodico.query.filter_by(sessao_id=id).delete()
+    AgregadoLeitura.query.filter_by(sessao_id=id).delete()
+    UltimoDadoSessao.query.filter_by(sessao_id=id).delete()
     SessaoIrrigacao.query.filter_by(sessao_id=id).delete()
+    InteresseSessao.query.filter_by(sessao_id=id).delete()
 
     db.session.delete(sessao)
     db.session.commit()
+    invalidar_sessoes_mqtt(id)
 
     log_admin_action("Sessão deletada", f"ID: {id}, Nome: {nome}, Cultura: {cultura_nome}")
     flash("Sessão deletada com sucesso!", "success")
@@ -1166,6 +1216,8 @@ def admin_usuario_delete(id):
     # Remove dados relacionados
     Log.query.filter_by(usuario_id=id).delete()
     TentativaAcesso.query.filter_by(usuario_id=id).delete()
+    NotificacaoUsuario.query.filter_by(usuario_id=id).delete()
+    InteresseSessao.query.filter_by(usuario_id=id).delete()
 
     db.session.delete(usuario)
     db.session.commit()
@@ -1217,8 +1269,9 @@ def admin_mqtt_status():
         status = mqtt_client.status()
         from lib.models import StatusMQTT, StatusDispositivo
         
-        # Status dos tópicos
-        topics_status = StatusMQTT.query.all()
+        # Status dos tópicos: vitalidade em memória, completada pelo histórico gravado
+        topicos = mqtt_client.atividade.topicos()
+        historico = StatusMQTT.query.filter(StatusMQTT.topico.notin_(list(topicos))).all() if topicos else StatusMQTT.query.all()
         
         # Status dos dispositivos
         devices_status = StatusDispositivo.query.order_by(
@@ -1229,11 +1282,24 @@ def admin_mqtt_status():
             "success": True,
             "mqtt_status": status,
             "topics": [{
+                "topico": topico,
+                "ultima_mensagem": t["ultima_mensagem"].isoformat() if t["ultima_mensagem"] else None,
+                "status_conexao": status["connected"] and t["erro_ultimo"] is None,
+                "erro_ultimo": t["erro_ultimo"],
+                "mensagens": t["mensagens"],
+                "bytes": t["bytes"],
+                "taxa_mensagens_s": round(t["taxa_mensagens_s"], 2),
+                "taxa_bytes_s": round(t["taxa_bytes_s"], 2)
+            } for topico, t in sorted(topicos.items())] + [{
                 "topico": t.topico,
                 "ultima_mensagem": t.ultima_mensagem.isoformat() if t.ultima_mensagem else None,
                 "status_conexao": t.status_conexao,
-                "erro_ultimo": t.erro_ultimo
-            } for t in topics_status],
+                "erro_ultimo": t.erro_ultimo,
+                "mensagens": t.mensagens,
+                "bytes": t.bytes_recebidos,
+                "taxa_mensagens_s": 0.0,
+                "taxa_bytes_s": 0.0
+            } for t in historico],
             "devices": [{
                 "tipo": d.tipo_dispositivo,
                 "status": d.status,
@@ -1258,48 +1324,77 @@ def admin_mqtt_command():
         command = data.get("command")
         sessao_id = data.get("sessao_id")
         
-        success = False
-        
         if device_type == "irrigacao":
             if not sessao_id:
                 return jsonify({"success": False, "message": "sessao_id obrigatório para irrigação"}), 400
-            success = mqtt_client.enviar_comando_irrigacao(sessao_id, command)
+            enviar, argumentos = mqtt_client.enviar_comando_irrigacao, (sessao_id, command)
             
         elif device_type == "ventilacao":
-            success = mqtt_client.enviar_comando_ventilacao(command)
+            enviar, argumentos = mqtt_client.enviar_comando_ventilacao, (command,)
             
         elif device_type == "iluminacao":
-            success = mqtt_client.enviar_comando_iluminacao(command)
+            enviar, argumentos = mqtt_client.enviar_comando_iluminacao, (command,)
             
         else:
             return jsonify({"success": False, "message": "Tipo de dispositivo inválido"}), 400
         
-        if success:
-            # Registrar comando no banco
-            from lib.models import ComandoDispositivo
-            comando = ComandoDispositivo(
-                tipo_dispositivo=device_type,
-                comando=command,
-                sessao_id=sessao_id,
-                usuario_id=current_user.id,
-                executado=True
-            )
-            db.session.add(comando)
+        # Registrar o comando antes de publicar, para que a confirmação do dispositivo o encontre
+        from lib.models import ComandoDispositivo
+        comando = ComandoDispositivo(
+            uuid=str(uuid.uuid4()),
+            tipo_dispositivo=device_type,
+            comando=command,
+            sessao_id=sessao_id,
+            usuario_id=current_user.id,
+            executado=False,
+            estado="PENDENTE"
+        )
+        db.session.add(comando)
+        db.session.commit()
+        
+        if not enviar(*argumentos, comando_id=comando.uuid):
+            comando.estado = "FALHOU"
             db.session.commit()
-            
-            log_admin_action("Comando MQTT enviado", f"Dispositivo: {device_type}, Comando: {command}")
-            
-            return jsonify({
-                "success": True, 
-                "message": f"Comando {command} enviado para {device_type}"
-            })
-        else:
-            return jsonify({"success": False, "message": "Falha ao enviar comando"}), 500
+            return jsonify({"success": False, "message": "Falha ao enviar comando", "comando_id": comando.uuid}), 500
+        
+        log_admin_action("Comando MQTT enviado", f"Dispositivo: {device_type}, Comando: {command}")
+        
+        # A publicação não aguarda o broker: o estado é acompanhado pela rota de status do comando
+        return jsonify({
+            "success": True, 
+            "message": f"Comando {command} enviado para {device_type}",
+            "comando_id": comando.uuid,
+            "status_url": url_for("admin_mqtt_command_status", comando_id=comando.uuid)
+        }), 202
             
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+@app.route("/admin/mqtt/command/<comando_id>")
+@admin_required(4)
+def admin_mqtt_command_status(comando_id):
+    """Estado de um comando enviado (consultado pela interface até a confirmação) - Nível 4+"""
+    from lib.models import ComandoDispositivo
+    
+    comando = ComandoDispositivo.query.filter_by(uuid=comando_id).first()
+    if not comando:
+        return jsonify({"success": False, "message": "Comando não encontrado"}), 404
+    
+    return jsonify({
+        "success": True,
+        "comando_id": comando.uuid,
+        "tipo_dispositivo": comando.tipo_dispositivo,
+        "comando": comando.comando,
+        "estado": comando.estado,
+        "executado": comando.executado,
+        "tentativas": comando.tentativas,
+        "data_hora": comando.data_hora.isoformat() if comando.data_hora else None,
+        "confirmado_em": comando.confirmado_em.isoformat() if comando.confirmado_em else None,
+        "latencia_ms": comando.latencia_ms
+    })
+
+
 @app.route("/admin/mqtt/sensors")
 @admin_required(2)
 def admin_mqtt_sensors():
@@ -1308,7 +1403,10 @@ def admin_mqtt_sensors():
         from lib.models import DadoPeriodico, Sessao, Cultura
         
         # Dados mais recentes por sessão
-        dados_recentes = db.session.query(DadoPeriodico, Sessao, Cultura).join(
+        # A coluna antiga de imagem é adiada: só o teste de nulidade vai na consulta
+        dados_recentes = db.session.query(
+            DadoPeriodico, Sessao, Cultura, DadoPeriodico.imagem.isnot(None).label("imagem_legada")
+        ).join(
             Sessao, DadoPeriodico.sessao_id == Sessao.id
         ).join(
             Cultura, Sessao.cultura_id == Cultura.id
@@ -1328,8 +1426,8 @@ def admin_mqtt_sensors():
                     "nome": sessao.nome,
                     "cultura": cultura.nome
                 },
-                "imagem_disponivel": dado.imagem is not None
-            } for dado, sessao, cultura in dados_recentes]
+                "imagem_disponivel": dado.imagem_sha256 is not None or bool(imagem_legada)
+            } for dado, sessao, cultura, imagem_legada in dados_recentes]
         })
         
     except Exception as e:
@@ -1369,6 +1467,138 @@ def admin_mqtt_devices():
                          comandos_recentes=comandos_recentes)
 
 
+# ===== IMAGENS =====
+
+
+def resposta_imagem(etag, carregar, privada=False):
+    """Bytes da imagem com ETag; 304 sem ler o arquivo quando o cliente já tem esta versão"""
+    dados = None
+    if not (etag and etag in request.if_none_match):
+        dados = carregar()
+        if not dados:
+            abort(404)
+        etag = etag or hashlib.sha256(dados).hexdigest()
+    if etag in request.if_none_match:
+        resposta = Response(status=304)
+    else:
+        resposta = Response(dados, mimetype=tipo_imagem(dados))
+    resposta.set_etag(etag)
+    # O cliente guarda a imagem e revalida a cada uso: a URL de uma sessão muda de conteúdo
+    resposta.cache_control.no_cache = True
+    if privada:
+        resposta.cache_control.private = True
+    else:
+        resposta.cache_control.public = True
+    return resposta
+
+
+def usuario_da_requisicao():
+    """Usuário logado na sessão web ou pelo token Bearer do aplicativo móvel"""
+    if current_user.is_authenticated:
+        return current_user
+    token = request.headers.get("Authorization", "").replace("Bearer ", "")
+    if token:
+        sessao_mobile = SessaoUsuario.query.filter_by(token=token).first()
+        if sessao_mobile and sessao_mobile.data_expiracao >= datetime.now():
+            return Usuario.query.get(sessao_mobile.usuario_id)
+    return None
+
+
+def consultar_sessoes_painel():
+    """(sessão, cultura, último dado) de todas as sessões; cultura e último dado podem ser None"""
+    return (
+        db.session.query(Sessao, Cultura, UltimoDadoSessao)
+        .outerjoin(Cultura, Cultura.id == Sessao.cultura_id)
+        .outerjoin(UltimoDadoSessao, UltimoDadoSessao.sessao_id == Sessao.id)
+        .order_by(Sessao.id)
+        .all()
+    )
+
+
+def url_imagem_sessao(sessao_id, ultimo, tamanho=None, externa=False):
+    """URL da imagem mais recente da sessão, ou None se ela ainda não tiver imagem"""
+    if ultimo is None or ultimo.imagem_data_hora is None:
+        return None
+    return url_for("api_sessao_imagem", id=sessao_id, tamanho=tamanho, _external=externa)
+
+
+def url_foto_usuario(usuario, externa=False):
+    if not usuario.foto_sha256:
+        return None
+    # A versão na URL evita revalidações enquanto a foto não muda
+    return url_for("api_usuario_foto", id=usuario.id, v=usuario.foto_sha256[:12], _external=externa)
+
+
+@app.route("/api/sessoes/<int:id>/imagem")
+def api_sessao_imagem(id):
+    """Imagem mais recente da sessão (?tamanho=miniatura|media; padrão: original)"""
+    tamanho = request.args.get("tamanho")
+    if tamanho not in TAMANHOS_IMAGEM:
+        tamanho = None
+
+    # A mesma fonte de url_imagem_sessao: a página e o endpoint concordam sobre a imagem
+    ultimo = db.session.get(UltimoDadoSessao, id)
+    if ultimo is None or ultimo.imagem_data_hora is None:
+        abort(404)
+    if not ultimo.imagem_sha256:
+        # Linha antiga, com os bytes na coluna imagem: lida só quando pedida
+        dado = (
+            DadoPeriodico.query.filter(
+                DadoPeriodico.sessao_id == id,
+                DadoPeriodico.data_hora <= ultimo.imagem_data_hora,
+                DadoPeriodico.imagem.isnot(None),
+            )
+            .order_by(DadoPeriodico.data_hora.desc())
+            .first()
+        )
+        if dado is None:
+            abort(404)
+        return resposta_imagem(None, lambda: dado.imagem)
+
+    sha256 = ultimo.imagem_sha256
+    versao = armazem_imagens.versao(sha256, tamanho)
+    etag = f"{sha256}-{versao}" if versao else sha256
+    return resposta_imagem(etag, lambda: armazem_imagens.ler(sha256, versao))
+
+
+@app.route("/api/usuarios/<int:id>/foto")
+def api_usuario_foto(id):
+    """Foto de perfil do usuário (requer login web ou token do aplicativo)"""
+    if usuario_da_requisicao() is None:
+        return jsonify({"success": False, "message": "Não autenticado"}), 401
+
+    usuario = Usuario.query.get_or_404(id)
+    resposta = resposta_imagem(usuario.foto_sha256, lambda: usuario.foto, privada=True)
+    if request.args.get("v"):
+        # URL versionada pelo conteúdo: pode ficar em cache sem revalidar
+        resposta.cache_control.no_cache = None
+        resposta.cache_control.max_age = 31536000
+        resposta.cache_control.immutable = True
+    return resposta
+
+
+@app.route("/api/sessoes/<int:id>/historico")
+def api_sessao_historico(id):
+    """Histórico agregado da sessão (?inicio=&fim= em ISO 8601, padrão: últimas 24 h; ?resolucao=minuto|hora|dia)"""
+    if usuario_da_requisicao() is None:
+        return jsonify({"success": False, "message": "Não autenticado"}), 401
+
+    try:
+        fim = datetime.fromisoformat(request.args["fim"]) if request.args.get("fim") else datetime.now()
+        inicio = datetime.fromisoformat(request.args["inicio"]) if request.args.get("inicio") else fim - timedelta(days=1)
+    except ValueError:
+        return jsonify({"success": False, "message": "Datas devem estar no formato ISO 8601"}), 400
+    resolucao = request.args.get("resolucao")
+    if resolucao is not None and resolucao not in RESOLUCOES:
+        return jsonify({"success": False, "message": f"Resolução deve ser uma de: {', '.join(RESOLUCOES)}"}), 400
+
+    Sessao.query.get_or_404(id)
+    resolucao, serie = consultar(db.session, id, inicio, fim, resolucao)
+    for ponto in serie:
+        ponto["inicio"] = ponto["inicio"].isoformat()
+    return jsonify({"success": True, "resolucao": resolucao, "inicio": inicio.isoformat(), "fim": fim.isoformat(), "serie": serie})
+
+
 # ===== API ENDPOINTS MÓVEIS =====
 
 
@@ -1431,7 +1661,7 @@ def api_mobile_login():
                                     if usuario.grupo
                                     else None
                                 ),
-                                "foto_base64": usuario.foto_base64,
+                                "foto_url": url_foto_usuario(usuario, externa=True),
                             },
                         }
                     ),
@@ -1481,36 +1711,23 @@ def api_mobile_dashboard():
         if not sessao_mobile or sessao_mobile.data_expiracao < datetime.now():
             return jsonify({"success": False, "message": "Token inválido ou expirado"}), 401
 
+        # Tamanho da imagem pedido pelo app: miniatura (padrão), media ou original
+        tamanho_imagem = request.args.get("tamanho_imagem", "miniatura")
+        if tamanho_imagem not in TAMANHOS_IMAGEM:
+            tamanho_imagem = None
+
         # Busca dados das sessões
         sessoes_info = []
-        sessoes = Sessao.query.all()
 
-        for sessao_cultivo in sessoes:
-            # Último dado periódico da sessão
-            ultimo_dado = (
-                DadoPeriodico.query.filter_by(sessao_id=sessao_cultivo.id).order_by(DadoPeriodico.data_hora.desc()).first()
-            )
-
-            # Verifica a cultura associada
-            cultura = Cultura.query.get(sessao_cultivo.cultura_id)
-
-            # Verifica se a sessão está sendo irrigada
-            irrigacao = (
-                SessaoIrrigacao.query.filter_by(sessao_id=sessao_cultivo.id)
-                .order_by(SessaoIrrigacao.data_inicio.desc())
-                .first()
-            )
-            esta_irrigando = irrigacao.status if irrigacao else False
+        for sessao_cultivo, cultura, ultimo in consultar_sessoes_painel():
+            # Último dado periódico e estado da irrigação, de ultimo_dado_sessao
+            ultimo_dado = ultimo if ultimo and ultimo.data_hora else None
+            esta_irrigando = ultimo.esta_irrigando if ultimo else False
 
             # Cálculo de tempo de cultivo
             tempo_cultivo = None
-            if irrigacao and irrigacao.data_inicio:
-                tempo_cultivo = (datetime.now() - irrigacao.data_inicio).days
-
-            # Prepara a imagem em base64
-            imagem_base64 = None
-            if ultimo_dado and ultimo_dado.imagem:
-                imagem_base64 = base64.b64encode(ultimo_dado.imagem).decode("utf-8")
+            if ultimo and ultimo.irrigacao_inicio:
+                tempo_cultivo = (datetime.now() - ultimo.irrigacao_inicio).days
 
             sessoes_info.append(
                 {
@@ -1526,7 +1743,7 @@ def api_mobile_dashboard():
                         "umidade_solo": ultimo_dado.umidade_solo if ultimo_dado else None,
                         "data_hora": ultimo_dado.data_hora.isoformat() if ultimo_dado else None,
                     },
-                    "imagem_base64": imagem_base64,
+                    "imagem_url": url_imagem_sessao(sessao_cultivo.id, ultimo_dado, tamanho_imagem, externa=True),
                 }
             )
 
@@ -1610,7 +1827,7 @@ def api_mobile_usuarios():
                         "nome": user.grupo.nome if user.grupo else None,
                         "nivel_acesso": user.grupo.nivel_acesso if user.grupo else None,
                     },
-                    "foto_base64": user.foto_base64,
+                    "foto_url": url_foto_usuario(user, externa=True),
                     "tem_senha": bool(user.senha),
                 }
             )
@@ -1706,7 +1923,7 @@ def api_mobile_perfil():
                 "nome": usuario.grupo.nome if usuario.grupo else None,
                 "nivel_acesso": usuario.grupo.nivel_acesso if usuario.grupo else None,
             },
-            "foto_base64": usuario.foto_base64,
+            "foto_url": url_foto_usuario(usuario, externa=True),
             "data_criacao": (
                 usuario.data_criacao.isoformat() if hasattr(usuario, "data_criacao") and usuario.data_criacao else None
             ),
@@ -1719,5 +1936,188 @@ def api_mobile_perfil():
         return jsonify({"success": False, "message": "Erro interno do servidor"}), 500
 
 
+@app.route("/api/mobile/notificacoes", methods=["GET"])
+def api_mobile_notificacoes():
+    """Endpoint da caixa de notificações para aplicativo móvel"""
+    try:
+        # Verifica autenticação
+        token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not token:
+            return jsonify({"success": False, "message": "Token não fornecido"}), 401
+
+        sessao_mobile = SessaoUsuario.query.filter_by(token=token).first()
+        if not sessao_mobile or sessao_mobile.data_expiracao < datetime.now():
+            return jsonify({"success": False, "message": "Token inválido ou expirado"}), 401
+
+        usuario = Usuario.query.get(sessao_mobile.usuario_id)
+        if not usuario:
+            return jsonify({"success": False, "message": "Usuário não encontrado"}), 404
+
+        limite = min(request.args.get("limite", 50, type=int), 200)
+        consulta = NotificacaoUsuario.query.filter_by(usuario_id=usuario.id)
+        if request.args.get("nao_lidas") == "1":
+            consulta = consulta.filter_by(lida=False)
+        entregas = consulta.order_by(NotificacaoUsuario.id.desc()).limit(limite).all()
+
+        notificacoes = [
+            {
+                "id": entrega.notificacao.id,
+                "titulo": entrega.notificacao.titulo,
+                "mensagem": entrega.notificacao.mensagem,
+                "data_hora": entrega.notificacao.data_hora.isoformat() if entrega.notificacao.data_hora else None,
+                "lida": entrega.lida,
+            }
+            for entrega in entregas
+        ]
+
+        # Contador desnormalizado: sem COUNT sobre notificacao_usuario
+        return jsonify(
+            {"success": True, "nao_lidas": usuario.notificacoes_nao_lidas, "notificacoes": notificacoes}
+        ), 200
+
+    except Exception as e:
+        print(f"Erro nas notificações móveis: {e}")
+        return jsonify({"success": False, "message": "Erro interno do servidor"}), 500
+
+
+@app.route("/api/mobile/notificacoes/lidas", methods=["POST"])
+def api_mobile_notificacoes_lidas():
+    """Marca como lidas as notificações do usuário (todas ou as informadas em ids)"""
+    try:
+        # Verifica autenticação
+        token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not token:
+            return jsonify({"success": False, "message": "Token não fornecido"}), 401
+
+        sessao_mobile = SessaoUsuario.query.filter_by(token=token).first()
+        if not sessao_mobile or sessao_mobile.data_expiracao < datetime.now():
+            return jsonify({"success": False, "message": "Token inválido ou expirado"}), 401
+
+        data = request.get_json(silent=True) or {}
+        lidas = marcar_lidas(db.session, sessao_mobile.usuario_id, data.get("ids"))
+        db.session.commit()
+        return jsonify({"success": True, "lidas": lidas}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao marcar notificações móveis: {e}")
+        return jsonify({"success": False, "message": "Erro interno do servidor"}), 500
+
+
+@app.route("/api/mobile/sessoes/<int:id>/interesse", methods=["POST", "DELETE"])
+def api_mobile_interesse_sessao(id):
+    """Inscreve (POST) ou remove (DELETE) o usuário dos alertas de uma sessão"""
+    try:
+        # Verifica autenticação
+        token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if not token:
+            return jsonify({"success": False, "message": "Token não fornecido"}), 401
+
+        sessao_mobile = SessaoUsuario.query.filter_by(token=token).first()
+        if not sessao_mobile or sessao_mobile.data_expiracao < datetime.now():
+            return jsonify({"success": False, "message": "Token inválido ou expirado"}), 401
+
+        if not Sessao.query.get(id):
+            return jsonify({"success": False, "message": "Sessão não encontrada"}), 404
+
+        interesse = InteresseSessao.query.filter_by(sessao_id=id, usuario_id=sessao_mobile.usuario_id).first()
+        if request.method == "POST" and not interesse:
+            db.session.add(InteresseSessao(sessao_id=id, usuario_id=sessao_mobile.usuario_id))
+        elif request.method == "DELETE" and interesse:
+            db.session.delete(interesse)
+        db.session.commit()
+
+        return jsonify({"success": True, "interessado": request.method == "POST"}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro no interesse da sessão: {e}")
+        return jsonify({"success": False, "message": "Erro interno do servidor"}), 500
+
+
+@app.cli.command("migrar-imagens")
+def migrar_imagens():
+    """Move as imagens gravadas em dado_periodico.imagem para o armazenamento em disco"""
+    total = armazem_imagens.migrar_coluna(db.session)
+    print(f"{total} imagens migradas para {armazem_imagens.diretorio}")
+
+    # Fotos de perfil gravadas antes de usuario.foto_sha256
+    usuarios = Usuario.query.filter(Usuario.foto.isnot(None), Usuario.foto_sha256.is_(None)).all()
+    for usuario in usuarios:
+        usuario.foto_sha256 = hashlib.sha256(usuario.foto).hexdigest()
+    db.session.commit()
+    print(f"{len(usuarios)} fotos de perfil com ETag calculado")
+
+
+@app.cli.command("recalcular-agregados")
+@click.option("--desde", type=click.DateTime(), help="Data inicial (padrão: desde o último minuto agregado)")
+@click.option("--ate", type=click.DateTime(), help="Data final (padrão: até a leitura mais recente)")
+def recalcular_agregados(desde, ate):
+    """Refaz agregado_leitura a partir de dado_periodico (após uma parada ou carga manual)"""
+    agregador = AgregadorLeituras()
+    if desde is None and ate is None:
+        lidas = agregador.recuperar(db.session)
+    else:
+        lidas = agregador.recalcular(db.session, desde or datetime.min, ate)
+    db.session.commit()
+    print(f"{lidas} leituras agregadas")
+
+
+@app.cli.command("recalcular-ultimos")
+def recalcular_ultimos():
+    """Refaz ultimo_dado_sessao a partir de dado_periodico e sessao_irrigacao (após uma carga manual)"""
+    sessoes = recalcular_ultimos_dados(db.session.connection())
+    db.session.commit()
+    print(f"Último dado de {sessoes} sessões recalculado")
+
+
+@app.cli.command("particionar-dados")
+@click.option("--manter-antiga", is_flag=True, help="Mantém a tabela original como dado_periodico_antigo")
+def particionar_dados(manter_antiga):
+    """Converte dado_periodico em tabela particionada por mês (PostgreSQL) e cria as partições futuras"""
+    if db.session.get_bind().dialect.name != "postgresql":
+        print("O particionamento de dado_periodico requer PostgreSQL")
+        return
+    retencao = MotorRetencao([], arquivo=ArquivoColunar() if ARQUIVO_ANTES_RETENCAO else None)
+    particoes = GerenciadorParticoes(preparar=retencao.preparar_remocao, tempo_max_s=float("inf"))
+    if not particoes.particionada(db.session):
+        copiadas = particoes.converter(db.session, manter_antiga=manter_antiga)
+        print(f"{copiadas} leituras copiadas para dado_periodico particionada")
+    resultado = particoes.manter(db.session)
+    db.session.commit()
+    criadas, expiradas = resultado["criadas"], list(resultado["expiradas"])
+    # Cada execução expira uma partição
+    while resultado["expiradas"]:
+        resultado = particoes.manter(db.session)
+        db.session.commit()
+        expiradas += resultado["expiradas"]
+    print(f"Partições criadas: {len(criadas)}, expiradas ({resultado['acao']}): {len(expiradas)}")
+
+
+@app.cli.command("aplicar-retencao")
+@click.option("--politicas", default=RETENCAO_POLITICAS, help="Políticas no formato de RETENCAO_POLITICAS")
+def aplicar_retencao(politicas):
+    """Remove as linhas antigas conforme as políticas de retenção, sem limite de tempo"""
+    motor = MotorRetencao(
+        ler_politicas(politicas), tempo_max_s=float("inf"), arquivo=ArquivoColunar() if ARQUIVO_ANTES_RETENCAO else None
+    )
+    relatorio = motor.executar(db.session)
+    for resultado in relatorio["politicas"]:
+        print(f"{resultado['politica']}: {resultado['removidas']} linhas removidas em {resultado['segundos']}s")
+    print(f"Total: {relatorio['removidas']} linhas em {relatorio['segundos']}s")
+
+
+@app.cli.command("arquivar-dados")
+@click.option("--ate", type=click.DateTime(), help="Arquiva os meses fechados com leituras antes desta data")
+@click.option("--substituir", is_flag=True, help="Exporta de novo os meses já arquivados")
+def arquivar_dados(ate, substituir):
+    """Exporta dado_periodico por sessão e mês para o arquivo colunar (.npy)"""
+    arquivo = ArquivoColunar()
+    exportados = arquivo.exportar_pendentes(db.session, ate=ate, substituir=substituir)
+    for (sessao_id, mes), linhas in sorted(exportados.items()):
+        print(f"Sessão {sessao_id}, {mes}: {linhas} leituras")
+    print(f"{len(exportados)} meses arquivados em {arquivo.diretorio}")
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
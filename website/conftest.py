@@ -204,3 +204,22 @@ def fertilizante_teste(db_session, unidade_medida_teste):
 def dados_completos(db_session, cultura_teste, fertilizante_teste, unidade_medida_teste):
     """Conjunto completo de dados para testes de integração."""
     return {"cultura": cultura_teste, "fertilizante": fertilizante_teste, "unidade_medida": unidade_medida_teste}
+
+
+@pytest.fixture
+def cliente_mqtt(app, tmp_path):
+    """MQTTClient com o cliente paho substituído por um mock."""
+    from unittest.mock import patch
+
+    with patch("paho.mqtt.client.Client"):
+        from lib.imagens import ArmazemImagens
+        from lib.miniaturas import GeradorMiniaturas
+        from lib.mqtt_new import MQTTClient
+        from lib.spool import SpoolIngestao
+
+        client = MQTTClient()
+        client.app = app
+        client.imagens = ArmazemImagens(str(tmp_path / "imagens"))
+        client.miniaturas = GeradorMiniaturas(client.imagens)
+        client.spool = SpoolIngestao(str(tmp_path / "ingestao.spool"), tamanho_mb=1)
+        yield client
@@ -7,7 +7,8 @@ CREATE TABLE cultura (
 CREATE TABLE sessao (
     id SERIAL PRIMARY KEY,
     nome VARCHAR NOT NULL,
-    cultura_id INTEGER REFERENCES cultura(id) ON DELETE CASCADE
+    cultura_id INTEGER REFERENCES cultura(id) ON DELETE CASCADE,
+    ativa BOOLEAN NOT NULL DEFAULT TRUE -- Sessões inativas não recebem leituras dos sensores
 );
 
 CREATE TABLE sessao_irrigacao (
@@ -18,18 +19,81 @@ CREATE TABLE sessao_irrigacao (
     sessao_id INTEGER REFERENCES sessao(id) ON DELETE CASCADE
 );
 
+-- Particionada por mês em data_hora; as partições mensais são criadas e expiradas
+-- pelo cliente MQTT (lib/particoes.py)
 CREATE TABLE dado_periodico (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     data_hora TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     temperatura FLOAT NOT NULL,
     umidade_ar FLOAT NOT NULL,
     umidade_solo FLOAT NOT NULL,
     imagem BYTEA,
+    imagem_sha256 VARCHAR(64),
     cultura_id INTEGER REFERENCES cultura(id) ON DELETE CASCADE,
     sessao_id INTEGER REFERENCES sessao(id) ON DELETE CASCADE,
-    exaustor_ligado BOOLEAN NOT NULL
+    exaustor_ligado BOOLEAN NOT NULL,
+    PRIMARY KEY (id, data_hora) -- A chave de uma tabela particionada inclui a coluna de partição
+) PARTITION BY RANGE (data_hora);
+
+-- Leituras fora das partições mensais, movidas quando o mês ganha sua partição
+CREATE TABLE dado_periodico_padrao PARTITION OF dado_periodico DEFAULT;
+
+-- Agregados das leituras por minuto, hora e dia (lib/agregados.py)
+CREATE TABLE agregado_leitura (
+    id SERIAL PRIMARY KEY,
+    sessao_id INTEGER REFERENCES sessao(id) ON DELETE CASCADE,
+    resolucao VARCHAR(6) NOT NULL, -- 'minuto', 'hora' ou 'dia'
+    inicio TIMESTAMP NOT NULL,
+    contagem INTEGER NOT NULL,
+    ultima_data_hora TIMESTAMP NOT NULL,
+    temperatura_min FLOAT NOT NULL,
+    temperatura_max FLOAT NOT NULL,
+    temperatura_soma FLOAT NOT NULL,
+    temperatura_ultimo FLOAT NOT NULL,
+    umidade_ar_min FLOAT NOT NULL,
+    umidade_ar_max FLOAT NOT NULL,
+    umidade_ar_soma FLOAT NOT NULL,
+    umidade_ar_ultimo FLOAT NOT NULL,
+    umidade_solo_min FLOAT NOT NULL,
+    umidade_solo_max FLOAT NOT NULL,
+    umidade_solo_soma FLOAT NOT NULL,
+    umidade_solo_ultimo FLOAT NOT NULL,
+    UNIQUE (sessao_id, resolucao, inicio)
+);
+
+-- Última leitura de cada sessão, atualizada a cada gravação (lib/ultimos.py)
+CREATE TABLE ultimo_dado_sessao (
+    sessao_id INTEGER PRIMARY KEY REFERENCES sessao(id) ON DELETE CASCADE,
+    data_hora TIMESTAMP,
+    temperatura FLOAT,
+    umidade_ar FLOAT,
+    umidade_solo FLOAT,
+    exaustor_ligado BOOLEAN,
+    imagem_sha256 VARCHAR(64),
+    imagem_data_hora TIMESTAMP,
+    esta_irrigando BOOLEAN NOT NULL DEFAULT FALSE,
+    irrigacao_inicio TIMESTAMP
 );
 
+-- Estado da irrigação gravado fora da aplicação chega a ultimo_dado_sessao
+CREATE FUNCTION atualizar_irrigacao_ultimo_dado() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO ultimo_dado_sessao (sessao_id, esta_irrigando, irrigacao_inicio)
+    SELECT sessao_id, "status", data_inicio FROM sessao_irrigacao
+    WHERE sessao_id = NEW.sessao_id
+    -- Mesma ordem de lib/ultimos.py: data_inicio nulo é a mais antiga
+    ORDER BY data_inicio DESC NULLS LAST, id DESC
+    LIMIT 1
+    ON CONFLICT (sessao_id) DO UPDATE
+    SET esta_irrigando = EXCLUDED.esta_irrigando, irrigacao_inicio = EXCLUDED.irrigacao_inicio;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_sessao_irrigacao_ultimo_dado
+AFTER INSERT OR UPDATE ON sessao_irrigacao
+FOR EACH ROW EXECUTE FUNCTION atualizar_irrigacao_ultimo_dado();
+
 CREATE TABLE condicao_ideal (
     id SERIAL PRIMARY KEY,
     temperatura_min FLOAT NOT NULL,
@@ -88,7 +152,9 @@ CREATE TABLE usuario (
     email TEXT NOT NULL UNIQUE,
     senha TEXT,
     foto BYTEA,
-    token_recuperacao TEXT
+    foto_sha256 VARCHAR(64), -- ETag da foto em /api/usuarios/<id>/foto
+    token_recuperacao TEXT,
+    notificacoes_nao_lidas INTEGER NOT NULL DEFAULT 0 -- Contador desnormalizado de notificacao_usuario não lidas
 );
 
 CREATE TABLE log (
@@ -133,7 +199,18 @@ CREATE TABLE notificacao (
 CREATE TABLE notificacao_usuario (
     id SERIAL PRIMARY KEY,
     notificacao_id INTEGER REFERENCES notificacao(id) ON DELETE CASCADE,
-    usuario_id INTEGER REFERENCES usuario(id) ON DELETE CASCADE
+    usuario_id INTEGER REFERENCES usuario(id) ON DELETE CASCADE,
+    lida BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE INDEX idx_notificacao_usuario_usuario_lida ON notificacao_usuario(usuario_id, lida);
+
+-- Usuários que recebem os alertas de uma sessão independentemente do nível de acesso
+CREATE TABLE interesse_sessao (
+    id SERIAL PRIMARY KEY,
+    usuario_id INTEGER REFERENCES usuario(id) ON DELETE CASCADE,
+    sessao_id INTEGER REFERENCES sessao(id) ON DELETE CASCADE,
+    UNIQUE (sessao_id, usuario_id)
 );
 
 --* Dados Iniciais *--
@@ -168,7 +245,12 @@ CREATE TABLE comando_dispositivo (
     data_hora TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     sessao_id INTEGER REFERENCES sessao(id) ON DELETE SET NULL, -- Para irrigacao
     usuario_id INTEGER REFERENCES usuario(id) ON DELETE CASCADE NOT NULL, -- Quem enviou o comando
-    executado BOOLEAN DEFAULT FALSE -- Se o comando foi executado com sucesso
+    executado BOOLEAN DEFAULT FALSE, -- Se o comando foi executado com sucesso
+    uuid VARCHAR(36) UNIQUE, -- comando_id enviado no payload
+    estado VARCHAR NOT NULL DEFAULT 'PENDENTE', -- 'PENDENTE', 'CONFIRMADO', 'EXPIRADO', 'FALHOU'
+    tentativas INTEGER NOT NULL DEFAULT 1,
+    confirmado_em TIMESTAMP,
+    latencia_ms REAL -- Tempo entre o envio e o status do dispositivo
 );
 
 CREATE TABLE status_mqtt (
@@ -176,11 +258,26 @@ CREATE TABLE status_mqtt (
     topico VARCHAR NOT NULL, -- Tópico MQTT
     ultima_mensagem TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     status_conexao BOOLEAN DEFAULT FALSE, -- Se o tópico está ativo
-    erro_ultimo VARCHAR -- Último erro registrado para este tópico
+    erro_ultimo VARCHAR, -- Último erro registrado para este tópico
+    mensagens BIGINT NOT NULL DEFAULT 0, -- Total de mensagens recebidas
+    bytes_recebidos BIGINT NOT NULL DEFAULT 0 -- Total de bytes recebidos
+);
+
+CREATE TABLE mensagem_recebida (
+    id SERIAL PRIMARY KEY,
+    particao INTEGER NOT NULL DEFAULT 0, -- Worker no modo de assinatura compartilhada
+    dispositivo VARCHAR(100) NOT NULL,
+    mensagem VARCHAR(100) NOT NULL, -- msg_id ou seq enviado pelo dispositivo
+    recebida_em TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (particao, dispositivo, mensagem)
 );
 
 -- Índices para otimização das consultas MQTT
 CREATE INDEX idx_status_dispositivo_tipo_data ON status_dispositivo(tipo_dispositivo, data_hora DESC);
 CREATE INDEX idx_comando_dispositivo_usuario_data ON comando_dispositivo(usuario_id, data_hora DESC);
 CREATE INDEX idx_status_mqtt_topico ON status_mqtt(topico);
+CREATE INDEX idx_mensagem_recebida_recebida_em ON mensagem_recebida(recebida_em);
 CREATE INDEX idx_dado_periodico_sessao_data ON dado_periodico(sessao_id, data_hora DESC);
+CREATE INDEX idx_sessao_irrigacao_sessao_inicio ON sessao_irrigacao(sessao_id, data_inicio DESC NULLS LAST);
+CREATE INDEX idx_dado_periodico_data_brin ON dado_periodico USING brin (data_hora);
+CREATE INDEX idx_agregado_leitura_resolucao_inicio ON agregado_leitura(resolucao, inicio);
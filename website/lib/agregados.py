@@ -0,0 +1,323 @@
+"""
+Agregados das leituras por sessão em resolução de minuto, hora e dia.
+
+Cada linha de agregado_leitura guarda, para um intervalo, a contagem e o mínimo, máximo,
+soma e último valor de temperatura, umidade do ar e umidade do solo. A ingestão soma as
+linhas de cada lote aos intervalos com um único upsert por tabela; recalcular() refaz um
+período a partir de dado_periodico (após uma parada ou gravações fora da ingestão).
+
+No PostgreSQL os upserts da ingestão e os recálculos usam uma trava consultiva (compartilhada
+e exclusiva): com vários workers (assinatura compartilhada), um recálculo nunca apaga
+intervalos enquanto outro worker soma um lote a eles.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from os import getenv
+
+from sqlalchemy import case, func, select, text
+
+CAMPOS_AGREGADOS = ("temperatura", "umidade_ar", "umidade_solo")
+
+# Início do intervalo que contém data_hora em cada resolução
+RESOLUCOES = {
+    "minuto": lambda data_hora: data_hora.replace(second=0, microsecond=0),
+    "hora": lambda data_hora: data_hora.replace(minute=0, second=0, microsecond=0),
+    "dia": lambda data_hora: data_hora.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+# Truncamento de data_hora para o início do intervalo no PostgreSQL e no SQLite
+TRUNCAMENTOS = {"minuto": "minute", "hora": "hour", "dia": "day"}
+FORMATOS_SQLITE = {"minuto": "%Y-%m-%d %H:%M:00", "hora": "%Y-%m-%d %H:00:00", "dia": "%Y-%m-%d 00:00:00"}
+# Duração de cada resolução, usada para escolher a resolução de uma consulta
+DURACOES = {"minuto": timedelta(minutes=1), "hora": timedelta(hours=1), "dia": timedelta(days=1)}
+# Pontos máximos devolvidos por consultar() quando a resolução não é informada
+AGREGADOS_MAX_PONTOS = int(getenv("AGREGADOS_MAX_PONTOS", 1500))
+# Dias recalculados por transação ao recuperar os agregados após uma parada
+AGREGADOS_RECUPERACAO_DIAS = int(getenv("AGREGADOS_RECUPERACAO_DIAS", 1))
+# Chave da trava consultiva de agregado_leitura no PostgreSQL
+TRAVA_AGREGADOS = 5_349_021
+
+
+def _upsert(session, modelo):
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+    else:
+        from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+    return insert_dialeto(modelo)
+
+
+def travar(session, exclusiva=False):
+    """Trava consultiva de agregado_leitura até o fim da transação (só no PostgreSQL)"""
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    funcao = "pg_advisory_xact_lock" if exclusiva else "pg_advisory_xact_lock_shared"
+    session.execute(text(f"SELECT {funcao}(:chave)"), {"chave": TRAVA_AGREGADOS})
+
+
+def _inicio_intervalo(session, resolucao, coluna):
+    """Expressão do início do intervalo de coluna na resolução, no dialeto do banco"""
+    if session.get_bind().dialect.name == "postgresql":
+        return func.date_trunc(TRUNCAMENTOS[resolucao], coluna)
+    return func.strftime(FORMATOS_SQLITE[resolucao], coluna)
+
+
+def intervalos_sem_resumo(session, resolucao, ate):
+    """Inícios dos intervalos com leituras antes de ate cujo agregado falta ou tem menos leituras
+
+    Um agregado com contagem maior que as leituras brutas é de um intervalo que já perdeu
+    leituras para a retenção, e continua valendo.
+    """
+    from lib.models import AgregadoLeitura, DadoPeriodico
+
+    inicio = _inicio_intervalo(session, resolucao, DadoPeriodico.data_hora)
+    brutas = {}
+    for sessao_id, intervalo, contagem in session.execute(
+        select(DadoPeriodico.sessao_id, inicio, func.count())
+        .where(DadoPeriodico.data_hora < ate)
+        .group_by(DadoPeriodico.sessao_id, inicio)
+    ):
+        if isinstance(intervalo, str):
+            intervalo = datetime.fromisoformat(intervalo)
+        brutas[(sessao_id, intervalo)] = contagem
+    if not brutas:
+        return []
+
+    agregados = session.execute(
+        select(AgregadoLeitura.sessao_id, AgregadoLeitura.inicio, AgregadoLeitura.contagem).where(
+            AgregadoLeitura.resolucao == resolucao,
+            AgregadoLeitura.inicio >= min(intervalo for _, intervalo in brutas),
+            AgregadoLeitura.inicio < ate,
+        )
+    )
+    contagens = {(sessao_id, intervalo): contagem for sessao_id, intervalo, contagem in agregados}
+    return sorted({chave[1] for chave, contagem in brutas.items() if contagens.get(chave, 0) < contagem})
+
+
+class _Acumulador:
+    __slots__ = ("contagem", "minimos", "maximos", "somas", "ultimos", "ultima_data_hora")
+
+    def __init__(self):
+        self.contagem = 0
+        self.minimos = {}
+        self.maximos = {}
+        self.somas = dict.fromkeys(CAMPOS_AGREGADOS, 0.0)
+        self.ultimos = {}
+        self.ultima_data_hora = None
+
+    def adicionar(self, data_hora, valores):
+        self.contagem += 1
+        for campo in CAMPOS_AGREGADOS:
+            valor = valores[campo]
+            self.minimos[campo] = min(self.minimos.get(campo, valor), valor)
+            self.maximos[campo] = max(self.maximos.get(campo, valor), valor)
+            self.somas[campo] += valor
+        if self.ultima_data_hora is None or data_hora >= self.ultima_data_hora:
+            self.ultima_data_hora = data_hora
+            self.ultimos = {campo: valores[campo] for campo in CAMPOS_AGREGADOS}
+
+    def linha(self, sessao_id, resolucao, inicio):
+        linha = {
+            "sessao_id": sessao_id,
+            "resolucao": resolucao,
+            "inicio": inicio,
+            "contagem": self.contagem,
+            "ultima_data_hora": self.ultima_data_hora,
+        }
+        for campo in CAMPOS_AGREGADOS:
+            linha[f"{campo}_min"] = self.minimos[campo]
+            linha[f"{campo}_max"] = self.maximos[campo]
+            linha[f"{campo}_soma"] = self.somas[campo]
+            linha[f"{campo}_ultimo"] = self.ultimos[campo]
+        return linha
+
+
+def agregar(leituras, resolucoes=tuple(RESOLUCOES)):
+    """Linhas de agregado_leitura a partir de dicts com sessao_id, data_hora e os campos"""
+    acumuladores = {}
+    for leitura in leituras:
+        data_hora = leitura.get("data_hora") or datetime.now()
+        for resolucao in resolucoes:
+            chave = (leitura["sessao_id"], resolucao, RESOLUCOES[resolucao](data_hora))
+            acumulador = acumuladores.get(chave)
+            if acumulador is None:
+                acumulador = acumuladores[chave] = _Acumulador()
+            acumulador.adicionar(data_hora, leitura)
+    return [acumulador.linha(*chave) for chave, acumulador in acumuladores.items()]
+
+
+class AgregadorLeituras:
+    """Mantém agregado_leitura a partir das leituras gravadas pela ingestão"""
+
+    def __init__(self, resolucoes=tuple(RESOLUCOES)):
+        self.resolucoes = tuple(resolucoes)
+
+        # Métricas expostas em status()
+        self.leituras = 0
+        self.linhas = 0
+        self.recalculos = 0
+
+    def registrar(self, session, leituras):
+        """Soma as leituras de um lote aos agregados, na transação do lote; retorna as linhas afetadas"""
+        from lib.models import AgregadoLeitura
+
+        linhas = agregar(leituras, self.resolucoes)
+        if not linhas:
+            return 0
+        # Antes das leituras do lote: um recálculo concorrente espera o commit e já as vê
+        travar(session)
+        instrucao = _upsert(session, AgregadoLeitura)
+        novo = instrucao.excluded
+        tabela = AgregadoLeitura.__table__.c
+        mais_recente = novo.ultima_data_hora >= tabela.ultima_data_hora
+        valores = {
+            "contagem": tabela.contagem + novo.contagem,
+            "ultima_data_hora": case((mais_recente, novo.ultima_data_hora), else_=tabela.ultima_data_hora),
+        }
+        for campo in CAMPOS_AGREGADOS:
+            minimo, maximo = f"{campo}_min", f"{campo}_max"
+            valores[minimo] = case((novo[minimo] < tabela[minimo], novo[minimo]), else_=tabela[minimo])
+            valores[maximo] = case((novo[maximo] > tabela[maximo], novo[maximo]), else_=tabela[maximo])
+            valores[f"{campo}_soma"] = tabela[f"{campo}_soma"] + novo[f"{campo}_soma"]
+            valores[f"{campo}_ultimo"] = case((mais_recente, novo[f"{campo}_ultimo"]), else_=tabela[f"{campo}_ultimo"])
+        session.execute(
+            instrucao.on_conflict_do_update(index_elements=["sessao_id", "resolucao", "inicio"], set_=valores),
+            linhas,
+        )
+        self.leituras += len(leituras)
+        self.linhas += len(linhas)
+        return len(linhas)
+
+    def recalcular(self, session, desde, ate=None, lote=5000):
+        """Refaz os agregados a partir de dado_periodico desde o início do dia de desde
+
+        Retorna quantas leituras foram lidas. Só os intervalos com leituras brutas são
+        substituídos, então a operação pode ser repetida sem contar leituras em dobro e os
+        agregados de leituras já removidas pela retenção são mantidos. No intervalo da
+        leitura bruta mais antiga, que pode ter perdido leituras para a retenção, o agregado
+        existente prevalece quando tem mais leituras que as brutas.
+        """
+        from lib.models import AgregadoLeitura, DadoPeriodico
+
+        # Espera os lotes em andamento; novos lotes esperam o commit do recálculo
+        travar(session, exclusiva=True)
+        desde = RESOLUCOES["dia"](desde)
+        mais_antiga = session.scalar(select(func.min(DadoPeriodico.data_hora)))
+        if mais_antiga is None:
+            return 0
+        consulta = (
+            select(DadoPeriodico.sessao_id, DadoPeriodico.data_hora, *[getattr(DadoPeriodico, c) for c in CAMPOS_AGREGADOS])
+            .where(DadoPeriodico.data_hora >= desde)
+            .order_by(DadoPeriodico.data_hora)
+            .execution_options(yield_per=lote)
+        )
+        if ate is not None:
+            ate = RESOLUCOES["dia"](ate) + DURACOES["dia"]
+            consulta = consulta.where(DadoPeriodico.data_hora < ate)
+
+        lidas = 0
+
+        def leituras():
+            nonlocal lidas
+            for linha in session.execute(consulta):
+                lidas += 1
+                yield linha._asdict()
+
+        linhas = agregar(leituras(), self.resolucoes)
+
+        # Intervalos que começam antes da leitura mais antiga: podem estar incompletos
+        parciais = {}
+        for resolucao in self.resolucoes:
+            inicio = RESOLUCOES[resolucao](mais_antiga)
+            if desde <= inicio < mais_antiga:
+                existentes = session.execute(
+                    select(AgregadoLeitura.sessao_id, AgregadoLeitura.contagem).where(
+                        AgregadoLeitura.resolucao == resolucao, AgregadoLeitura.inicio == inicio
+                    )
+                )
+                parciais.update({(sessao_id, resolucao, inicio): contagem for sessao_id, contagem in existentes})
+        linhas = [
+            linha
+            for linha in linhas
+            if parciais.get((linha["sessao_id"], linha["resolucao"], linha["inicio"]), 0) <= linha["contagem"]
+        ]
+
+        instrucao = _upsert(session, AgregadoLeitura)
+        chave = ("sessao_id", "resolucao", "inicio")
+        valores = {coluna: instrucao.excluded[coluna] for coluna in linhas[0] if coluna not in chave} if linhas else {}
+        for inicio in range(0, len(linhas), lote):
+            session.execute(
+                instrucao.on_conflict_do_update(index_elements=list(chave), set_=valores), linhas[inicio : inicio + lote]
+            )
+        self.recalculos += 1
+        logging.info(f"Agregados recalculados desde {desde:%Y-%m-%d}: {lidas} leituras, {len(linhas)} intervalos")
+        return lidas
+
+    def recuperar(self, session, dias=AGREGADOS_RECUPERACAO_DIAS, agora=None):
+        """Recalcula o período desde o último minuto agregado após uma parada, qualquer que seja a duração
+
+        Sem agregados, começa pela leitura mais antiga. O período é refeito em etapas de dias
+        dias, cada uma na sua transação; retorna quantas leituras foram lidas.
+        """
+        from lib.models import AgregadoLeitura, DadoPeriodico
+
+        ultimo = session.scalar(select(func.max(AgregadoLeitura.inicio)).where(AgregadoLeitura.resolucao == "minuto"))
+        if ultimo is None:
+            ultimo = session.scalar(select(func.min(DadoPeriodico.data_hora)))
+            if ultimo is None:
+                return 0
+        hoje = RESOLUCOES["dia"](agora or datetime.now())
+        etapa = DURACOES["dia"] * max(dias, 1)
+        inicio, lidas = RESOLUCOES["dia"](ultimo), 0
+        while True:
+            fim = inicio + etapa
+            # A última etapa vai até a leitura mais recente, inclusive as com data futura
+            lidas += self.recalcular(session, inicio, fim - DURACOES["dia"] if fim <= hoje else None)
+            session.commit()
+            if fim > hoje:
+                return lidas
+            inicio = fim
+
+    def status(self):
+        return {
+            "resolucoes": list(self.resolucoes),
+            "leituras": self.leituras,
+            "linhas": self.linhas,
+            "recalculos": self.recalculos,
+        }
+
+
+def escolher_resolucao(inicio, fim, max_pontos=AGREGADOS_MAX_PONTOS):
+    """Resolução mais fina que mantém o período em até max_pontos intervalos"""
+    for resolucao in ("minuto", "hora"):
+        if (fim - inicio) / DURACOES[resolucao] <= max_pontos:
+            return resolucao
+    return "dia"
+
+
+def consultar(session, sessao_id, inicio, fim, resolucao=None):
+    """Série da sessão no período: dicts com inicio, contagem e mínimo/máximo/média/último de cada campo"""
+    from lib.models import AgregadoLeitura
+
+    resolucao = resolucao or escolher_resolucao(inicio, fim)
+    linhas = session.scalars(
+        select(AgregadoLeitura)
+        .where(
+            AgregadoLeitura.sessao_id == sessao_id,
+            AgregadoLeitura.resolucao == resolucao,
+            AgregadoLeitura.inicio >= RESOLUCOES[resolucao](inicio),
+            AgregadoLeitura.inicio < fim,
+        )
+        .order_by(AgregadoLeitura.inicio)
+    ).all()
+    serie = []
+    for linha in linhas:
+        ponto = {"inicio": linha.inicio, "contagem": linha.contagem}
+        for campo in CAMPOS_AGREGADOS:
+            ponto[campo] = {
+                "min": getattr(linha, f"{campo}_min"),
+                "max": getattr(linha, f"{campo}_max"),
+                "media": getattr(linha, f"{campo}_soma") / linha.contagem,
+                "ultimo": getattr(linha, f"{campo}_ultimo"),
+            }
+        serie.append(ponto)
+    return resolucao, serie
@@ -0,0 +1,217 @@
+"""
+Arquivo colunar do histórico de dado_periodico para análises.
+
+Cada sessão e mês vira o diretório <ARQUIVO_DIR>/sessao_<id>/<AAAA-MM>/, com um .npy por
+coluna (data_hora em datetime64[us] e os sensores em float64, ordenados por data_hora) e
+um meta.json. Os arquivos são abertos com mmap: ler_mes() devolve os arrays sem cópia e
+análises de anos de dados não passam pelo banco. Requer numpy (já instalado com o
+scikit-learn e o OpenCV); sem ele o arquivo fica indisponível.
+"""
+
+import json
+import logging
+import os
+import shutil
+from datetime import date, datetime
+from os import getenv
+
+from sqlalchemy import and_, func, select
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - dependência opcional
+    numpy = None
+
+from lib.agregados import CAMPOS_AGREGADOS
+from lib.particoes import somar_meses
+
+# Diretório do arquivo colunar (relativo ao diretório de execução)
+ARQUIVO_DIR = getenv("ARQUIVO_DIR", "arquivo")
+# Linhas lidas do banco por vez ao exportar
+ARQUIVO_LOTE = int(getenv("ARQUIVO_LOTE", 10000))
+# Exporta os meses antes de a retenção remover as leituras brutas (lib/retencao.py)
+ARQUIVO_ANTES_RETENCAO = getenv("ARQUIVO_ANTES_RETENCAO", "true").lower() not in ("0", "false", "no")
+
+COLUNAS_ARQUIVO = ("data_hora", *CAMPOS_AGREGADOS)
+TIPOS_COLUNAS = {"data_hora": "datetime64[us]", **dict.fromkeys(CAMPOS_AGREGADOS, "float64")}
+
+
+def _inicio_mes(mes):
+    return datetime(mes.year, mes.month, 1)
+
+
+def _mes_texto(session, coluna):
+    """Expressão AAAA-MM da coluna no dialeto do banco"""
+    if session.get_bind().dialect.name == "postgresql":
+        return func.to_char(coluna, "YYYY-MM")
+    return func.strftime("%Y-%m", coluna)
+
+
+class ArquivoColunar:
+    """Exporta dado_periodico por sessão e mês em arquivos .npy e os lê como arrays NumPy"""
+
+    def __init__(self, diretorio=ARQUIVO_DIR, lote=ARQUIVO_LOTE):
+        self.diretorio = diretorio
+        self.lote = lote
+
+        # Métricas expostas em status()
+        self.exportados = 0
+        self.linhas = 0
+
+    @property
+    def disponivel(self):
+        return numpy is not None
+
+    def _exigir_numpy(self):
+        if not self.disponivel:
+            raise RuntimeError("Arquivo colunar indisponível: numpy não instalado")
+
+    def caminho(self, sessao_id, mes):
+        return os.path.join(self.diretorio, f"sessao_{int(sessao_id)}", f"{mes:%Y-%m}")
+
+    def arquivado(self, sessao_id, mes):
+        return os.path.exists(os.path.join(self.caminho(sessao_id, mes), "meta.json"))
+
+    def exportar_mes(self, session, sessao_id, mes, substituir=False):
+        """Grava as leituras do mês da sessão; retorna as linhas gravadas (None se já arquivado)
+
+        As colunas são preenchidas em lotes direto nos arquivos (open_memmap), sem montar o
+        mês inteiro em memória, e o diretório só aparece completo (rename ao final).
+        """
+        from lib.models import DadoPeriodico
+
+        self._exigir_numpy()
+        mes = date(mes.year, mes.month, 1)
+        if not substituir and self.arquivado(sessao_id, mes):
+            return None
+
+        filtro = and_(
+            DadoPeriodico.sessao_id == sessao_id,
+            DadoPeriodico.data_hora >= _inicio_mes(mes),
+            DadoPeriodico.data_hora < _inicio_mes(somar_meses(mes, 1)),
+        )
+        total = session.scalar(select(func.count()).select_from(DadoPeriodico).where(filtro))
+        if not total:
+            return 0
+
+        destino = self.caminho(sessao_id, mes)
+        temporario = f"{destino}.tmp"
+        shutil.rmtree(temporario, ignore_errors=True)
+        os.makedirs(temporario)
+        arrays = {
+            coluna: numpy.lib.format.open_memmap(
+                os.path.join(temporario, f"{coluna}.npy"), mode="w+", dtype=TIPOS_COLUNAS[coluna], shape=(total,)
+            )
+            for coluna in COLUNAS_ARQUIVO
+        }
+        consulta = (
+            select(*[getattr(DadoPeriodico, coluna) for coluna in COLUNAS_ARQUIVO])
+            .where(filtro)
+            .order_by(DadoPeriodico.data_hora)
+            .limit(total)
+            .execution_options(yield_per=self.lote)
+        )
+        linhas = 0
+        for parte in session.execute(consulta).partitions():
+            fim = linhas + len(parte)
+            for indice, coluna in enumerate(COLUNAS_ARQUIVO):
+                arrays[coluna][linhas:fim] = [linha[indice] for linha in parte]
+            linhas = fim
+        for array in arrays.values():
+            array.flush()
+        del arrays
+
+        meta = {
+            "sessao_id": sessao_id,
+            "mes": f"{mes:%Y-%m}",
+            # Menor que o tamanho dos arrays se leituras foram removidas durante a exportação
+            "linhas": linhas,
+            "colunas": TIPOS_COLUNAS,
+            "exportado_em": datetime.now().isoformat(),
+        }
+        with open(os.path.join(temporario, "meta.json"), "w") as arquivo:
+            json.dump(meta, arquivo)
+        shutil.rmtree(destino, ignore_errors=True)
+        os.replace(temporario, destino)
+
+        self.exportados += 1
+        self.linhas += linhas
+        logging.info(f"Sessão {sessao_id}, {mes:%Y-%m}: {linhas} leituras arquivadas em {destino}")
+        return linhas
+
+    def pendentes(self, session, ate=None, substituir=False):
+        """Meses fechados com leituras antes de ate ainda não arquivados: [(sessao_id, mês)], do mais antigo
+
+        Meses fechados são os anteriores ao mês atual.
+        """
+        from lib.models import DadoPeriodico
+
+        limite = _inicio_mes(datetime.now())
+        ate = min(ate, limite) if ate else limite
+        mes = _mes_texto(session, DadoPeriodico.data_hora)
+        pendentes = session.execute(
+            select(DadoPeriodico.sessao_id, mes).where(DadoPeriodico.data_hora < ate).group_by(DadoPeriodico.sessao_id, mes)
+        ).all()
+        meses = sorted((datetime.strptime(texto, "%Y-%m"), sessao_id) for sessao_id, texto in pendentes)
+        return [(sessao_id, mes) for mes, sessao_id in meses if substituir or not self.arquivado(sessao_id, mes)]
+
+    def exportar_pendentes(self, session, ate=None, substituir=False):
+        """Exporta os meses pendentes (pendentes()); retorna {(sessao_id, "AAAA-MM"): linhas}"""
+        exportados = {}
+        for sessao_id, mes in self.pendentes(session, ate, substituir):
+            linhas = self.exportar_mes(session, sessao_id, mes, substituir)
+            if linhas is not None:
+                exportados[(sessao_id, f"{mes:%Y-%m}")] = linhas
+        return exportados
+
+    def meses(self, sessao_id):
+        """Meses arquivados da sessão, em ordem"""
+        diretorio = os.path.join(self.diretorio, f"sessao_{int(sessao_id)}")
+        if not os.path.isdir(diretorio):
+            return []
+        meses = []
+        for nome in os.listdir(diretorio):
+            # Diretórios .tmp são exportações interrompidas
+            if not nome.endswith(".tmp") and os.path.exists(os.path.join(diretorio, nome, "meta.json")):
+                meses.append(datetime.strptime(nome, "%Y-%m").date())
+        return sorted(meses)
+
+    def ler_mes(self, sessao_id, mes, colunas=COLUNAS_ARQUIVO):
+        """Arrays do mês abertos com mmap, sem cópia; None se o mês não estiver arquivado"""
+        destino = self.caminho(sessao_id, mes)
+        try:
+            with open(os.path.join(destino, "meta.json")) as arquivo:
+                linhas = json.load(arquivo)["linhas"]
+        except FileNotFoundError:
+            return None
+        return {coluna: numpy.load(os.path.join(destino, f"{coluna}.npy"), mmap_mode="r")[:linhas] for coluna in colunas}
+
+    def ler(self, sessao_id, inicio=None, fim=None, colunas=COLUNAS_ARQUIVO):
+        """Colunas da sessão no período [inicio, fim), juntando os meses arquivados
+
+        Dentro de um único mês os arrays são fatias dos arquivos mapeados (sem cópia);
+        períodos de vários meses são concatenados.
+        """
+        self._exigir_numpy()
+        partes = []
+        for mes in self.meses(sessao_id):
+            if (inicio and _inicio_mes(somar_meses(mes, 1)) <= inicio) or (fim and _inicio_mes(mes) >= fim):
+                continue
+            arrays = self.ler_mes(sessao_id, mes, dict.fromkeys(("data_hora", *colunas)))
+            datas = arrays["data_hora"]
+            primeira = numpy.searchsorted(datas, numpy.datetime64(inicio, "us")) if inicio else 0
+            ultima = numpy.searchsorted(datas, numpy.datetime64(fim, "us")) if fim else len(datas)
+            partes.append({coluna: arrays[coluna][primeira:ultima] for coluna in colunas})
+        if len(partes) == 1:
+            return partes[0]
+        if not partes:
+            return {coluna: numpy.empty(0, dtype=TIPOS_COLUNAS[coluna]) for coluna in colunas}
+        return {coluna: numpy.concatenate([parte[coluna] for parte in partes]) for coluna in colunas}
+
+    def status(self):
+        return {
+            "disponivel": self.disponivel,
+            "diretorio": self.diretorio,
+            "exportados": self.exportados,
+            "linhas": self.linhas,
+        }
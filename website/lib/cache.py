@@ -0,0 +1,278 @@
+"""
+Caches em memória usados no caminho de ingestão MQTT.
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import bindparam, insert, update
+
+CAMPOS_LEITURA = ("temperatura", "umidade_ar", "umidade_solo", "exaustor_ligado")
+
+SessaoAtiva = namedtuple("SessaoAtiva", ["id", "cultura_id"])
+
+
+class CacheLeituras:
+    """Últimos valores conhecidos de cada sessão, aquecido do banco e atualizado a cada gravação"""
+
+    def __init__(self):
+        self._valores = {}
+        self._lock = threading.Lock()
+        self.aquecido = False
+
+    def aquecer(self):
+        """Carrega a última leitura de cada sessão de ultimo_dado_sessao (requer app context)"""
+        from lib.models import UltimoDadoSessao, db
+
+        linhas = (
+            db.session.query(
+                UltimoDadoSessao.sessao_id,
+                UltimoDadoSessao.data_hora,
+                *[getattr(UltimoDadoSessao, campo) for campo in CAMPOS_LEITURA],
+            )
+            .filter(UltimoDadoSessao.data_hora.isnot(None))
+            .all()
+        )
+
+        with self._lock:
+            self._valores = {}
+            for linha in linhas:
+                self._valores[linha.sessao_id] = {campo: getattr(linha, campo) for campo in ("data_hora",) + CAMPOS_LEITURA}
+            self.aquecido = True
+        logging.info(f"Cache de leituras aquecido com {len(linhas)} sessões")
+
+    def obter(self, sessao_id):
+        with self._lock:
+            valores = self._valores.get(sessao_id)
+            return dict(valores) if valores is not None else None
+
+    def atualizar(self, sessao_id, campos):
+        """Atualiza os valores da sessão, ignorando leituras mais antigas que as do cache"""
+        with self._lock:
+            atual = self._valores.setdefault(sessao_id, {})
+            data_hora = campos.get("data_hora")
+            if data_hora is not None and atual.get("data_hora") is not None and data_hora < atual["data_hora"]:
+                return
+            for campo in ("data_hora",) + CAMPOS_LEITURA:
+                if campo in campos:
+                    atual[campo] = campos[campo]
+
+    def remover(self, sessao_id):
+        with self._lock:
+            self._valores.pop(sessao_id, None)
+
+    def limpar(self):
+        with self._lock:
+            self._valores = {}
+            self.aquecido = False
+
+
+class RegistroSessoes:
+    """Sessões ativas mantidas em memória para o fan-out das leituras, recarregadas após invalidação
+
+    filtro restringe as sessões atendidas por este processo; ttl (s) força a recarga periódica
+    quando as invalidações acontecem em outro processo.
+    """
+
+    def __init__(self, filtro=None, ttl=0):
+        self._sessoes = None
+        self._versao = 0
+        self._lock = threading.Lock()
+        self._carregado_em = 0.0
+        self.filtro = filtro
+        self.ttl = ttl
+        self.carregamentos = 0
+
+    def invalidar(self):
+        """Descarta o registro; a próxima leitura recarrega as sessões ativas do banco"""
+        with self._lock:
+            self._sessoes = None
+            self._versao += 1
+
+    def _carregar(self):
+        from lib.models import Sessao
+
+        with self._lock:
+            versao = self._versao
+        linhas = Sessao.query.with_entities(Sessao.id, Sessao.cultura_id).filter_by(ativa=True).order_by(Sessao.id).all()
+        sessoes = {
+            linha.id: SessaoAtiva(linha.id, linha.cultura_id)
+            for linha in linhas
+            if self.filtro is None or self.filtro(linha.id)
+        }
+        with self._lock:
+            # Uma invalidação durante a consulta obriga a recarregar na próxima leitura
+            if versao == self._versao:
+                self._sessoes = sessoes
+                self._carregado_em = time.monotonic()
+            self.carregamentos += 1
+        logging.info(f"Registro de sessões ativas carregado com {len(sessoes)} sessões")
+        return sessoes
+
+    def _atuais(self):
+        sessoes = self._sessoes
+        if sessoes is None or (self.ttl and time.monotonic() - self._carregado_em >= self.ttl):
+            return self._carregar()
+        return sessoes
+
+    def ativas(self):
+        """Lista de SessaoAtiva (requer app context apenas quando precisa recarregar)"""
+        return list(self._atuais().values())
+
+    def obter(self, sessao_id):
+        return self._atuais().get(sessao_id)
+
+
+class AtividadeTopicos:
+    """Vitalidade de cada tópico MQTT mantida em memória e persistida em lote em status_mqtt"""
+
+    def __init__(self):
+        self._topicos = {}
+        self._sujos = set()
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._ultima_amostra = time.monotonic()
+
+        # Estado da conexão com o broker
+        self.conectado = False
+        self.erro_conexao = None
+        self.conexao_alterada_em = None
+
+    def _entrada(self, topico):
+        entrada = self._topicos.get(topico)
+        if entrada is None:
+            entrada = self._topicos[topico] = {
+                "ultima_mensagem": None,
+                "mensagens": 0,
+                "bytes": 0,
+                "erro_ultimo": None,
+                "taxa_mensagens_s": 0.0,
+                "taxa_bytes_s": 0.0,
+                "_amostra": (0, 0),
+                # Contadores já somados em status_mqtt
+                "_gravado": (0, 0),
+            }
+        return entrada
+
+    def registrar(self, topico, tamanho, quando=None):
+        """Conta uma mensagem recebida no tópico"""
+        with self._lock:
+            entrada = self._entrada(topico)
+            entrada["ultima_mensagem"] = quando or datetime.now()
+            entrada["mensagens"] += 1
+            entrada["bytes"] += tamanho
+            entrada["erro_ultimo"] = None
+            self._sujos.add(topico)
+
+    def registrar_erro(self, topico, erro):
+        with self._lock:
+            self._entrada(topico)["erro_ultimo"] = str(erro)[:500]
+            self._sujos.add(topico)
+
+    def conexao(self, conectado, erro=None):
+        """Registra mudança no estado da conexão; todos os tópicos são regravados no próximo ciclo"""
+        with self._lock:
+            self.conectado = conectado
+            self.erro_conexao = erro
+            self.conexao_alterada_em = datetime.now()
+            self._sujos.update(self._topicos)
+
+    def _amostrar_taxas(self):
+        agora = time.monotonic()
+        decorrido = agora - self._ultima_amostra
+        if decorrido <= 0:
+            return
+        self._ultima_amostra = agora
+        for entrada in self._topicos.values():
+            mensagens, tamanho = entrada["_amostra"]
+            entrada["taxa_mensagens_s"] = (entrada["mensagens"] - mensagens) / decorrido
+            entrada["taxa_bytes_s"] = (entrada["bytes"] - tamanho) / decorrido
+            entrada["_amostra"] = (entrada["mensagens"], entrada["bytes"])
+
+    def topicos(self):
+        """Cópia do estado de cada tópico para exibição"""
+        with self._lock:
+            return {
+                topico: {campo: valor for campo, valor in entrada.items() if not campo.startswith("_")}
+                for topico, entrada in self._topicos.items()
+            }
+
+    def persistir(self, session):
+        """Grava e confirma em status_mqtt os tópicos alterados desde a última chamada (requer app context)"""
+        from lib.models import StatusMQTT
+
+        with self._lock:
+            self._amostrar_taxas()
+            sujos = {topico: dict(self._topicos[topico]) for topico in self._sujos}
+            self._sujos = set()
+            conectado, erro_conexao = self.conectado, self.erro_conexao
+        if not sujos:
+            return 0
+
+        try:
+            desconhecidos = [topico for topico in sujos if topico not in self._ids]
+            if desconhecidos:
+                linhas = (
+                    session.query(StatusMQTT.id, StatusMQTT.topico)
+                    .filter(StatusMQTT.topico.in_(desconhecidos))
+                    .order_by(StatusMQTT.id)
+                    .all()
+                )
+                for linha in linhas:
+                    self._ids.setdefault(linha.topico, linha.id)
+
+            # Soma só o que chegou desde a última gravação: outros workers somam os seus
+            incremento = (
+                update(StatusMQTT)
+                .where(StatusMQTT.id == bindparam("id_status"))
+                .values(
+                    mensagens=StatusMQTT.mensagens + bindparam("delta_mensagens"),
+                    bytes_recebidos=StatusMQTT.bytes_recebidos + bindparam("delta_bytes"),
+                )
+            )
+            novos = []
+            for topico, entrada in sujos.items():
+                mensagens, tamanho = entrada["_gravado"]
+                campos = {
+                    "ultima_mensagem": entrada["ultima_mensagem"],
+                    "status_conexao": conectado and entrada["erro_ultimo"] is None,
+                    "erro_ultimo": entrada["erro_ultimo"] or (None if conectado else erro_conexao),
+                }
+                delta = {"delta_mensagens": entrada["mensagens"] - mensagens, "delta_bytes": entrada["bytes"] - tamanho}
+                id_ = self._ids.get(topico)
+                if id_ is not None and session.execute(incremento.values(**campos), dict(delta, id_status=id_)).rowcount:
+                    continue
+                # Linha nova, ou removida desde a última gravação (retenção de status_mqtt)
+                self._ids.pop(topico, None)
+                novos.append(
+                    dict(campos, topico=topico, mensagens=delta["delta_mensagens"], bytes_recebidos=delta["delta_bytes"])
+                )
+
+            if novos:
+                inseridos = session.execute(insert(StatusMQTT).returning(StatusMQTT.id, StatusMQTT.topico), novos).all()
+                for linha in inseridos:
+                    self._ids[linha.topico] = linha.id
+            session.commit()
+        except Exception:
+            session.rollback()
+            # Mantém os tópicos pendentes e relê os ids gravados na próxima tentativa
+            with self._lock:
+                self._sujos.update(sujos)
+                self._ids = {}
+            raise
+        with self._lock:
+            for topico, entrada in sujos.items():
+                self._topicos[topico]["_gravado"] = (entrada["mensagens"], entrada["bytes"])
+        return len(sujos)
+
+    def status(self):
+        return {
+            "conectado": self.conectado,
+            "erro_conexao": self.erro_conexao,
+            "conexao_alterada_em": self.conexao_alterada_em.isoformat() if self.conexao_alterada_em else None,
+            "topicos": len(self._topicos),
+            "pendentes": len(self._sujos),
+        }
@@ -0,0 +1,176 @@
+"""
+Coalescência de leituras parciais de sensores em uma única linha de DadoPeriodico.
+
+Temperatura, umidade do ar e umidade do solo chegam em tópicos separados. Em vez
+de gravar uma linha completa por mensagem, as leituras de cada sessão que caem
+na mesma janela de tempo são mescladas e gravadas juntas quando a janela fecha.
+"""
+
+import threading
+import time
+from datetime import timedelta
+from os import getenv
+
+# Configurações de coalescência (0 desativa)
+COALESCENCIA_JANELA_MS = int(getenv("COALESCENCIA_JANELA_MS", 5000))
+COALESCENCIA_ATRASO_MS = int(getenv("COALESCENCIA_ATRASO_MS", 2000))
+# Janelas específicas por sessão no formato "sessao_id=ms,sessao_id=ms"
+COALESCENCIA_JANELAS_SESSAO = getenv("COALESCENCIA_JANELAS_SESSAO", "")
+# Intervalo máximo entre verificações das janelas abertas
+COALESCENCIA_VERIFICACAO_MAX_S = 1.0
+
+
+def _janelas_por_sessao(texto):
+    janelas = {}
+    for item in filter(None, (parte.strip() for parte in texto.split(","))):
+        sessao_id, _, ms = item.partition("=")
+        janelas[int(sessao_id)] = int(ms)
+    return janelas
+
+
+class _Janela:
+    __slots__ = ("cultura_id", "inicio", "aberta_em", "valores")
+
+    def __init__(self, cultura_id, inicio):
+        self.cultura_id = cultura_id
+        self.inicio = inicio
+        self.aberta_em = time.monotonic()
+        self.valores = {}
+
+    def mesclar(self, data_hora, valores):
+        # Cada campo guarda o valor com o horário mais recente
+        for campo, valor in valores.items():
+            atual = self.valores.get(campo)
+            if atual is None or data_hora >= atual[0]:
+                self.valores[campo] = (data_hora, valor)
+
+
+class Coalescedor:
+    """Mescla leituras por sessão dentro de uma janela de tempo configurável"""
+
+    def __init__(self, janela_ms=COALESCENCIA_JANELA_MS, atraso_ms=COALESCENCIA_ATRASO_MS, janelas_sessao=None):
+        self.janela_padrao_ms = janela_ms
+        self.atraso = timedelta(milliseconds=atraso_ms)
+        self.janelas_sessao = (
+            _janelas_por_sessao(COALESCENCIA_JANELAS_SESSAO) if janelas_sessao is None else dict(janelas_sessao)
+        )
+        self._abertas = {}
+        self._fechadas = {}
+        self._lock = threading.Lock()
+
+        self.recebidas = 0
+        self.emitidas = 0
+        self.atrasadas = 0
+
+    def definir_janela(self, sessao_id, janela_ms):
+        """Define a janela de uma sessão; None volta ao padrão"""
+        with self._lock:
+            if janela_ms is None:
+                self.janelas_sessao.pop(sessao_id, None)
+            else:
+                self.janelas_sessao[sessao_id] = janela_ms
+
+    def intervalo_verificacao_s(self):
+        """Metade da menor janela configurada, limitada a COALESCENCIA_VERIFICACAO_MAX_S
+
+        Com todas as janelas em 0 o limite cobre as definidas depois por definir_janela.
+        """
+        janelas = [ms for ms in (self.janela_padrao_ms, *self.janelas_sessao.values()) if ms > 0]
+        if not janelas:
+            return COALESCENCIA_VERIFICACAO_MAX_S
+        return min(max(min(janelas) / 2000, 0.05), COALESCENCIA_VERIFICACAO_MAX_S)
+
+    def janela_ms(self, sessao_id):
+        return self.janelas_sessao.get(sessao_id, self.janela_padrao_ms)
+
+    def adicionar(self, sessao_id, cultura_id, data_hora, valores):
+        """Registra uma leitura e devolve as linhas que ficaram prontas para gravação"""
+        with self._lock:
+            self.recebidas += 1
+            duracao = timedelta(milliseconds=self.janela_ms(sessao_id))
+            if duracao <= timedelta(0):
+                return [self._emitir(sessao_id, cultura_id, data_hora, valores)]
+
+            emitidas = []
+            janela = self._abertas.get(sessao_id)
+
+            if janela is not None and data_hora >= janela.inicio + duracao:
+                emitidas.append(self._fechar(sessao_id, duracao))
+                janela = None
+
+            if janela is not None and data_hora < janela.inicio:
+                # Chegada tardia: mescla se dentro da tolerância, senão vira linha própria
+                if janela.inicio - data_hora <= self.atraso:
+                    janela.mesclar(data_hora, valores)
+                else:
+                    self.atrasadas += 1
+                    emitidas.append(self._emitir(sessao_id, cultura_id, data_hora, valores))
+                return emitidas
+
+            if janela is None:
+                fim_anterior = self._fechadas.get(sessao_id)
+                if fim_anterior is not None and data_hora < fim_anterior:
+                    # A janela correspondente já foi gravada
+                    self.atrasadas += 1
+                    emitidas.append(self._emitir(sessao_id, cultura_id, data_hora, valores))
+                    return emitidas
+                janela = self._abertas[sessao_id] = _Janela(cultura_id, data_hora)
+
+            janela.mesclar(data_hora, valores)
+            return emitidas
+
+    def expirar(self, forcar=False):
+        """Fecha as janelas abertas há mais tempo que a sua duração (ou todas, se forcar)"""
+        agora = time.monotonic()
+        with self._lock:
+            emitidas = []
+            for sessao_id in list(self._abertas):
+                duracao = timedelta(milliseconds=self.janela_ms(sessao_id))
+                if forcar or agora - self._abertas[sessao_id].aberta_em >= duracao.total_seconds():
+                    emitidas.append(self._fechar(sessao_id, duracao))
+            return emitidas
+
+    def descartar(self, sessao_id):
+        with self._lock:
+            self._abertas.pop(sessao_id, None)
+            self._fechadas.pop(sessao_id, None)
+
+    def instantaneo(self):
+        """Cópia do estado das janelas, usada para desfazer um lote que não foi gravado"""
+        with self._lock:
+            abertas = {
+                sessao_id: (janela.cultura_id, janela.inicio, janela.aberta_em, dict(janela.valores))
+                for sessao_id, janela in self._abertas.items()
+            }
+            return abertas, dict(self._fechadas), (self.recebidas, self.emitidas, self.atrasadas)
+
+    def restaurar(self, estado):
+        abertas, fechadas, contadores = estado
+        with self._lock:
+            self._abertas = {}
+            for sessao_id, (cultura_id, inicio, aberta_em, valores) in abertas.items():
+                janela = self._abertas[sessao_id] = _Janela(cultura_id, inicio)
+                janela.aberta_em = aberta_em
+                janela.valores = dict(valores)
+            self._fechadas = fechadas
+            self.recebidas, self.emitidas, self.atrasadas = contadores
+
+    def _fechar(self, sessao_id, duracao):
+        janela = self._abertas.pop(sessao_id)
+        self._fechadas[sessao_id] = janela.inicio + duracao
+        data_hora = max(registro[0] for registro in janela.valores.values())
+        valores = {campo: registro[1] for campo, registro in janela.valores.items()}
+        return self._emitir(sessao_id, janela.cultura_id, data_hora, valores)
+
+    def _emitir(self, sessao_id, cultura_id, data_hora, valores):
+        self.emitidas += 1
+        return dict(valores, sessao_id=sessao_id, cultura_id=cultura_id, data_hora=data_hora)
+
+    def status(self):
+        return {
+            "janela_ms": self.janela_padrao_ms,
+            "abertas": len(self._abertas),
+            "recebidas": self.recebidas,
+            "emitidas": self.emitidas,
+            "atrasadas": self.atrasadas,
+        }
@@ -0,0 +1,122 @@
+"""
+Rastreamento dos comandos enviados aos dispositivos até a confirmação pelo tópico de status.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+
+# Configurações de confirmação dos comandos
+COMANDO_TIMEOUT_S = float(getenv("COMANDO_TIMEOUT_S", 10))
+COMANDO_TENTATIVAS = int(getenv("COMANDO_TENTATIVAS", 3))
+
+
+class ComandoPendente:
+    __slots__ = ("comando_id", "tipo", "sessao_id", "topic", "payload", "qos", "enviado_em", "ultimo_envio", "tentativas")
+
+    def __init__(self, comando_id, tipo, topic, payload, qos, sessao_id=None):
+        self.comando_id = comando_id
+        self.tipo = tipo
+        self.sessao_id = sessao_id
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.enviado_em = time.monotonic()
+        self.ultimo_envio = self.enviado_em
+        self.tentativas = 1
+
+
+class RastreadorComandos:
+    """Comandos publicados aguardando o status do dispositivo, com reenvio e expiração
+
+    O status é associado pelo campo comando_id do payload; sem ele, ao comando pendente
+    mais antigo do mesmo tipo de dispositivo (e da mesma sessão, quando informada).
+    """
+
+    def __init__(self, timeout_s=COMANDO_TIMEOUT_S, tentativas=COMANDO_TENTATIVAS):
+        self.timeout_s = timeout_s
+        self.max_tentativas = max(1, tentativas)
+        self._pendentes = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métricas expostas em status()
+        self.confirmados = 0
+        self.expirados = 0
+        self.reenvios = 0
+        self.ultima_latencia_ms = None
+        self._soma_latencia_ms = 0.0
+
+    def registrar(self, comando_id, tipo, topic, payload, qos, sessao_id=None):
+        with self._lock:
+            self._pendentes[comando_id] = ComandoPendente(comando_id, tipo, topic, payload, qos, sessao_id)
+
+    def descartar(self, comando_id):
+        """Remove um comando que não chegou a ser publicado, sem contar como expirado"""
+        with self._lock:
+            return self._pendentes.pop(comando_id, None)
+
+    def pendente(self, comando_id):
+        with self._lock:
+            return self._pendentes.get(comando_id)
+
+    def confirmar(self, tipo, data):
+        """Retorna (comando_id, latencia_ms) do comando confirmado pelo status, ou None
+
+        Um comando_id desconhecido (enviado por outro processo) é devolvido com latência None.
+        """
+        comando_id = data.get("comando_id")
+        with self._lock:
+            if comando_id:
+                pendente = self._pendentes.pop(comando_id, None)
+            else:
+                pendente = next(
+                    (
+                        p
+                        for p in self._pendentes.values()
+                        if p.tipo == tipo and (data.get("sessao_id") is None or str(p.sessao_id) == str(data["sessao_id"]))
+                    ),
+                    None,
+                )
+                if pendente is not None:
+                    del self._pendentes[pendente.comando_id]
+
+            if pendente is None:
+                return (comando_id, None) if comando_id else None
+
+            latencia = (time.monotonic() - pendente.enviado_em) * 1000
+            self.confirmados += 1
+            self.ultima_latencia_ms = latencia
+            self._soma_latencia_ms += latencia
+        logging.info(f"Comando {pendente.comando_id} confirmado por {tipo} em {latencia:.0f} ms")
+        return pendente.comando_id, latencia
+
+    def vencidos(self):
+        """Separa os comandos sem resposta no prazo em (reenviar, expirados)"""
+        agora = time.monotonic()
+        reenviar, expirados = [], []
+        with self._lock:
+            for comando_id, pendente in list(self._pendentes.items()):
+                if agora - pendente.ultimo_envio < self.timeout_s:
+                    continue
+                if pendente.tentativas < self.max_tentativas:
+                    pendente.tentativas += 1
+                    pendente.ultimo_envio = agora
+                    reenviar.append(pendente)
+                else:
+                    del self._pendentes[comando_id]
+                    expirados.append(pendente)
+            self.reenvios += len(reenviar)
+            self.expirados += len(expirados)
+        return reenviar, expirados
+
+    def status(self):
+        return {
+            "pendentes": len(self._pendentes),
+            "confirmados": self.confirmados,
+            "expirados": self.expirados,
+            "reenvios": self.reenvios,
+            "ultima_latencia_ms": round(self.ultima_latencia_ms, 2) if self.ultima_latencia_ms is not None else None,
+            "media_latencia_ms": round(self._soma_latencia_ms / self.confirmados, 2) if self.confirmados else None,
+        }
@@ -0,0 +1,153 @@
+"""
+Supressão de mensagens duplicadas (reentregas QoS 1) pela identidade enviada pelo dispositivo.
+
+O dispositivo informa msg_id ou seq (opcionalmente com boot, para não repetir a sequência
+após reiniciar) e, quando há mais de um por tópico, o campo dispositivo. As identidades
+recentes ficam em uma janela LRU por dispositivo; a tabela mensagem_recebida, com chave
+única, é a guarda no banco e recebe uma única escrita por lote, sem leituras por mensagem.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from os import getenv
+
+from sqlalchemy import delete
+
+# Configurações da deduplicação
+DEDUP_JANELA = int(getenv("DEDUP_JANELA", 256))
+DEDUP_MAX_DISPOSITIVOS = int(getenv("DEDUP_MAX_DISPOSITIVOS", 1024))
+# Tempo (s) que as identidades ficam guardadas em mensagem_recebida
+DEDUP_RETENCAO_S = float(getenv("DEDUP_RETENCAO_S", 86400))
+
+
+def identidade(topic, data):
+    """Chave (dispositivo, mensagem) do payload, ou None se o dispositivo não identificar a mensagem"""
+    if not isinstance(data, dict):
+        return None
+    mensagem = data.get("msg_id")
+    if mensagem is None:
+        seq = data.get("seq")
+        if seq is None:
+            return None
+        boot = data.get("boot")
+        mensagem = f"{boot}:{seq}" if boot is not None else seq
+    return str(data.get("dispositivo") or topic)[:100], str(mensagem)[:100]
+
+
+def _insert_ignorando_conflitos(session, modelo):
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(modelo).on_conflict_do_nothing()
+
+
+class FiltroDuplicatas:
+    """Janela deslizante das últimas identidades de cada dispositivo, com os dispositivos em LRU"""
+
+    def __init__(self, janela=DEDUP_JANELA, max_dispositivos=DEDUP_MAX_DISPOSITIVOS, retencao_s=DEDUP_RETENCAO_S, particao=0):
+        self.janela = max(1, janela)
+        self.max_dispositivos = max(1, max_dispositivos)
+        self.retencao = timedelta(seconds=retencao_s)
+        self.particao = particao
+        self._dispositivos = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métricas expostas em status()
+        self.unicas = 0
+        self.duplicadas = 0
+        self.duplicadas_banco = 0
+
+    def registrar(self, chave):
+        """Marca a identidade como vista; False se ela já estava na janela do dispositivo"""
+        dispositivo, mensagem = chave
+        with self._lock:
+            recentes = self._dispositivos.get(dispositivo)
+            if recentes is None:
+                if len(self._dispositivos) >= self.max_dispositivos:
+                    self._dispositivos.popitem(last=False)
+                recentes = self._dispositivos[dispositivo] = OrderedDict()
+            else:
+                self._dispositivos.move_to_end(dispositivo)
+
+            if mensagem in recentes:
+                self.duplicadas += 1
+                return False
+            recentes[mensagem] = None
+            if len(recentes) > self.janela:
+                recentes.popitem(last=False)
+            self.unicas += 1
+            return True
+
+    def esquecer(self, chaves):
+        """Remove identidades de um lote que não chegou a ser gravado"""
+        with self._lock:
+            for dispositivo, mensagem in chaves:
+                recentes = self._dispositivos.get(dispositivo)
+                if recentes is not None:
+                    recentes.pop(mensagem, None)
+
+    def reservar(self, session, chaves):
+        """Grava as identidades em mensagem_recebida e retorna as que ainda não existiam no banco"""
+        from lib.models import MensagemRecebida
+
+        if not chaves:
+            return set()
+        agora = datetime.now()
+        linhas = [
+            {"particao": self.particao, "dispositivo": dispositivo, "mensagem": mensagem, "recebida_em": agora}
+            for dispositivo, mensagem in chaves
+        ]
+        instrucao = (
+            _insert_ignorando_conflitos(session, MensagemRecebida)
+            .values(linhas)
+            .returning(MensagemRecebida.dispositivo, MensagemRecebida.mensagem)
+        )
+        reservadas = {tuple(linha) for linha in session.execute(instrucao)}
+        with self._lock:
+            self.duplicadas_banco += len(chaves) - len(reservadas)
+        return reservadas
+
+    def aquecer(self, session):
+        """Carrega as identidades mais recentes de cada dispositivo (requer app context)"""
+        from lib.models import MensagemRecebida
+
+        linhas = (
+            session.query(MensagemRecebida.dispositivo, MensagemRecebida.mensagem)
+            .filter(
+                MensagemRecebida.particao == self.particao,
+                MensagemRecebida.recebida_em >= datetime.now() - self.retencao,
+            )
+            .order_by(MensagemRecebida.id.desc())
+            .limit(self.janela * self.max_dispositivos)
+            .all()
+        )
+        with self._lock:
+            self._dispositivos = OrderedDict()
+            for dispositivo, mensagem in reversed(linhas):
+                recentes = self._dispositivos.setdefault(dispositivo, OrderedDict())
+                recentes[mensagem] = None
+                if len(recentes) > self.janela:
+                    recentes.popitem(last=False)
+            while len(self._dispositivos) > self.max_dispositivos:
+                self._dispositivos.popitem(last=False)
+        logging.info(f"Janela de deduplicação aquecida com {len(linhas)} mensagens")
+
+    def limpar(self, session):
+        """Remove de mensagem_recebida as identidades mais antigas que a retenção"""
+        from lib.models import MensagemRecebida
+
+        resultado = session.execute(
+            delete(MensagemRecebida).where(MensagemRecebida.recebida_em < datetime.now() - self.retencao)
+        )
+        return resultado.rowcount
+
+    def status(self):
+        return {
+            "dispositivos": len(self._dispositivos),
+            "unicas": self.unicas,
+            "duplicadas": self.duplicadas,
+            "duplicadas_banco": self.duplicadas_banco,
+        }
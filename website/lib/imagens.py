@@ -0,0 +1,234 @@
+"""
+Imagens da câmera: remontagem de quadros enviados em partes e armazenamento em disco
+endereçado pelo conteúdo (sha256), mantendo no banco apenas a referência.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from os import getenv
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import undefer
+
+# Diretório do armazenamento de imagens (relativo ao diretório de execução)
+IMAGENS_DIR = getenv("IMAGENS_DIR", "imagens")
+# Prazo (s) para receber todas as partes de um quadro e limites da remontagem
+QUADRO_TIMEOUT_S = float(getenv("QUADRO_TIMEOUT_S", 30))
+QUADRO_MAX_PENDENTES = int(getenv("QUADRO_MAX_PENDENTES", 16))
+QUADRO_MAX_PARTES = int(getenv("QUADRO_MAX_PARTES", 1024))
+
+_HEX = frozenset("0123456789abcdef")
+
+
+def tipo_imagem(dados):
+    """Tipo MIME da imagem pelos primeiros bytes (JPEG, PNG, WebP ou GIF)"""
+    if dados[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if dados[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if dados[:4] == b"RIFF" and dados[8:12] == b"WEBP":
+        return "image/webp"
+    if dados[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
+
+
+class ArmazemImagens:
+    """Arquivos gravados em <diretorio>/<2 primeiros hex>/<sha256>; conteúdo repetido é gravado uma vez"""
+
+    def __init__(self, diretorio=IMAGENS_DIR):
+        self.diretorio = diretorio
+        self.gravadas = 0
+        self.reaproveitadas = 0
+
+    def caminho(self, sha256):
+        if len(sha256) != 64 or not _HEX.issuperset(sha256):
+            raise ValueError(f"Referência de imagem inválida: {sha256}")
+        return os.path.join(self.diretorio, sha256[:2], sha256)
+
+    def salvar(self, dados):
+        """Grava o conteúdo (se ainda não existir) e retorna o sha256 que o referencia"""
+        sha256 = hashlib.sha256(dados).hexdigest()
+        caminho = self.caminho(sha256)
+        if os.path.exists(caminho):
+            self.reaproveitadas += 1
+            return sha256
+
+        self._gravar(caminho, dados)
+        self.gravadas += 1
+        return sha256
+
+    def caminho_derivado(self, sha256, tamanho):
+        """Versão redimensionada (ex.: "miniatura"), gravada ao lado do original"""
+        if not tamanho.isalpha():
+            raise ValueError(f"Tamanho de imagem inválido: {tamanho}")
+        return f"{self.caminho(sha256)}_{tamanho}"
+
+    def salvar_derivado(self, sha256, tamanho, dados):
+        self._gravar(self.caminho_derivado(sha256, tamanho), dados)
+
+    def possui_derivado(self, sha256, tamanho):
+        return os.path.exists(self.caminho_derivado(sha256, tamanho))
+
+    def versao(self, sha256, tamanho=None):
+        """Tamanho efetivamente servido: o pedido, se já gerado, ou None para o original"""
+        if tamanho and self.possui_derivado(sha256, tamanho):
+            return tamanho
+        return None
+
+    def _gravar(self, caminho, dados):
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        # Grava em arquivo temporário e renomeia: leitores nunca veem um arquivo parcial
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, "wb") as arquivo:
+            arquivo.write(dados)
+        os.replace(temporario, caminho)
+
+    def ler(self, sha256, tamanho=None):
+        """Bytes do original ou, se houver, da versão no tamanho pedido"""
+        try:
+            if self.versao(sha256, tamanho):
+                caminho = self.caminho_derivado(sha256, tamanho)
+            else:
+                caminho = self.caminho(sha256)
+            with open(caminho, "rb") as arquivo:
+                return arquivo.read()
+        except (OSError, ValueError) as e:
+            logging.warning(f"Imagem {sha256} indisponível: {e}")
+            return None
+
+    def imagem_de(self, dado, tamanho=None):
+        """Bytes da imagem de um DadoPeriodico, do arquivo referenciado ou da coluna antiga"""
+        if dado is None:
+            return None
+        if getattr(dado, "imagem_sha256", None):
+            return self.ler(dado.imagem_sha256, tamanho)
+        return dado.imagem
+
+    def migrar_coluna(self, session, lote=100):
+        """Move para o disco as imagens da coluna antiga dado_periodico.imagem; retorna quantas linhas
+
+        Cada lote é confirmado separadamente, então a migração pode ser interrompida e retomada.
+        """
+        from lib.models import DadoPeriodico
+
+        total = 0
+        while True:
+            dados = session.scalars(
+                select(DadoPeriodico)
+                .options(undefer(DadoPeriodico.imagem))
+                .where(DadoPeriodico.imagem.isnot(None), DadoPeriodico.imagem_sha256.is_(None))
+                .order_by(DadoPeriodico.id)
+                .limit(lote)
+            ).all()
+            if not dados:
+                return total
+            referencias = [{"id_": dado.id, "sha256": self.salvar(dado.imagem)} for dado in dados]
+            session.expunge_all()
+            session.connection().execute(
+                update(DadoPeriodico.__table__)
+                .where(DadoPeriodico.__table__.c.id == bindparam("id_"))
+                .values(imagem_sha256=bindparam("sha256"), imagem=None),
+                referencias,
+            )
+            session.commit()
+            total += len(referencias)
+            logging.info(f"{total} imagens movidas para {self.diretorio}")
+
+    def status(self):
+        return {
+            "diretorio": self.diretorio,
+            "gravadas": self.gravadas,
+            "reaproveitadas": self.reaproveitadas,
+        }
+
+
+class _Quadro:
+    __slots__ = ("total", "partes", "sha256", "timestamp", "recebido_em")
+
+    def __init__(self, total):
+        self.total = total
+        self.partes = {}
+        self.sha256 = None
+        self.timestamp = None
+        self.recebido_em = time.monotonic()
+
+
+class MontadorQuadros:
+    """Remonta quadros enviados em partes com CRC32 por parte e sha256 opcional do quadro
+
+    Partes repetidas (reentregas QoS 1) substituem a anterior; quadros incompletos
+    são descartados após o prazo ou quando há quadros pendentes demais.
+    """
+
+    def __init__(self, timeout_s=QUADRO_TIMEOUT_S, max_pendentes=QUADRO_MAX_PENDENTES, max_partes=QUADRO_MAX_PARTES):
+        self.timeout_s = timeout_s
+        self.max_pendentes = max(1, max_pendentes)
+        self.max_partes = max_partes
+        self._pendentes = OrderedDict()
+
+        # Métricas expostas em status()
+        self.partes = 0
+        self.completos = 0
+        self.corrompidos = 0
+        self.expirados = 0
+
+    def adicionar(self, chave, parte, total, dados, crc32=None, sha256=None, timestamp=None):
+        """Registra uma parte; retorna (imagem, timestamp) quando o quadro fica completo, senão None"""
+        if not 0 < total <= self.max_partes or not 0 <= parte < total:
+            raise ValueError(f"Parte {parte} de {total} inválida no quadro {chave}")
+        if crc32 is not None and zlib.crc32(dados) != crc32:
+            self.corrompidos += 1
+            raise ValueError(f"Checksum inválido na parte {parte} do quadro {chave}")
+
+        self.partes += 1
+        quadro = self._pendentes.get(chave)
+        if quadro is None:
+            if len(self._pendentes) >= self.max_pendentes:
+                descartado, _ = self._pendentes.popitem(last=False)
+                self.expirados += 1
+                logging.warning(f"Quadro {descartado} incompleto descartado: limite de quadros pendentes")
+            quadro = self._pendentes[chave] = _Quadro(total)
+        elif quadro.total != total:
+            del self._pendentes[chave]
+            self.corrompidos += 1
+            raise ValueError(f"Total de partes divergente no quadro {chave}: {quadro.total} e {total}")
+
+        quadro.partes[parte] = dados
+        quadro.sha256 = sha256 or quadro.sha256
+        quadro.timestamp = timestamp or quadro.timestamp
+        quadro.recebido_em = time.monotonic()
+        if len(quadro.partes) < total:
+            return None
+
+        del self._pendentes[chave]
+        imagem = b"".join(quadro.partes[i] for i in range(total))
+        if quadro.sha256 and hashlib.sha256(imagem).hexdigest() != quadro.sha256.lower():
+            self.corrompidos += 1
+            raise ValueError(f"sha256 do quadro {chave} não confere")
+        self.completos += 1
+        return imagem, quadro.timestamp
+
+    def expirar(self):
+        """Descarta os quadros sem novas partes há mais que o prazo; retorna quantos"""
+        limite = time.monotonic() - self.timeout_s
+        vencidos = [chave for chave, quadro in self._pendentes.items() if quadro.recebido_em < limite]
+        for chave in vencidos:
+            quadro = self._pendentes.pop(chave)
+            logging.warning(f"Quadro {chave} expirado com {len(quadro.partes)} de {quadro.total} partes")
+        self.expirados += len(vencidos)
+        return len(vencidos)
+
+    def status(self):
+        return {
+            "pendentes": len(self._pendentes),
+            "partes": self.partes,
+            "completos": self.completos,
+            "corrompidos": self.corrompidos,
+            "expirados": self.expirados,
+        }
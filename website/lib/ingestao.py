@@ -0,0 +1,301 @@
+"""
+Fila de ingestão com escrita em lote (write-behind) para as mensagens MQTT.
+
+A thread de rede do paho apenas enfileira as mensagens; um worker dedicado
+drena a fila e grava as linhas acumuladas com INSERTs multi-linha a cada
+N mensagens ou T milissegundos, o que ocorrer primeiro.
+
+Com um classificador de prioridade, a fila entrega primeiro as classes mais
+urgentes e, quando o acúmulo passa dos limiares, descarta imagens e reduz a
+amostragem das leituras escalares (menos as mensagens de lote, que juntam leituras de
+vários instantes) em vez de acumular latência. Imagens enviadas
+em partes são descartadas por quadro: as partes de um quadro já aceito continuam
+entrando, e um quadro recusado não entra pela metade.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from os import getenv
+
+from sqlalchemy import insert
+
+# Configurações da fila de ingestão
+INGESTAO_MAX_FILA = int(getenv("INGESTAO_MAX_FILA", 10000))
+INGESTAO_LOTE_MENSAGENS = int(getenv("INGESTAO_LOTE_MENSAGENS", 200))
+INGESTAO_LOTE_MS = int(getenv("INGESTAO_LOTE_MS", 500))
+# Limiares de descarte, em fração da capacidade da fila
+INGESTAO_LIMIAR_IMAGENS = float(getenv("INGESTAO_LIMIAR_IMAGENS", 0.25))
+INGESTAO_LIMIAR_AMOSTRAGEM = float(getenv("INGESTAO_LIMIAR_AMOSTRAGEM", 0.5))
+# Acima do limiar de amostragem, mantém 1 de cada N leituras escalares por tópico
+INGESTAO_AMOSTRAGEM = int(getenv("INGESTAO_AMOSTRAGEM", 4))
+# Espaço extra da fila reservado para alertas e status (fração da capacidade)
+INGESTAO_RESERVA_PRIORITARIA = float(getenv("INGESTAO_RESERVA_PRIORITARIA", 0.1))
+# Quadros da câmera cuja decisão (aceito ou recusado) é lembrada para as partes seguintes
+INGESTAO_QUADROS_LEMBRADOS = int(getenv("INGESTAO_QUADROS_LEMBRADOS", 256))
+
+# Classes de prioridade: menor valor é processado primeiro
+PRIORIDADE_ALTA = 0  # alertas e status dos dispositivos
+PRIORIDADE_SENSORES = 1  # leituras escalares
+PRIORIDADE_IMAGENS = 2  # quadros da câmera
+CLASSES_PRIORIDADE = {PRIORIDADE_ALTA: "alta", PRIORIDADE_SENSORES: "sensores", PRIORIDADE_IMAGENS: "imagens"}
+
+# Sinal de encerramento: ordenado depois de qualquer mensagem
+_FIM = (float("inf"), 0, None, None)
+
+
+class LoteEscrita:
+    """Acumula linhas por modelo para gravação com um INSERT multi-linha por tabela"""
+
+    def __init__(self):
+        self.linhas = {}
+
+    def __len__(self):
+        return sum(len(linhas) for linhas in self.linhas.values())
+
+    def adicionar(self, modelo, **campos):
+        self.linhas.setdefault(modelo, []).append(campos)
+        return campos
+
+    def pendentes(self, modelo):
+        return self.linhas.get(modelo, [])
+
+    def descarregar(self, session):
+        """Grava todas as linhas pendentes na sessão e esvazia o lote"""
+        total = 0
+        for modelo, linhas in self.linhas.items():
+            if linhas:
+                session.execute(insert(modelo), linhas)
+                total += len(linhas)
+        self.linhas = {}
+        return total
+
+
+class FilaIngestao:
+    """Fila limitada drenada por um worker que processa as mensagens em lotes
+
+    classificar(topic) devolve a classe de prioridade da mensagem; sem classificador
+    todas as mensagens têm a mesma classe e só são descartadas com a fila cheia.
+    quadro(topic, payload) devolve a chave do quadro de uma parte de imagem (None para
+    imagens inteiras), usada para descartar quadros inteiros em vez de partes soltas.
+    amostravel(topic) diz se as leituras do tópico podem ser amostradas (padrão: todas).
+    """
+
+    def __init__(
+        self,
+        processar_lote,
+        max_fila=INGESTAO_MAX_FILA,
+        lote_mensagens=INGESTAO_LOTE_MENSAGENS,
+        lote_ms=INGESTAO_LOTE_MS,
+        classificar=None,
+        limiar_imagens=INGESTAO_LIMIAR_IMAGENS,
+        limiar_amostragem=INGESTAO_LIMIAR_AMOSTRAGEM,
+        amostragem=INGESTAO_AMOSTRAGEM,
+        quadro=None,
+        amostravel=None,
+    ):
+        self.processar_lote = processar_lote
+        self.fila = queue.PriorityQueue()
+        self.capacidade = max(1, max_fila)
+        self.lote_mensagens = max(1, lote_mensagens)
+        self.lote_ms = max(1, lote_ms)
+        self.classificar = classificar
+        self.limiar_imagens = int(self.capacidade * limiar_imagens)
+        self.limiar_amostragem = int(self.capacidade * limiar_amostragem)
+        self.limite_prioritario = self.capacidade + int(self.capacidade * INGESTAO_RESERVA_PRIORITARIA)
+        self.amostragem = max(1, amostragem)
+        self.quadro = quadro
+        self.amostravel = amostravel
+        self.worker = None
+        self._lock = threading.Lock()
+        self._tarefas = []
+        self._sequencia = itertools.count()
+        self._amostras = Counter()
+        # Chave do quadro -> aceito, dos quadros mais recentes
+        self._quadros = OrderedDict()
+
+        # Métricas expostas em status()
+        self.recebidas = 0
+        self.descartadas = 0
+        self.descartes = Counter()
+        self.processadas = 0
+        self.lotes = 0
+        self.erros = 0
+        self.ultima_latencia_ms = None
+        self.maior_latencia_ms = 0.0
+        self._soma_latencia_ms = 0.0
+
+    @property
+    def ativa(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def iniciar(self):
+        with self._lock:
+            if self.ativa:
+                return
+            self.worker = threading.Thread(target=self._executar, name="mqtt-ingestao")
+            self.worker.daemon = True
+            self.worker.start()
+            logging.info("Worker de ingestão MQTT iniciado")
+
+    def agendar(self, intervalo, tarefa):
+        """Executa tarefa(forcar=False) no worker a cada intervalo (s) e tarefa(forcar=True) ao parar
+
+        Uma tarefa que devolve True ainda tem trabalho pendente e roda de novo logo após o
+        próximo lote, sem esperar o intervalo.
+        """
+        self._tarefas.append([intervalo, time.monotonic() + intervalo, tarefa])
+
+    def _executar_tarefas(self, forcar=False):
+        agora = time.monotonic()
+        for agendada in self._tarefas:
+            intervalo, proxima, tarefa = agendada
+            if forcar or agora >= proxima:
+                agendada[1] = agora + intervalo
+                try:
+                    if tarefa(forcar=forcar):
+                        agendada[1] = time.monotonic()
+                except Exception as e:
+                    logging.error(f"Erro na tarefa periódica {getattr(tarefa, '__name__', tarefa)}: {e}")
+
+    def _espera_tarefas(self):
+        if not self._tarefas:
+            return None
+        return max(0.0, min(agendada[1] for agendada in self._tarefas) - time.monotonic())
+
+    def enfileirar(self, topic, payload):
+        """Enfileira sem bloquear a thread de rede; descarta conforme a classe e o acúmulo da fila"""
+        classe = self.classificar(topic) if self.classificar else PRIORIDADE_SENSORES
+        chave = self.quadro(topic, payload) if classe == PRIORIDADE_IMAGENS and self.quadro else None
+        motivo = self._motivo_descarte(topic, classe, self.fila.qsize(), chave)
+        if motivo:
+            self.descartadas += 1
+            self.descartes[motivo] += 1
+            if motivo == "fila_cheia":
+                logging.warning(f"Fila de ingestão cheia ({self.capacidade}); mensagem de {topic} descartada")
+            return False
+        self.fila.put_nowait((classe, next(self._sequencia), topic, payload))
+        self.recebidas += 1
+        return True
+
+    def _motivo_descarte(self, topic, classe, profundidade, quadro=None):
+        if classe == PRIORIDADE_ALTA:
+            return "fila_cheia" if profundidade >= self.limite_prioritario else None
+        if profundidade >= self.capacidade:
+            return "fila_cheia"
+        if self.classificar is None:
+            return None
+        if classe == PRIORIDADE_IMAGENS:
+            # Quadros intermediários são dispensáveis: o próximo após a fila baixar é gravado
+            return self._descarte_quadro(quadro, profundidade >= self.limiar_imagens)
+        if classe == PRIORIDADE_SENSORES and profundidade >= self.limiar_amostragem:
+            if self.amostravel is not None and not self.amostravel(topic):
+                return None
+            self._amostras[topic] += 1
+            if self._amostras[topic] % self.amostragem:
+                return "amostragem"
+        return None
+
+    def _descarte_quadro(self, quadro, acima_do_limiar):
+        """Decide o descarte na primeira parte de cada quadro e repete a decisão nas seguintes"""
+        if quadro is None:
+            return "imagens" if acima_do_limiar else None
+        aceito = self._quadros.get(quadro)
+        if aceito is None:
+            aceito = self._quadros[quadro] = not acima_do_limiar
+            if len(self._quadros) > INGESTAO_QUADROS_LEMBRADOS:
+                self._quadros.popitem(last=False)
+        return None if aceito else "imagens"
+
+    def parar(self, timeout=10.0):
+        """Encerra o worker após drenar as mensagens já enfileiradas"""
+        with self._lock:
+            if not self.ativa:
+                return
+            self.fila.put(_FIM)
+            self.worker.join(timeout)
+            if self.worker.is_alive():
+                logging.error("Worker de ingestão não terminou dentro do tempo limite")
+            else:
+                logging.info("Worker de ingestão MQTT encerrado")
+            self.worker = None
+
+    def _coletar_lote(self):
+        """Aguarda a primeira mensagem (ou a próxima tarefa) e coleta até N mensagens ou T ms"""
+        lote = []
+        try:
+            item = self.fila.get(timeout=self._espera_tarefas())
+        except queue.Empty:
+            return lote, False
+        if item is _FIM:
+            return lote, True
+        lote.append(item[2:])
+
+        limite = time.monotonic() + self.lote_ms / 1000
+        while len(lote) < self.lote_mensagens:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                item = self.fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            if item is _FIM:
+                return lote, True
+            lote.append(item[2:])
+        return lote, False
+
+    def _executar(self):
+        encerrar = False
+        while not encerrar:
+            lote, encerrar = self._coletar_lote()
+            if lote:
+                self._descarregar(lote)
+            self._executar_tarefas()
+
+        # Drenar o que sobrou na fila antes de sair
+        restantes = []
+        while True:
+            try:
+                item = self.fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _FIM:
+                restantes.append(item[2:])
+        for inicio in range(0, len(restantes), self.lote_mensagens):
+            self._descarregar(restantes[inicio : inicio + self.lote_mensagens])
+        self._executar_tarefas(forcar=True)
+
+    def _descarregar(self, lote):
+        inicio = time.perf_counter()
+        try:
+            self.processar_lote(lote)
+        except Exception as e:
+            self.erros += 1
+            logging.error(f"Erro ao processar lote de {len(lote)} mensagens: {e}")
+        finally:
+            latencia = (time.perf_counter() - inicio) * 1000
+            self.lotes += 1
+            self.processadas += len(lote)
+            self.ultima_latencia_ms = latencia
+            self.maior_latencia_ms = max(self.maior_latencia_ms, latencia)
+            self._soma_latencia_ms += latencia
+
+    def status(self):
+        return {
+            "ativa": self.ativa,
+            "profundidade": self.fila.qsize(),
+            "capacidade": self.capacidade,
+            "recebidas": self.recebidas,
+            "descartadas": self.descartadas,
+            "descartes": dict(self.descartes),
+            "processadas": self.processadas,
+            "lotes": self.lotes,
+            "erros": self.erros,
+            "ultima_latencia_ms": round(self.ultima_latencia_ms, 2) if self.ultima_latencia_ms is not None else None,
+            "media_latencia_ms": round(self._soma_latencia_ms / self.lotes, 2) if self.lotes else None,
+            "maior_latencia_ms": round(self.maior_latencia_ms, 2),
+        }
@@ -0,0 +1,131 @@
+"""
+Geração das versões redimensionadas das imagens da câmera com OpenCV.
+
+Depois que o original é gravado (lib/imagens.py), a miniatura e a versão média são
+geradas em um pool de threads, fora do worker de ingestão, e gravadas ao lado do
+original como <sha256>_<tamanho>. Sem o pacote opcional opencv-python-headless as
+imagens continuam sendo servidas no tamanho original.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+
+try:
+    import cv2
+    import numpy
+except ImportError:  # pragma: no cover - dependência opcional
+    cv2 = None
+    numpy = None
+
+# Maior lado (px) de cada versão gerada
+TAMANHOS_IMAGEM = {
+    "miniatura": int(getenv("IMAGENS_MINIATURA_PX", 160)),
+    "media": int(getenv("IMAGENS_MEDIA_PX", 640)),
+}
+# Formato (webp ou jpeg) e qualidade (0-100) das versões geradas
+IMAGENS_DERIVADOS_FORMATO = getenv("IMAGENS_DERIVADOS_FORMATO", "webp").lower()
+IMAGENS_DERIVADOS_QUALIDADE = int(getenv("IMAGENS_DERIVADOS_QUALIDADE", 80))
+IMAGENS_DERIVADOS_THREADS = int(getenv("IMAGENS_DERIVADOS_THREADS", 2))
+
+
+def redimensionar(dados, lado, formato=IMAGENS_DERIVADOS_FORMATO, qualidade=IMAGENS_DERIVADOS_QUALIDADE):
+    """Reduz a imagem para que o maior lado tenha no máximo lado px e a codifica em webp ou jpeg"""
+    imagem = cv2.imdecode(numpy.frombuffer(dados, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+    if imagem is None:
+        raise ValueError("Imagem em formato não reconhecido pelo OpenCV")
+    altura, largura = imagem.shape[:2]
+    escala = lado / max(altura, largura)
+    if escala < 1:
+        tamanho = (max(1, round(largura * escala)), max(1, round(altura * escala)))
+        imagem = cv2.resize(imagem, tamanho, interpolation=cv2.INTER_AREA)
+
+    if formato == "webp":
+        extensao, parametros = ".webp", [cv2.IMWRITE_WEBP_QUALITY, qualidade]
+    else:
+        extensao, parametros = ".jpg", [cv2.IMWRITE_JPEG_QUALITY, qualidade]
+    sucesso, codificada = cv2.imencode(extensao, imagem, parametros)
+    if not sucesso:
+        raise ValueError(f"Falha ao codificar a imagem em {formato}")
+    return codificada.tobytes()
+
+
+class GeradorMiniaturas:
+    """Pool de threads que grava as versões de cada imagem nova no armazenamento"""
+
+    def __init__(
+        self,
+        armazem,
+        tamanhos=None,
+        formato=IMAGENS_DERIVADOS_FORMATO,
+        qualidade=IMAGENS_DERIVADOS_QUALIDADE,
+        threads=IMAGENS_DERIVADOS_THREADS,
+    ):
+        self.armazem = armazem
+        self.tamanhos = dict(TAMANHOS_IMAGEM if tamanhos is None else tamanhos)
+        self.formato = formato
+        self.qualidade = qualidade
+        self.threads = max(1, threads)
+        self._executor = None
+        self._em_andamento = set()
+        self._lock = threading.Lock()
+
+        # Métricas expostas em status()
+        self.geradas = 0
+        self.falhas = 0
+
+    @property
+    def disponivel(self):
+        return cv2 is not None and bool(self.tamanhos)
+
+    def enfileirar(self, sha256):
+        """Agenda a geração das versões da imagem; retorna o Future ou None se não houver o que fazer"""
+        if not self.disponivel:
+            return None
+        with self._lock:
+            if sha256 in self._em_andamento:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="miniaturas")
+            self._em_andamento.add(sha256)
+        return self._executor.submit(self.gerar, sha256)
+
+    def gerar(self, sha256):
+        """Grava as versões que ainda não existem; retorna quantas foram geradas"""
+        try:
+            faltantes = {nome: lado for nome, lado in self.tamanhos.items() if not self.armazem.possui_derivado(sha256, nome)}
+            if not faltantes:
+                return 0
+            original = self.armazem.ler(sha256)
+            if original is None:
+                return 0
+            for nome, lado in faltantes.items():
+                self.armazem.salvar_derivado(sha256, nome, redimensionar(original, lado, self.formato, self.qualidade))
+            with self._lock:
+                self.geradas += len(faltantes)
+            return len(faltantes)
+        except Exception as e:
+            with self._lock:
+                self.falhas += 1
+            logging.error(f"Erro ao gerar as versões da imagem {sha256[:12]}: {e}")
+            return 0
+        finally:
+            with self._lock:
+                self._em_andamento.discard(sha256)
+
+    def parar(self, aguardar=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=aguardar)
+
+    def status(self):
+        return {
+            "disponivel": self.disponivel,
+            "tamanhos": self.tamanhos,
+            "formato": self.formato,
+            "pendentes": len(self._em_andamento),
+            "geradas": self.geradas,
+            "falhas": self.falhas,
+        }
@@ -1,6 +1,9 @@
+import hashlib
 from base64 import b64encode
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import validates
 
 # * Constants
 USUARIO_ID = "usuario.id"
@@ -26,6 +29,7 @@ class Sessao(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String, nullable=False)
     cultura_id = db.Column(db.Integer, db.ForeignKey(CULTURA_ID), nullable=False)
+    ativa = db.Column(db.Boolean, nullable=False, default=True)  # Recebe leituras dos sensores via MQTT
     irrigacoes = db.relationship("SessaoIrrigacao", backref="sessao", lazy=True)
     dados_periodicos = db.relationship("DadoPeriodico", backref="sessao", lazy=True)
 
@@ -41,17 +45,88 @@ class SessaoIrrigacao(db.Model):
 
 class DadoPeriodico(db.Model):
     __tablename__ = "dado_periodico"
+    # No PostgreSQL particionado por mês a chave é (id, data_hora), ver lib/particoes.py
     id = db.Column(db.Integer, primary_key=True)
     data_hora = db.Column(db.TIMESTAMP, nullable=False, default=db.func.current_timestamp())
     temperatura = db.Column(db.Float, nullable=False)
     umidade_ar = db.Column(db.Float, nullable=False)
     umidade_solo = db.Column(db.Float, nullable=False)
-    imagem = db.Column(db.LargeBinary)
+    # Coluna antiga com os bytes da imagem: carregada só quando acessada (as novas ficam em disco)
+    imagem = db.deferred(db.Column(db.LargeBinary))
+    # Referência (sha256) da imagem no armazenamento em disco, ver lib/imagens.py
+    imagem_sha256 = db.Column(db.String(64))
     cultura_id = db.Column(db.Integer, db.ForeignKey(CULTURA_ID), nullable=False)
     sessao_id = db.Column(db.Integer, db.ForeignKey("sessao.id"), nullable=False)
     exaustor_ligado = db.Column(db.Boolean, nullable=False)
 
 
+class AgregadoLeitura(db.Model):
+    """Mínimo, máximo, soma e último valor das leituras de uma sessão em um intervalo (lib/agregados.py)"""
+
+    __tablename__ = "agregado_leitura"
+    id = db.Column(db.Integer, primary_key=True)
+    sessao_id = db.Column(db.Integer, db.ForeignKey("sessao.id"), nullable=False)
+    resolucao = db.Column(db.String(6), nullable=False)  # 'minuto', 'hora', 'dia'
+    inicio = db.Column(db.TIMESTAMP, nullable=False)
+    contagem = db.Column(db.Integer, nullable=False)
+    ultima_data_hora = db.Column(db.TIMESTAMP, nullable=False)
+    temperatura_min = db.Column(db.Float, nullable=False)
+    temperatura_max = db.Column(db.Float, nullable=False)
+    temperatura_soma = db.Column(db.Float, nullable=False)
+    temperatura_ultimo = db.Column(db.Float, nullable=False)
+    umidade_ar_min = db.Column(db.Float, nullable=False)
+    umidade_ar_max = db.Column(db.Float, nullable=False)
+    umidade_ar_soma = db.Column(db.Float, nullable=False)
+    umidade_ar_ultimo = db.Column(db.Float, nullable=False)
+    umidade_solo_min = db.Column(db.Float, nullable=False)
+    umidade_solo_max = db.Column(db.Float, nullable=False)
+    umidade_solo_soma = db.Column(db.Float, nullable=False)
+    umidade_solo_ultimo = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("sessao_id", "resolucao", "inicio"),
+        # Recuperação e recálculo por período, sem filtrar por sessão
+        db.Index("idx_agregado_leitura_resolucao_inicio", "resolucao", "inicio"),
+    )
+
+
+class UltimoDadoSessao(db.Model):
+    """Última leitura, última imagem e estado da irrigação de cada sessão (lib/ultimos.py)"""
+
+    __tablename__ = "ultimo_dado_sessao"
+    sessao_id = db.Column(db.Integer, db.ForeignKey("sessao.id"), primary_key=True)
+    data_hora = db.Column(db.TIMESTAMP)
+    temperatura = db.Column(db.Float)
+    umidade_ar = db.Column(db.Float)
+    umidade_solo = db.Column(db.Float)
+    exaustor_ligado = db.Column(db.Boolean)
+    imagem_sha256 = db.Column(db.String(64))
+    imagem_data_hora = db.Column(db.TIMESTAMP)  # Preenchida também para imagens antigas, sem sha256
+    esta_irrigando = db.Column(db.Boolean, nullable=False, default=False)
+    irrigacao_inicio = db.Column(db.TIMESTAMP)
+
+
+@event.listens_for(DadoPeriodico, "after_insert")
+def _atualizar_ultimo_dado(mapper, connection, dado):
+    """Leituras gravadas pelo ORM; o lote da ingestão chama lib.ultimos.registrar diretamente"""
+    from lib.ultimos import CAMPOS_ULTIMO, registrar
+
+    estado = inspect(dado).dict
+    leitura = {campo: estado.get(campo) for campo in CAMPOS_ULTIMO + ("sessao_id", "imagem_sha256", "imagem")}
+    if leitura["data_hora"] is None:
+        # Horário preenchido pelo banco (current_timestamp): lido de volta, não estimado
+        leitura["data_hora"] = connection.scalar(select(DadoPeriodico.data_hora).where(DadoPeriodico.id == dado.id))
+    registrar(connection, [leitura])
+
+
+@event.listens_for(SessaoIrrigacao, "after_insert")
+@event.listens_for(SessaoIrrigacao, "after_update")
+def _atualizar_irrigacao_ultimo_dado(mapper, connection, irrigacao):
+    from lib.ultimos import registrar_irrigacao
+
+    registrar_irrigacao(connection, [irrigacao.sessao_id])
+
+
 class CondicaoIdeal(db.Model):
     __tablename__ = "condicao_ideal"
     id = db.Column(db.Integer, primary_key=True)
@@ -128,8 +203,13 @@ class Usuario(db.Model):
     nome = db.Column(db.String, nullable=False)
     email = db.Column(db.String, nullable=False, unique=True)
     senha = db.Column(db.String)
-    foto = db.Column(db.LargeBinary)
+    # Carregada só quando acessada; páginas e API usam /api/usuarios/<id>/foto
+    foto = db.deferred(db.Column(db.LargeBinary))
+    # sha256 da foto, usado como ETag e para saber se há foto sem carregar os bytes
+    foto_sha256 = db.Column(db.String(64))
     token_recuperacao = db.Column(db.String)
+    # Contador desnormalizado de notificacao_usuario não lidas, ver lib/notificacoes.py
+    notificacoes_nao_lidas = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     logs = db.relationship("Log", backref="usuario", lazy=True)
     tentativas_acesso = db.relationship("TentativaAcesso", backref="usuario", lazy=True)
     notificacoes = db.relationship("NotificacaoUsuario", backref="usuario", lazy=True)
@@ -139,6 +219,11 @@ class Usuario(db.Model):
     is_active = True
     is_anonymous = False
 
+    @validates("foto")
+    def _atualizar_foto_sha256(self, _chave, foto):
+        self.foto_sha256 = hashlib.sha256(foto).hexdigest() if foto else None
+        return foto
+
     @property
     def foto_base64(self):
         if self.foto:
@@ -198,6 +283,19 @@ class NotificacaoUsuario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     notificacao_id = db.Column(db.Integer, db.ForeignKey("notificacao.id"), nullable=False)
     usuario_id = db.Column(db.Integer, db.ForeignKey(USUARIO_ID), nullable=False)
+    lida = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    notificacao = db.relationship("Notificacao", lazy="joined")
+
+    __table_args__ = (db.Index("idx_notificacao_usuario_usuario_lida", "usuario_id", "lida"),)
+
+
+class InteresseSessao(db.Model):
+    __tablename__ = "interesse_sessao"
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey(USUARIO_ID), nullable=False)
+    sessao_id = db.Column(db.Integer, db.ForeignKey("sessao.id"), nullable=False)
+
+    __table_args__ = (db.UniqueConstraint("sessao_id", "usuario_id"),)
 
 
 # ? Tabelas de controle de dispositivos IoT
@@ -220,6 +318,11 @@ class ComandoDispositivo(db.Model):
     sessao_id = db.Column(db.Integer, db.ForeignKey("sessao.id"), nullable=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey(USUARIO_ID), nullable=False)
     executado = db.Column(db.Boolean, default=False)
+    uuid = db.Column(db.String(36), unique=True, nullable=True)  # comando_id enviado no payload
+    estado = db.Column(db.String, nullable=False, default="PENDENTE")  # 'PENDENTE', 'CONFIRMADO', 'EXPIRADO', 'FALHOU'
+    tentativas = db.Column(db.Integer, nullable=False, default=1)
+    confirmado_em = db.Column(db.TIMESTAMP, nullable=True)
+    latencia_ms = db.Column(db.Float, nullable=True)  # Tempo entre o envio e o status do dispositivo
 
 
 class StatusMQTT(db.Model):
@@ -229,3 +332,17 @@ class StatusMQTT(db.Model):
     ultima_mensagem = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
     status_conexao = db.Column(db.Boolean, default=False)
     erro_ultimo = db.Column(db.String, nullable=True)
+    mensagens = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_recebidos = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class MensagemRecebida(db.Model):
+    """Identidades das mensagens já gravadas, guarda contra reentregas QoS 1"""
+
+    __tablename__ = "mensagem_recebida"
+    __table_args__ = (db.UniqueConstraint("particao", "dispositivo", "mensagem"),)
+    id = db.Column(db.Integer, primary_key=True)
+    particao = db.Column(db.Integer, nullable=False, default=0)  # Worker no modo de assinatura compartilhada
+    dispositivo = db.Column(db.String(100), nullable=False)
+    mensagem = db.Column(db.String(100), nullable=False)  # msg_id ou seq enviado pelo dispositivo
+    recebida_em = db.Column(db.TIMESTAMP, nullable=False, default=db.func.current_timestamp(), index=True)
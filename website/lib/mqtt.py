@@ -9,26 +9,14 @@ from base64 import b64decode
 import paho.mqtt.client as mqtt
 from flask import current_app as app
 
+from lib.topicos import MQTT_TOPICS
+
 # Configurações do Broker MQTT
 MQTT_BROKER = getenv("MQTT_URL")
 MQTT_PORT = int(getenv("MQTT_PORT", 8883))
 MQTT_USERNAME = getenv("MQTT_USERNAME")
 MQTT_PASSWORD = getenv("MQTT_PASSWORD")
 
-MQTT_TOPICS = {
-    "temperatura": "estufa/temperatura",
-    "umidade_ar": "estufa/umidade/ar",
-    "umidade_solo": "estufa/umidade/solo/#",
-    "camera": "estufa/camera/imagem",
-    "irrigacao_status": "estufa/irrigacao/status",
-    "ventilacao_status": "estufa/ventilacao/status",
-    "iluminacao_status": "estufa/iluminacao/status",
-    "alerta": "estufa/alerta",
-    "irrigacao_manual": "estufa/irrigacao/manual",
-    "ventilacao_manual": "estufa/ventilacao/manual",
-    "iluminacao_manual": "estufa/iluminacao/manual",
-}
-
 
 class MQTTClient:
     def __init__(self):
@@ -0,0 +1,276 @@
+"""
+Motor asyncio para o cliente MQTT.
+
+Um único event loop, em uma thread própria, cuida da conexão (via callbacks de
+socket do paho), das reconexões com backoff exponencial e jitter, da fila de
+ingestão e das tarefas periódicas. As gravações no banco são feitas por um
+executor de uma thread, preservando a ordem das mensagens.
+
+Ativado com MQTT_MOTOR=asyncio; os handlers e o roteamento do MQTTClient são os mesmos.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+
+from lib.ingestao import _FIM, FilaIngestao
+
+# Configurações de reconexão
+MQTT_BACKOFF_BASE_S = float(getenv("MQTT_BACKOFF_BASE_S", 1))
+MQTT_BACKOFF_MAX_S = float(getenv("MQTT_BACKOFF_MAX_S", 60))
+
+
+def backoff(tentativa, base=MQTT_BACKOFF_BASE_S, maximo=MQTT_BACKOFF_MAX_S):
+    """Espera antes da próxima tentativa: exponencial limitado com jitter completo"""
+    return random.uniform(0, min(maximo, base * 2**tentativa))
+
+
+class FilaIngestaoAsync(FilaIngestao):
+    """FilaIngestao drenada por uma tarefa asyncio, com as gravações em um executor dedicado
+
+    enfileirar() deve ser chamado na thread do event loop (onde o paho dispara on_message).
+    As regras de prioridade e descarte são as mesmas da FilaIngestao.
+    """
+
+    def __init__(self, processar_lote, **kwargs):
+        super().__init__(processar_lote, **kwargs)
+        self.fila = asyncio.PriorityQueue()
+        self.loop = None
+        self._executor = None
+        self._consumidor = None
+
+    @property
+    def ativa(self):
+        return self._consumidor is not None and not self._consumidor.done()
+
+    def iniciar(self):
+        """A fila é iniciada pelo MotorAsyncio dentro do event loop"""
+
+    def iniciar_no_loop(self, loop):
+        self.loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mqtt-gravacao")
+        self._consumidor = loop.create_task(self._executar())
+        logging.info("Fila de ingestão asyncio iniciada")
+
+    def parar(self, timeout=10.0):
+        """O encerramento é conduzido pelo MotorAsyncio.parar()"""
+
+    async def encerrar(self):
+        """Sinaliza o fim, aguarda a drenagem da fila e libera o executor"""
+        if not self.ativa:
+            return
+        await self.fila.put(_FIM)
+        await self._consumidor
+        self._executor.shutdown(wait=True)
+        logging.info("Fila de ingestão asyncio encerrada")
+
+    async def _coletar_lote(self):
+        lote = []
+        try:
+            item = await asyncio.wait_for(self.fila.get(), timeout=self._espera_tarefas())
+        except asyncio.TimeoutError:
+            return lote, False
+        if item is _FIM:
+            return lote, True
+        lote.append(item[2:])
+
+        limite = time.monotonic() + self.lote_ms / 1000
+        while len(lote) < self.lote_mensagens:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.fila.get(), timeout=restante)
+            except asyncio.TimeoutError:
+                break
+            if item is _FIM:
+                return lote, True
+            lote.append(item[2:])
+        return lote, False
+
+    async def _gravar(self, funcao, *args):
+        await self.loop.run_in_executor(self._executor, funcao, *args)
+
+    async def _executar(self):
+        encerrar = False
+        while not encerrar:
+            lote, encerrar = await self._coletar_lote()
+            if lote:
+                await self._gravar(self._descarregar, lote)
+            await self._gravar(self._executar_tarefas)
+
+        restantes = []
+        while not self.fila.empty():
+            item = self.fila.get_nowait()
+            if item is not _FIM:
+                restantes.append(item[2:])
+        for inicio in range(0, len(restantes), self.lote_mensagens):
+            await self._gravar(self._descarregar, restantes[inicio : inicio + self.lote_mensagens])
+        await self._gravar(self._executar_tarefas, True)
+
+
+class MotorAsyncio:
+    """Conduz o cliente paho e a ingestão de um MQTTClient a partir de um event loop próprio"""
+
+    def __init__(self, cliente, base_backoff=None, max_backoff=None, intervalo_manutencao=1.0):
+        self.cliente = cliente
+        self.base_backoff = MQTT_BACKOFF_BASE_S if base_backoff is None else base_backoff
+        self.max_backoff = MQTT_BACKOFF_MAX_S if max_backoff is None else max_backoff
+        self.intervalo_manutencao = intervalo_manutencao
+        self.loop = None
+        self.thread = None
+        self._parando = None
+        self._conexao = None
+        self._conectou = False
+        self._lock = threading.Lock()
+
+        # Métricas expostas em status()
+        self.tentativas = 0
+        self.reconexoes = 0
+        self.proxima_espera_s = None
+
+    @property
+    def ativo(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def iniciar(self, host, porta, keepalive=60):
+        with self._lock:
+            if self.ativo:
+                return
+            self.host, self.porta, self.keepalive = host, porta, keepalive
+            self.loop = asyncio.new_event_loop()
+            pronto = threading.Event()
+            self.thread = threading.Thread(target=self._executar, args=(pronto,), name="mqtt-asyncio")
+            self.thread.daemon = True
+            self.thread.start()
+            pronto.wait(timeout=10)
+            logging.info("Motor asyncio MQTT iniciado")
+
+    def parar(self, timeout=10.0):
+        """Desconecta, drena a fila de ingestão e encerra o event loop"""
+        with self._lock:
+            if not self.ativo:
+                return
+            self.loop.call_soon_threadsafe(self._parando.set)
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logging.error("Motor asyncio MQTT não terminou dentro do tempo limite")
+            else:
+                logging.info("Motor asyncio MQTT encerrado")
+            self.thread = None
+
+    def reconectar(self):
+        """Agenda uma reconexão com backoff (pode ser chamado de qualquer thread)"""
+        if self.ativo:
+            self.loop.call_soon_threadsafe(self._agendar_conexao)
+
+    def _executar(self, pronto):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._principal(pronto))
+        finally:
+            self.loop.close()
+
+    async def _principal(self, pronto):
+        self._parando = asyncio.Event()
+        self._registrar_sockets()
+        self.cliente.ingestao.iniciar_no_loop(self.loop)
+        manutencao = self.loop.create_task(self._manutencao())
+        self._agendar_conexao()
+        pronto.set()
+
+        await self._parando.wait()
+
+        for tarefa in (manutencao, self._conexao):
+            if tarefa is not None:
+                tarefa.cancel()
+        try:
+            if self.cliente.connected:
+                self.cliente.mqtt_client.disconnect()
+                self.cliente.mqtt_client.loop_write()
+        except Exception as e:
+            logging.error(f"Erro ao desconectar do broker MQTT: {e}")
+        await self.cliente.ingestao.encerrar()
+
+    # Integração do paho com o event loop pelos callbacks de socket
+    def _registrar_sockets(self):
+        paho = self.cliente.mqtt_client
+        paho.on_socket_open = self._socket_aberto
+        paho.on_socket_close = self._socket_fechado
+        paho.on_socket_register_write = self._registrar_escrita
+        paho.on_socket_unregister_write = self._cancelar_escrita
+
+    def _socket_aberto(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_reader, sock, self._ler)
+
+    def _socket_fechado(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self._remover_socket, sock)
+
+    def _registrar_escrita(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock, self._escrever)
+
+    def _cancelar_escrita(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock)
+
+    def _remover_socket(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+
+    def _ler(self):
+        self.cliente.mqtt_client.loop_read()
+
+    def _escrever(self):
+        self.cliente.mqtt_client.loop_write()
+
+    async def _manutencao(self):
+        """Keepalive e retransmissões do paho a cada intervalo"""
+        while True:
+            await asyncio.sleep(self.intervalo_manutencao)
+            try:
+                self.cliente.mqtt_client.loop_misc()
+            except Exception as e:
+                logging.error(f"Erro na manutenção da conexão MQTT: {e}")
+
+    def _agendar_conexao(self):
+        if self._parando.is_set() or (self._conexao is not None and not self._conexao.done()):
+            return
+        self._conexao = self.loop.create_task(self._conectar())
+
+    async def _conectar(self):
+        """Tenta conectar até conseguir, esperando backoff(tentativa) entre as falhas"""
+        tentativa = 0
+        while not self._parando.is_set():
+            self.tentativas += 1
+            try:
+                # connect() resolve o nome e faz o handshake TLS: roda fora do event loop
+                await self.loop.run_in_executor(None, self.cliente.mqtt_client.connect, self.host, self.porta, self.keepalive)
+                if self._conectou:
+                    self.reconexoes += 1
+                self._conectou = True
+                self.proxima_espera_s = None
+                logging.info(f"Conexão MQTT estabelecida com {self.host}:{self.porta}")
+                return
+            except Exception as e:
+                espera = backoff(tentativa, self.base_backoff, self.max_backoff)
+                tentativa += 1
+                self.proxima_espera_s = espera
+                self.cliente.last_error = str(e)
+                self.cliente.update_mqtt_status("DESCONECTADO", str(e))
+                logging.warning(f"Falha ao conectar ao broker MQTT ({e}); nova tentativa em {espera:.1f}s")
+                try:
+                    await asyncio.wait_for(self._parando.wait(), timeout=espera)
+                except asyncio.TimeoutError:
+                    pass
+
+    def status(self):
+        return {
+            "tipo": "asyncio",
+            "ativo": self.ativo,
+            "tentativas": self.tentativas,
+            "reconexoes": self.reconexoes,
+            "proxima_espera_s": round(self.proxima_espera_s, 2) if self.proxima_espera_s is not None else None,
+        }
@@ -1,50 +1,163 @@
+import atexit
 import json
 import logging
 import uuid
 import threading
 import ssl
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
 from os import getenv
 from base64 import b64decode
 from datetime import datetime
 
 import paho.mqtt.client as mqtt
+from sqlalchemy import bindparam, text, update
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from lib.agregados import AgregadorLeituras
+from lib.arquivo import ARQUIVO_ANTES_RETENCAO, ArquivoColunar
+from lib.cache import AtividadeTopicos, CacheLeituras, RegistroSessoes
+from lib.coalescencia import Coalescedor
+from lib.comandos import RastreadorComandos
+from lib.deduplicacao import FiltroDuplicatas, identidade
+from lib.imagens import ArmazemImagens, MontadorQuadros
+from lib.miniaturas import GeradorMiniaturas
+from lib.ingestao import PRIORIDADE_ALTA, PRIORIDADE_IMAGENS, PRIORIDADE_SENSORES, FilaIngestao, LoteEscrita
+from lib.notificacoes import nivel_acesso_alerta, notificar
+from lib.particoes import PARTICOES_INTERVALO_S, GerenciadorParticoes
+from lib.payload import PayloadInvalido, chave_quadro, decodificar
+from lib.retencao import RETENCAO_INTERVALO_S, MotorRetencao
+from lib.spool import SpoolIngestao
+from lib.topicos import MQTT_TOPICS, Particionamento, RoteadorTopicos
+from lib import ultimos
 
 # Configurações do Broker MQTT
 MQTT_BROKER = getenv("MQTT_URL")
 MQTT_PORT = int(getenv("MQTT_PORT", 8883))
 MQTT_USERNAME = getenv("MQTT_USERNAME")
 MQTT_PASSWORD = getenv("MQTT_PASSWORD")
+MQTT_TLS = getenv("MQTT_TLS", "true").lower() not in ("0", "false", "no")
+# Intervalo (s) entre gravações do status dos tópicos em status_mqtt
+MQTT_STATUS_INTERVALO_S = float(getenv("MQTT_STATUS_INTERVALO_S", 5))
+
+# Modo de assinatura compartilhada (MQTTv5): vários workers dividem a ingestão
+MQTT_GRUPO_COMPARTILHADO = getenv("MQTT_GRUPO_COMPARTILHADO")
+MQTT_WORKER_INDICE = int(getenv("MQTT_WORKER_INDICE", 0))
+MQTT_WORKERS = int(getenv("MQTT_WORKERS", 1))
+# Recarga periódica (s) das sessões ativas, necessária quando as sessões são editadas em outro processo
+REGISTRO_SESSOES_TTL_S = float(getenv("REGISTRO_SESSOES_TTL_S", 0))
+
+# Intervalo (s) da limpeza das identidades de mensagens fora da retenção
+DEDUP_LIMPEZA_S = float(getenv("DEDUP_LIMPEZA_S", 600))
 
-MQTT_TOPICS = {
-    "temperatura": "estufa/temperatura",
-    "umidade_ar": "estufa/umidade/ar",
-    "umidade_solo": "estufa/umidade/solo/#",
-    "camera": "estufa/camera/imagem",
-    "irrigacao_status": "estufa/irrigacao/status",
-    "ventilacao_status": "estufa/ventilacao/status",
-    "iluminacao_status": "estufa/iluminacao/status",
-    "alerta": "estufa/alerta",
-    "irrigacao_manual": "estufa/irrigacao/manual",
-    "ventilacao_manual": "estufa/ventilacao/manual",
-    "iluminacao_manual": "estufa/iluminacao/manual",
-}
+# Verificação (s) do banco para reproduzir o spool e tempo de reprodução por vez, entre
+# dois lotes da fila; com o banco de volta, a reprodução continua até esvaziar o spool
+SPOOL_VERIFICACAO_S = float(getenv("SPOOL_VERIFICACAO_S", 5))
+SPOOL_REPRODUCAO_TEMPO_MAX_S = float(getenv("SPOOL_REPRODUCAO_TEMPO_MAX_S", 0.5))
+
+# Erros que indicam banco fora do ar (e não dados inválidos): o lote vai para o spool
+ERROS_BANCO_INDISPONIVEL = (OperationalError, InterfaceError, PoolTimeoutError)
+
+# Motor do cliente: "thread" (loop_forever + worker de ingestão) ou "asyncio" (lib/mqtt_async.py)
+MQTT_MOTOR = getenv("MQTT_MOTOR", "thread")
 
 
 class MQTTClient:
-    def __init__(self, app=None):
+    def __init__(self, app=None, particionamento=None, motor=None):
         self.app = app
-        self.mqtt_client = mqtt.Client(protocol=mqtt.MQTTv311, client_id=f"FlaskClient-{uuid.uuid4()}")
+
+        # Partição deste worker; sem grupo compartilhado o processo recebe todo o tráfego
+        self.particionamento = particionamento or Particionamento(
+            MQTT_GRUPO_COMPARTILHADO, MQTT_WORKER_INDICE, MQTT_WORKERS
+        )
+        protocolo = mqtt.MQTTv5 if self.particionamento.ativo else mqtt.MQTTv311
+        self.mqtt_client = mqtt.Client(protocol=protocolo, client_id=f"FlaskClient-{uuid.uuid4()}")
         self.mqtt_client.on_connect = self.on_connect
         self.mqtt_client.on_message = self.on_message
         self.mqtt_client.on_disconnect = self.on_disconnect
         self.connected = False
         self.last_error = None
-        
-        # Configurar TLS para HiveMQ Cloud
-        context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        self.mqtt_client.tls_set_context(context)
+
+        # Fila de ingestão: a thread de rede só enfileira, o worker grava em lote
+        if (motor or MQTT_MOTOR) == "asyncio":
+            from lib.mqtt_async import FilaIngestaoAsync, MotorAsyncio
+
+            self.ingestao = FilaIngestaoAsync(
+                self.processar_lote, classificar=self.prioridade, quadro=self.quadro, amostravel=self.amostravel
+            )
+            self.motor = MotorAsyncio(self)
+        else:
+            self.ingestao = FilaIngestao(
+                self.processar_lote, classificar=self.prioridade, quadro=self.quadro, amostravel=self.amostravel
+            )
+            self.motor = None
+        self._local = threading.local()
+
+        # Últimos valores por sessão, evitando consultar dado_periodico a cada mensagem
+        self.leituras = CacheLeituras()
+
+        # Sessões ativas para o fan-out, invalidadas pelas rotas de administração de sessões
+        self.sessoes = RegistroSessoes(filtro=self.particionamento.possui, ttl=REGISTRO_SESSOES_TTL_S)
+
+        # Leituras parciais da mesma sessão são mescladas por janela de tempo
+        self.coalescedor = Coalescedor()
+
+        # Agregados por minuto, hora e dia mantidos a cada lote de leituras
+        self.agregados = AgregadorLeituras()
+
+        # Vitalidade por tópico em memória, gravada em lote em status_mqtt
+        self.atividade = AtividadeTopicos()
+        self.ingestao.agendar(MQTT_STATUS_INTERVALO_S, self.persistir_atividade)
+
+        # Comandos publicados aguardando confirmação pelo status do dispositivo
+        self.comandos = RastreadorComandos()
+        self.ingestao.agendar(1.0, self.verificar_comandos)
+
+        # Reentregas QoS 1 descartadas pela identidade da mensagem (msg_id/seq)
+        self.duplicatas = FiltroDuplicatas(particao=self.particionamento.indice)
+        self.ingestao.agendar(DEDUP_LIMPEZA_S, self.limpar_duplicatas)
+
+        # Linhas antigas removidas conforme RETENCAO_POLITICAS, em lotes curtos
+        self.retencao = MotorRetencao(arquivo=ArquivoColunar() if ARQUIVO_ANTES_RETENCAO else None)
+        if self.retencao.politicas:
+            self.ingestao.agendar(RETENCAO_INTERVALO_S, self.aplicar_retencao)
+
+        # Partições mensais de dado_periodico criadas à frente e expiradas pela retenção,
+        # com o mesmo arquivamento e garantia dos agregados da retenção por linhas
+        self.particoes = GerenciadorParticoes(preparar=self.retencao.preparar_remocao)
+        self.ingestao.agendar(PARTICOES_INTERVALO_S, self.manter_particoes)
+
+        # Mensagens guardadas em disco enquanto o banco está indisponível
+        self.spool = SpoolIngestao()
+        self.ingestao.agendar(SPOOL_VERIFICACAO_S, self.reproduzir_spool)
+
+        # Imagens gravadas em disco por sha256; quadros em partes remontados no worker
+        self.imagens = ArmazemImagens()
+        self.miniaturas = GeradorMiniaturas(self.imagens)
+        self.quadros = MontadorQuadros()
+        self.ingestao.agendar(max(self.quadros.timeout_s / 2, 0.05), self.expirar_quadros)
+
+        # Mensagens recebidas por formato de payload
+        self.formatos = Counter()
+
+        # Mensagens de lote (estufa/leituras), leituras gravadas e descartadas
+        self.lotes_leituras = Counter()
+
+        # Roteamento dos tópicos recebidos para os handlers
+        self.roteador = RoteadorTopicos()
+        self.registrar_rotas()
+
+        # Sempre agendado: janelas por sessão podem existir com a janela padrão em 0
+        self.ingestao.agendar(self.coalescedor.intervalo_verificacao_s(), self.descarregar_janelas)
+
+        # Configurar TLS para HiveMQ Cloud (desativável para um broker local)
+        if MQTT_TLS:
+            context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self.mqtt_client.tls_set_context(context)
         
         # Configurar credenciais
         if MQTT_USERNAME and MQTT_PASSWORD:
@@ -57,12 +170,40 @@ class MQTTClient:
     def init_app(self, app):
         self.app = app
         app.mqtt_client = self
+        self.aquecer_cache()
         self.connect_broker()
 
+    def aquecer_cache(self):
+        """Carrega do banco os últimos valores de cada sessão antes de iniciar a ingestão"""
+        from lib.models import db
+
+        try:
+            with self.app.app_context():
+                # Sessões ainda sem linha em ultimo_dado_sessao (tabela recém-criada)
+                ultimos.preencher(db.session.connection())
+                db.session.commit()
+                self.leituras.aquecer()
+                self.duplicatas.aquecer(db.session)
+                # Leituras gravadas enquanto a ingestão estava parada entram nos agregados
+                self.agregados.recuperar(db.session)
+                db.session.commit()
+                # Partição do mês atual existente antes da primeira leitura
+                self.particoes.manter(db.session)
+                db.session.commit()
+        except Exception as e:
+            # Tabelas ainda não criadas: o cache será aquecido na primeira leitura
+            logging.warning(f"Não foi possível aquecer o cache de leituras: {e}")
+
     def connect_broker(self):
         try:
             if MQTT_BROKER and MQTT_PORT:
                 logging.info(f"Tentando conectar ao broker MQTT: {MQTT_BROKER}:{MQTT_PORT}")
+                atexit.register(self.parar)
+                if self.motor:
+                    # O motor asyncio conecta, reconecta e drena a fila no seu event loop
+                    self.motor.iniciar(MQTT_BROKER, MQTT_PORT, 60)
+                    return
+                self.ingestao.iniciar()
                 self.mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
                 
                 # Iniciar o loop MQTT em segundo plano
@@ -82,31 +223,101 @@ class MQTTClient:
             'connected': self.connected,
             'broker': MQTT_BROKER,
             'port': MQTT_PORT,
-            'last_error': self.last_error
+            'last_error': self.last_error,
+            'ingestao': self.ingestao.status(),
+            'coalescencia': self.coalescedor.status(),
+            'agregados': self.agregados.status(),
+            'particoes': self.particoes.status(),
+            'retencao': self.retencao.status(),
+            'rotas': self.roteador.estatisticas(),
+            'atividade': self.atividade.status(),
+            'comandos': self.comandos.status(),
+            'duplicatas': self.duplicatas.status(),
+            'spool': self.spool.status(),
+            'imagens': dict(self.imagens.status(), quadros=self.quadros.status(), miniaturas=self.miniaturas.status()),
+            'formatos': dict(self.formatos),
+            'lotes_leituras': dict(self.lotes_leituras),
+            'particionamento': self.particionamento.status(),
+            'motor': self.motor.status() if self.motor else {'tipo': 'thread'}
         }
 
+    def registrar_rotas(self):
+        # A prioridade define a ordem de processamento e o descarte quando a fila acumula
+        self.roteador.registrar(MQTT_TOPICS["temperatura"], self.processar_temperatura, PRIORIDADE_SENSORES)
+        self.roteador.registrar(MQTT_TOPICS["umidade_ar"], self.processar_umidade_ar, PRIORIDADE_SENSORES)
+        self.roteador.registrar("estufa/umidade/solo/{canteiro}", self.processar_umidade_solo, PRIORIDADE_SENSORES)
+        self.roteador.registrar(MQTT_TOPICS["camera"], self.processar_imagem, PRIORIDADE_IMAGENS)
+        self.roteador.registrar(MQTT_TOPICS["camera_parte"], self.processar_parte_imagem, PRIORIDADE_IMAGENS)
+        self.roteador.registrar(MQTT_TOPICS["irrigacao_status"], self.processar_status_irrigacao, PRIORIDADE_ALTA)
+        self.roteador.registrar(MQTT_TOPICS["ventilacao_status"], self.processar_status_ventilacao, PRIORIDADE_ALTA)
+        self.roteador.registrar(MQTT_TOPICS["iluminacao_status"], self.processar_status_iluminacao, PRIORIDADE_ALTA)
+        self.roteador.registrar(MQTT_TOPICS["alerta"], self.processar_alerta, PRIORIDADE_ALTA)
+        self.roteador.registrar(MQTT_TOPICS["leituras"], self.processar_leituras, PRIORIDADE_SENSORES)
+
+    def prioridade(self, topic):
+        """Classe de prioridade do tópico na fila de ingestão (tópicos desconhecidos contam como sensores)"""
+        rota, _ = self.roteador.resolver(topic)
+        if rota is None or rota.prioridade is None:
+            return PRIORIDADE_SENSORES
+        return rota.prioridade
+
+    def quadro(self, topic, payload):
+        """Chave do quadro das partes de imagem, para a fila descartar quadros inteiros"""
+        rota, _ = self.roteador.resolver(topic)
+        if rota is None or rota.handler != self.processar_parte_imagem:
+            return None
+        return chave_quadro(payload)
+
+    def amostravel(self, topic):
+        """Se a fila pode amostrar o tópico: lotes (estufa/leituras) juntam vários instantes e nunca são amostrados"""
+        rota, _ = self.roteador.resolver(topic)
+        return rota is None or rota.handler != self.processar_leituras
+
+    def esquecer_sessao(self, sessao_id):
+        """Remove do estado em memória uma sessão excluída"""
+        self.sessoes.invalidar()
+        self.leituras.remover(sessao_id)
+        self.coalescedor.descartar(sessao_id)
+
+    def parar(self, timeout=10.0):
+        """Desconecta do broker e drena a fila de ingestão antes de encerrar"""
+        if self.motor:
+            self.motor.parar(timeout)
+        else:
+            try:
+                if self.connected:
+                    self.mqtt_client.disconnect()
+            except Exception as e:
+                logging.error(f"Erro ao desconectar do broker MQTT: {e}")
+            self.ingestao.parar(timeout)
+        self.spool.fechar()
+        self.miniaturas.parar()
+
     def publish(self, topic, payload, qos=1):
+        """Enfileira a publicação no cliente paho sem aguardar o envio ao broker"""
         try:
             if not self.connected:
                 logging.warning("MQTT não conectado. Tentando reconectar...")
                 return False
             
             result = self.mqtt_client.publish(topic, json.dumps(payload), qos)
-            result.wait_for_publish()
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                logging.error(f"Publicação recusada no tópico {topic}: {mqtt.error_string(result.rc)}")
+                return False
             logging.info(f"Mensagem publicada no tópico {topic}: {payload}")
             return True
         except Exception as e:
             logging.error(f"Erro ao publicar mensagem no tópico {topic}: {e}")
             return False
 
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
             self.connected = True
             self.last_error = None
             logging.info("Conectado ao Broker MQTT com sucesso!")
             
             # Subscrever aos tópicos necessários
-            for topic_name, topic in MQTT_TOPICS.items():
+            for topic in self.particionamento.assinaturas():
                 try:
                     client.subscribe(topic)
                     logging.info(f"Inscrito no tópico: {topic}")
@@ -124,35 +335,41 @@ class MQTTClient:
                 4: "Usuário ou senha incorretos",
                 5: "Não autorizado"
             }
-            error_msg = error_messages.get(rc, f"Erro desconhecido: {rc}")
+            error_msg = error_messages.get(getattr(rc, "value", rc), f"Erro desconhecido: {rc}")
             self.last_error = error_msg
             logging.error(f"Falha na conexão MQTT: {error_msg}")
             self.update_mqtt_status("DESCONECTADO", error_msg)
 
     def on_message(self, client, userdata, msg):
-        try:
-            topic = msg.topic
-            payload = msg.payload.decode()
-            logging.info(f"Mensagem recebida no tópico {topic}: {payload}")
-            
-            # Processar mensagem com contexto Flask
-            if self.app:
-                with self.app.app_context():
-                    self.process_message(topic, payload)
-            else:
-                logging.warning("App context não disponível para processar mensagem")
-                
-        except Exception as e:
-            logging.error(f"Erro ao processar mensagem do tópico {msg.topic}: {e}")
+        # Apenas enfileira: decodificação, processamento e gravação ocorrem no worker de ingestão
+        if not self.app:
+            logging.warning("App context não disponível para processar mensagem")
+            return
+        logging.debug(f"Mensagem recebida no tópico {msg.topic} ({len(msg.payload)} bytes)")
+        if not self.pertence(msg.topic):
+            self.particionamento.ignoradas += 1
+            return
+        self.ingestao.enfileirar(msg.topic, msg.payload)
 
-    def on_disconnect(self, client, userdata, rc):
+    def pertence(self, topic):
+        """Tópicos por canteiro de sessões de outra partição são descartados antes da fila"""
+        if not self.particionamento.ativo:
+            return True
+        _, parametros = self.roteador.resolver(topic)
+        canteiro = parametros.get("canteiro")
+        return canteiro is None or self.particionamento.possui(canteiro)
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
         self.connected = False
         if rc != 0:
             logging.warning(f"Conexão perdida com o Broker MQTT. Código: {rc}. Tentando reconectar...")
             self.last_error = f"Desconexão inesperada: {rc}"
             self.update_mqtt_status("DESCONECTADO", self.last_error)
-            # Tentar reconectar após 5 segundos
-            threading.Timer(5.0, self.reconnect).start()
+            if self.motor:
+                self.motor.reconectar()
+            else:
+                # Tentar reconectar após 5 segundos
+                threading.Timer(5.0, self.reconnect).start()
         else:
             logging.info("Desconexão limpa do Broker MQTT.")
             self.update_mqtt_status("DESCONECTADO")
@@ -167,289 +384,574 @@ class MQTTClient:
             threading.Timer(30.0, self.reconnect).start()
 
     def process_message(self, topic, payload):
+        """Processa uma única mensagem de forma síncrona (mesmo caminho do worker)"""
         try:
-            # Import here to avoid circular imports
-            from lib.models import (
-                db, DadoPeriodico, Notificacao, Sessao, StatusDispositivo, StatusMQTT
-            )
-            
-            data = json.loads(payload)
-            
-            # Atualizar último recebimento no tópico
-            status_mqtt = StatusMQTT.query.filter_by(topico=topic).first()
-            if not status_mqtt:
-                status_mqtt = StatusMQTT(topico=topic, status_conexao=True)
-                db.session.add(status_mqtt)
-            else:
-                status_mqtt.ultima_mensagem = datetime.utcnow()
-                status_mqtt.status_conexao = True
-                status_mqtt.erro_ultimo = None
-                
-            # Processar por tipo de tópico
-            if topic == MQTT_TOPICS["temperatura"]:
-                self.processar_temperatura(data)
-                
-            elif topic == MQTT_TOPICS["umidade_ar"]:
-                self.processar_umidade_ar(data)
-                
-            elif topic.startswith("estufa/umidade/solo/"):
-                canteiro = topic.split("/")[-1]
-                self.processar_umidade_solo(data, canteiro)
-                
-            elif topic == MQTT_TOPICS["camera"]:
-                self.processar_imagem(data)
-                
-            elif topic == MQTT_TOPICS["irrigacao_status"]:
-                self.processar_status_irrigacao(data)
-                
-            elif topic == MQTT_TOPICS["ventilacao_status"]:
-                self.processar_status_ventilacao(data)
-                
-            elif topic == MQTT_TOPICS["iluminacao_status"]:
-                self.processar_status_iluminacao(data)
-                
-            elif topic == MQTT_TOPICS["alerta"]:
-                self.processar_alerta(data)
-                
-            else:
-                logging.warning(f"Tópico não reconhecido: {topic}")
-                
-            db.session.commit()
-            
-        except json.JSONDecodeError:
-            logging.error(f"Payload JSON inválido para tópico {topic}: {payload}")
+            self.processar_lote([(topic, payload)], descarregar_janelas=True)
         except Exception as e:
             logging.error(f"Erro ao processar mensagem: {e}")
+
+    @contextmanager
+    def _transacao_lote(self):
+        """Acumula as linhas geradas em um LoteEscrita e grava tudo em uma única transação"""
+        from lib.models import DadoPeriodico, db
+
+        contexto = self.app.app_context() if self.app else nullcontext()
+        with contexto:
+            lote = LoteEscrita()
+            self._local.lote = lote
+            try:
+                yield lote
+                # Agregados por minuto, hora e dia atualizados na mesma transação das leituras
+                self.agregados.registrar(db.session, lote.pendentes(DadoPeriodico))
+                # Última leitura de cada sessão, também na mesma transação
+                ultimos.registrar(db.session.connection(), lote.pendentes(DadoPeriodico))
+                lote.descarregar(db.session)
+                db.session.commit()
+            except Exception:
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+                raise
+            finally:
+                self._local.lote = None
+
+    def processar_lote(self, mensagens, descarregar_janelas=False):
+        """Processa um lote de mensagens e grava todas as linhas em uma única transação
+
+        Com o banco indisponível as mensagens vão para o spool local; enquanto houver
+        mensagens no spool, as novas também vão para ele, preservando a ordem.
+        """
+        for topic, payload in mensagens:
+            self.atividade.registrar(topic, len(payload))
+        if self.spool.pendentes:
+            self.spool.anexar(mensagens)
+            return 0
+        try:
+            return self._gravar_lote(mensagens, descarregar_janelas)
+        except ERROS_BANCO_INDISPONIVEL as e:
+            logging.error(f"Banco indisponível; {len(mensagens)} mensagens enviadas ao spool: {e}")
+            self.spool.anexar(mensagens)
+            return 0
+
+    def _gravar_lote(self, mensagens, descarregar_janelas=False):
+        decodificadas = [mensagem for mensagem in (self._decodificar(*item) for item in mensagens) if mensagem]
+        chaves = []
+        estado = self.coalescedor.instantaneo()
+        try:
+            with self._transacao_lote() as lote:
+                for topic, data in self._sem_duplicatas(decodificadas, chaves):
+                    self._despachar(topic, data)
+                self._gravar_janelas(forcar=descarregar_janelas)
+        except Exception:
+            # Lote não gravado: a reentrega dessas mensagens deve ser aceita e as janelas
+            # voltam ao estado anterior, para a reprodução do spool gerar as mesmas linhas
+            self.duplicatas.esquecer(chaves)
+            self.coalescedor.restaurar(estado)
+            raise
+        return len(lote)
+
+    def reproduzir_spool(self, forcar=False, tempo_max_s=SPOOL_REPRODUCAO_TEMPO_MAX_S):
+        """Tarefa periódica: grava as mensagens do spool em lotes quando o banco volta
+
+        Reproduz até esvaziar o spool ou por tempo_max_s (ao menos um lote); devolve True se
+        ainda houver mensagens, e a fila chama de novo após o próximo lote, sem esperar
+        SPOOL_VERIFICACAO_S, até o spool esvaziar.
+        """
+        if forcar or not self.spool.abrir_existente() or not self.spool.pendentes:
+            return False
+        if not self._banco_disponivel():
+            return False
+
+        prazo_final = time.monotonic() + tempo_max_s
+        while True:
+            registros, posicao = self.spool.ler(self.ingestao.lote_mensagens)
+            if not registros:
+                break
             try:
+                self._gravar_lote(registros)
+            except ERROS_BANCO_INDISPONIVEL as e:
+                logging.warning(f"Banco indisponível durante a reprodução do spool: {e}")
+                return False
+            except Exception as e:
+                # Um lote que nunca poderá ser gravado não pode travar o spool
+                logging.error(f"Lote de {len(registros)} mensagens do spool descartado: {e}")
+            self.spool.consumir(posicao, len(registros))
+            if time.monotonic() >= prazo_final:
+                break
+        logging.info(f"Spool de ingestão reproduzido; {self.spool.pendentes} mensagens pendentes")
+        return self.spool.pendentes > 0
+
+    def _banco_disponivel(self):
+        from lib.models import db
+
+        contexto = self.app.app_context() if self.app else nullcontext()
+        with contexto:
+            try:
+                db.session.execute(text("SELECT 1"))
+                return True
+            except SQLAlchemyError as e:
+                logging.warning(f"Banco ainda indisponível para reproduzir o spool: {e}")
                 db.session.rollback()
-            except:
-                pass
+                return False
+
+    def _sem_duplicatas(self, mensagens, chaves):
+        """Descarta reentregas pela janela em memória e reserva as identidades novas no banco"""
+        from lib.models import db
+
+        unicas = []
+        for topic, data in mensagens:
+            chave = identidade(topic, data)
+            if chave is not None:
+                if not self.duplicatas.registrar(chave):
+                    logging.debug(f"Mensagem duplicada descartada: {chave}")
+                    continue
+                chaves.append(chave)
+            unicas.append((topic, data, chave))
+        if not chaves:
+            return [(topic, data) for topic, data, _ in unicas]
+
+        # Uma escrita por lote; o que já estava no banco (ex.: antes de reiniciar) também é descartado
+        reservadas = self.duplicatas.reservar(db.session, chaves)
+        return [(topic, data) for topic, data, chave in unicas if chave is None or chave in reservadas]
+
+    def descarregar_janelas(self, forcar=False):
+        """Tarefa periódica: grava as janelas de coalescência vencidas"""
+        if self.spool.pendentes and not forcar:
+            # As janelas só fecham depois que o spool for reproduzido, na ordem original
+            return
+        if not self.coalescedor.status()["abertas"]:
+            # Nada a gravar: evita abrir uma transação a cada verificação
+            return
+        estado = self.coalescedor.instantaneo()
+        try:
+            with self._transacao_lote():
+                self._gravar_janelas(forcar=forcar)
+        except Exception:
+            self.coalescedor.restaurar(estado)
+            raise
+
+    def _gravar_janelas(self, forcar=False):
+        for linha in self.coalescedor.expirar(forcar=forcar):
+            self._gravar_leitura(linha)
+
+    def expirar_quadros(self, forcar=False):
+        """Tarefa periódica: libera os quadros de imagem que não foram completados no prazo"""
+        self.quadros.expirar()
+
+    def limpar_duplicatas(self, forcar=False):
+        """Tarefa periódica: remove de mensagem_recebida as identidades fora da retenção"""
+        from lib.models import db
+
+        if forcar:
+            return
+        with self._transacao_lote():
+            removidas = self.duplicatas.limpar(db.session)
+        logging.debug(f"{removidas} identidades de mensagens removidas")
+
+    def manter_particoes(self, forcar=False):
+        """Tarefa periódica: cria as partições futuras de dado_periodico e trata as expiradas"""
+        from lib.models import db
+
+        if forcar:
+            return
+        contexto = self.app.app_context() if self.app else nullcontext()
+        with contexto:
+            try:
+                self.particoes.manter(db.session)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def aplicar_retencao(self, forcar=False):
+        """Tarefa periódica: remove as linhas que saíram das políticas de retenção"""
+        from lib.models import db
+
+        if forcar:
+            return
+        contexto = self.app.app_context() if self.app else nullcontext()
+        with contexto:
+            self.retencao.executar(db.session)
+
+    def persistir_atividade(self, forcar=False):
+        """Tarefa periódica: grava em status_mqtt os tópicos alterados"""
+        from lib.models import db
+
+        contexto = self.app.app_context() if self.app else nullcontext()
+        with contexto:
+            self.atividade.persistir(db.session)
+
+    def _decodificar(self, topic, payload, recebida_em=None):
+        """Retorna (topic, dados) ou None se o payload for inválido
+
+        recebida_em (epoch) vem das mensagens reproduzidas do spool e vale como horário
+        da leitura quando o dispositivo não informou um.
+        """
+        try:
+            # JSON, struct binário ou MessagePack, conforme o primeiro byte (lib/payload.py)
+            formato, data = decodificar(payload)
+        except PayloadInvalido as e:
+            logging.error(f"{e} no tópico {topic}: {payload[:64]!r}")
+            self.atividade.registrar_erro(topic, e)
+            return None
+        self.formatos[formato] += 1
+        if recebida_em is not None and isinstance(data, dict) and "timestamp" not in data and "data_hora" not in data:
+            data["timestamp"] = recebida_em
+        return topic, data
+
+    def _despachar(self, topic, data):
+        try:
+            # Processar por tipo de tópico
+            if not self.roteador.despachar(topic, data):
+                logging.warning(f"Tópico não reconhecido: {topic}")
+
+        except SQLAlchemyError:
+            # Erros de banco invalidam o lote inteiro
+            raise
+        except Exception as e:
+            logging.error(f"Erro ao processar mensagem do tópico {topic}: {e}")
+            self.atividade.registrar_erro(topic, e)
+
+    def _lote_atual(self):
+        return getattr(self._local, "lote", None)
+
+    def _registrar(self, modelo, **campos):
+        """Adiciona uma linha ao lote em andamento ou, fora do worker, direto à sessão"""
+        from lib.models import db
+
+        lote = self._lote_atual()
+        if lote is not None:
+            return lote.adicionar(modelo, **campos)
+        db.session.add(modelo(**campos))
+        return campos
+
+    def _data_hora(self, data):
+        """Horário da leitura informado pelo dispositivo (epoch ou ISO 8601) ou o horário atual"""
+        valor = data.get("timestamp", data.get("data_hora"))
+        try:
+            if isinstance(valor, (int, float)):
+                return datetime.fromtimestamp(valor)
+            if isinstance(valor, str):
+                return datetime.fromisoformat(valor)
+        except (ValueError, OverflowError, OSError):
+            logging.warning(f"Horário de leitura inválido: {valor}")
+        return datetime.now()
+
+    def _registrar_leitura(self, sessao, data_hora=None, **valores):
+        """Envia uma leitura parcial ao coalescedor e grava as linhas que ele liberar"""
+        if not self.leituras.aquecido:
+            self.leituras.aquecer()
+        data_hora = data_hora or datetime.now()
+
+        for linha in self.coalescedor.adicionar(sessao.id, sessao.cultura_id, data_hora, valores):
+            self._gravar_leitura(linha)
+        self.leituras.atualizar(sessao.id, dict(valores, data_hora=data_hora))
+
+    def _gravar_leitura(self, linha):
+        """Completa a linha com os últimos valores conhecidos da sessão e a grava"""
+        from lib.models import DadoPeriodico
+
+        ultimo_dado = self.leituras.obter(linha["sessao_id"]) or {}
+        campos = {
+            "temperatura": ultimo_dado.get("temperatura", 0.0),
+            "umidade_ar": ultimo_dado.get("umidade_ar", 0.0),
+            "umidade_solo": ultimo_dado.get("umidade_solo", 0.0),
+            "exaustor_ligado": ultimo_dado.get("exaustor_ligado", False),
+        }
+        campos.update(linha)
+        return self._registrar(DadoPeriodico, **campos)
 
     def processar_temperatura(self, data):
-        from lib.models import db, DadoPeriodico, Sessao
-        
         temperatura = data.get("temperatura")
         if temperatura is not None:
             # Salvar para todas as sessões ativas
-            sessoes_ativas = Sessao.query.all()  # Implementar lógica de sessões ativas
+            sessoes_ativas = self.sessoes.ativas()
             
+            data_hora = self._data_hora(data)
             for sessao in sessoes_ativas:
-                # Buscar último dado para manter outros valores
-                ultimo_dado = DadoPeriodico.query.filter_by(
-                    sessao_id=sessao.id
-                ).order_by(DadoPeriodico.data_hora.desc()).first()
-                
-                novo_dado = DadoPeriodico(
-                    sessao_id=sessao.id,
-                    cultura_id=sessao.cultura_id,
-                    temperatura=temperatura,
-                    umidade_ar=ultimo_dado.umidade_ar if ultimo_dado else 0.0,
-                    umidade_solo=ultimo_dado.umidade_solo if ultimo_dado else 0.0,
-                    exaustor_ligado=ultimo_dado.exaustor_ligado if ultimo_dado else False
-                )
-                db.session.add(novo_dado)
+                self._registrar_leitura(sessao, data_hora, temperatura=temperatura)
             
             logging.info(f"Temperatura processada: {temperatura}°C")
 
     def processar_umidade_ar(self, data):
-        from lib.models import db, DadoPeriodico, Sessao
-        
         umidade_ar = data.get("umidade_ar")
         if umidade_ar is not None:
             # Salvar para todas as sessões ativas
-            sessoes_ativas = Sessao.query.all()
+            sessoes_ativas = self.sessoes.ativas()
             
+            data_hora = self._data_hora(data)
             for sessao in sessoes_ativas:
-                ultimo_dado = DadoPeriodico.query.filter_by(
-                    sessao_id=sessao.id
-                ).order_by(DadoPeriodico.data_hora.desc()).first()
-                
-                novo_dado = DadoPeriodico(
-                    sessao_id=sessao.id,
-                    cultura_id=sessao.cultura_id,
-                    temperatura=ultimo_dado.temperatura if ultimo_dado else 0.0,
-                    umidade_ar=umidade_ar,
-                    umidade_solo=ultimo_dado.umidade_solo if ultimo_dado else 0.0,
-                    exaustor_ligado=ultimo_dado.exaustor_ligado if ultimo_dado else False
-                )
-                db.session.add(novo_dado)
+                self._registrar_leitura(sessao, data_hora, umidade_ar=umidade_ar)
             
             logging.info(f"Umidade do ar processada: {umidade_ar}%")
 
     def processar_umidade_solo(self, data, canteiro):
-        from lib.models import db, DadoPeriodico, Sessao
-        
         umidade_solo = data.get("umidade")
         if umidade_solo is not None:
             try:
                 # Assumir que canteiro corresponde ao sessao_id
                 sessao_id = int(canteiro)
-                sessao = Sessao.query.filter_by(id=sessao_id).first()
+                sessao = self.sessoes.obter(sessao_id)
                 
                 if sessao:
-                    ultimo_dado = DadoPeriodico.query.filter_by(
-                        sessao_id=sessao.id
-                    ).order_by(DadoPeriodico.data_hora.desc()).first()
-                    
-                    novo_dado = DadoPeriodico(
-                        sessao_id=sessao.id,
-                        cultura_id=sessao.cultura_id,
-                        temperatura=ultimo_dado.temperatura if ultimo_dado else 0.0,
-                        umidade_ar=ultimo_dado.umidade_ar if ultimo_dado else 0.0,
-                        umidade_solo=umidade_solo,
-                        exaustor_ligado=ultimo_dado.exaustor_ligado if ultimo_dado else False
-                    )
-                    db.session.add(novo_dado)
+                    self._registrar_leitura(sessao, self._data_hora(data), umidade_solo=umidade_solo)
                     
                     logging.info(f"Umidade do solo processada para canteiro {canteiro}: {umidade_solo}%")
                 else:
-                    logging.warning(f"Sessão {sessao_id} não encontrada para canteiro {canteiro}")
+                    logging.warning(f"Sessão {sessao_id} não encontrada ou inativa para canteiro {canteiro}")
                     
             except ValueError:
                 logging.error(f"ID de canteiro inválido: {canteiro}")
 
+    def processar_leituras(self, data):
+        """Lote de leituras com horário próprio, acumulado pelo dispositivo e enviado de uma vez
+
+        Aceita {"leituras": [...]} ou a lista diretamente. Cada leitura usa os mesmos campos
+        dos tópicos individuais (temperatura, umidade_ar, umidade + canteiro) e timestamp.
+        Todas as linhas geradas entram no mesmo INSERT do lote de ingestão.
+        """
+        leituras = data.get("leituras") if isinstance(data, dict) else data
+        if not isinstance(leituras, list):
+            raise ValueError("Lote sem a lista de leituras")
+
+        self.lotes_leituras["mensagens"] += 1
+        sessoes_ativas = None
+        validas = []
+        for leitura in leituras:
+            if not isinstance(leitura, dict):
+                self.lotes_leituras["descartadas"] += 1
+                continue
+            valores = {campo: leitura[campo] for campo in ("temperatura", "umidade_ar") if leitura.get(campo) is not None}
+            umidade_solo = leitura.get("umidade", leitura.get("umidade_solo"))
+            canteiro = leitura.get("canteiro")
+
+            if canteiro is not None:
+                try:
+                    canteiro = int(canteiro)
+                except (TypeError, ValueError):
+                    logging.error(f"ID de canteiro inválido no lote: {canteiro}")
+                    self.lotes_leituras["descartadas"] += 1
+                    continue
+                if not self.particionamento.possui(canteiro):
+                    # Canteiro de outra partição: gravado pelo worker dono
+                    continue
+                sessao = self.sessoes.obter(canteiro)
+                if umidade_solo is not None:
+                    valores["umidade_solo"] = umidade_solo
+                sessoes = [sessao] if sessao else []
+            else:
+                # Sem canteiro a leitura é do ambiente e vale para todas as sessões ativas
+                if sessoes_ativas is None:
+                    sessoes_ativas = self.sessoes.ativas()
+                sessoes = sessoes_ativas
+
+            if not valores or not sessoes:
+                self.lotes_leituras["descartadas"] += 1
+                continue
+            validas.append((self._data_hora(leitura), sessoes, valores))
+
+        # Em ordem cronológica para o coalescedor abrir e fechar as janelas corretamente
+        validas.sort(key=lambda item: item[0])
+        for data_hora, sessoes, valores in validas:
+            for sessao in sessoes:
+                self._registrar_leitura(sessao, data_hora, **valores)
+        self.lotes_leituras["leituras"] += len(validas)
+
+        logging.info(f"Lote de leituras processado: {len(validas)} de {len(leituras)}")
+
     def processar_imagem(self, data):
-        from lib.models import db, DadoPeriodico, Sessao
-        
-        imagem_base64 = data.get("imagem")
-        if imagem_base64:
+        imagem = data.get("imagem")
+        if imagem:
             try:
-                # Decodificar imagem base64
-                imagem_bytes = b64decode(imagem_base64)
-                
-                # Salvar para todas as sessões ativas (ou implementar lógica específica)
-                sessoes_ativas = Sessao.query.all()
-                
-                for sessao in sessoes_ativas:
-                    ultimo_dado = DadoPeriodico.query.filter_by(
-                        sessao_id=sessao.id
-                    ).order_by(DadoPeriodico.data_hora.desc()).first()
-                    
-                    if ultimo_dado:
-                        ultimo_dado.imagem = imagem_bytes
-                    else:
-                        # Criar novo registro se não existir
-                        novo_dado = DadoPeriodico(
-                            sessao_id=sessao.id,
-                            cultura_id=sessao.cultura_id,
-                            temperatura=0.0,
-                            umidade_ar=0.0,
-                            umidade_solo=0.0,
-                            exaustor_ligado=False,
-                            imagem=imagem_bytes
-                        )
-                        db.session.add(novo_dado)
-                
-                logging.info("Imagem processada e salva")
+                # Imagens binárias chegam prontas; em JSON vêm em base64
+                imagem_bytes = imagem if isinstance(imagem, bytes) else b64decode(imagem)
+                self._registrar_imagem(imagem_bytes, self._data_hora(data))
                 
+            except SQLAlchemyError:
+                raise
             except Exception as e:
                 logging.error(f"Erro ao processar imagem: {e}")
 
+    def processar_parte_imagem(self, data):
+        """Parte de um quadro da câmera; o quadro é gravado quando todas as partes chegam"""
+        dados = data.get("dados") or b""
+        dados = dados if isinstance(dados, bytes) else b64decode(dados)
+        completo = self.quadros.adicionar(
+            (data.get("camera"), data["quadro"]),
+            int(data["parte"]),
+            int(data["total"]),
+            dados,
+            crc32=data.get("crc32"),
+            sha256=data.get("sha256"),
+            timestamp=data.get("timestamp", data.get("data_hora")),
+        )
+        if completo is not None:
+            imagem, timestamp = completo
+            self._registrar_imagem(imagem, self._data_hora({"timestamp": timestamp}))
+
+    def _registrar_imagem(self, imagem, data_hora):
+        """Grava a imagem no armazenamento em disco e envia só a referência às sessões ativas"""
+        sha256 = self.imagens.salvar(imagem)
+        # Miniatura e versão média são geradas no pool de threads, sem atrasar o lote
+        self.miniaturas.enfileirar(sha256)
+
+        # A referência entra na janela de coalescência junto com as demais leituras
+        for sessao in self.sessoes.ativas():
+            self._registrar_leitura(sessao, data_hora, imagem_sha256=sha256)
+
+        logging.info(f"Imagem processada e salva ({len(imagem)} bytes, {sha256[:12]})")
+
     def processar_status_irrigacao(self, data):
-        from lib.models import db, StatusDispositivo
+        from lib.models import StatusDispositivo
         
         status = data.get("status")
         sessao_id = data.get("sessao_id")
         
         if status:
-            status_device = StatusDispositivo(
+            self._registrar(
+                StatusDispositivo,
                 tipo_dispositivo="irrigacao",
                 status=status,
                 sessao_id=sessao_id
             )
-            db.session.add(status_device)
+            self._confirmar_comando("irrigacao", data)
             logging.info(f"Status irrigação: {status} para sessão {sessao_id}")
 
     def processar_status_ventilacao(self, data):
-        from lib.models import db, StatusDispositivo
+        from lib.models import StatusDispositivo
         
         status = data.get("status")
         
         if status:
-            status_device = StatusDispositivo(
+            self._registrar(
+                StatusDispositivo,
                 tipo_dispositivo="ventilacao",
                 status=status
             )
-            db.session.add(status_device)
+            self._confirmar_comando("ventilacao", data)
             logging.info(f"Status ventilação: {status}")
 
     def processar_status_iluminacao(self, data):
-        from lib.models import db, StatusDispositivo
+        from lib.models import StatusDispositivo
         
         status = data.get("status")
         
         if status:
-            status_device = StatusDispositivo(
+            self._registrar(
+                StatusDispositivo,
                 tipo_dispositivo="iluminacao",
                 status=status
             )
-            db.session.add(status_device)
+            self._confirmar_comando("iluminacao", data)
             logging.info(f"Status iluminação: {status}")
 
     def processar_alerta(self, data):
-        from lib.models import db, Notificacao
-        
+        """Cria a notificação do alerta e a entrega aos usuários (lib/notificacoes.py)"""
+        from lib.models import db
+
         mensagem = data.get("mensagem", "Alerta recebido")
         nivel = data.get("nivel", "INFO")
-        
-        alerta = Notificacao(
+        sessao_id = data.get("sessao_id", data.get("canteiro"))
+        if sessao_id is not None:
+            try:
+                sessao_id = int(sessao_id)
+            except (TypeError, ValueError):
+                # O alerta ainda é entregue por nível de acesso, sem os inscritos na sessão
+                logging.warning(f"Alerta com sessão inválida ignorada: {sessao_id!r}")
+                sessao_id = None
+
+        # Os destinatários vêm só do nível do alerta, nunca de um campo escolhido pelo dispositivo
+        _, destinatarios = notificar(
+            db.session,
             titulo=f"Alerta {nivel} na Estufa",
-            mensagem=mensagem
+            mensagem=mensagem,
+            nivel_acesso=nivel_acesso_alerta(nivel),
+            sessao_id=sessao_id,
         )
-        db.session.add(alerta)
-        logging.info(f"Alerta criado: {mensagem}")
+        logging.info(f"Alerta criado para {destinatarios} usuários: {mensagem}")
 
     def update_mqtt_status(self, status, error_message=None):
-        """Atualiza o status da conexão MQTT no banco de dados"""
-        try:
-            if not self.app:
-                return
-                
-            # Usar contexto da aplicação Flask
-            with self.app.app_context():
-                # Importar apenas quando necessário para evitar import circular
-                from lib.models import StatusMQTT, db
-                
-                # Buscar registro existente ou criar novo
-                mqtt_status = StatusMQTT.query.first()
-                if not mqtt_status:
-                    mqtt_status = StatusMQTT()
-                    db.session.add(mqtt_status)
-                
-                mqtt_status.status = status
-                mqtt_status.ultima_conexao = datetime.now()
-                mqtt_status.mensagem_erro = error_message
-                
-                db.session.commit()
-                
-        except Exception as e:
-            logging.error(f"Erro ao atualizar status MQTT: {e}")
+        """Registra em memória o estado da conexão; a gravação ocorre com o status dos tópicos"""
+        self.atividade.conexao(status == "CONECTADO", error_message)
 
     # Métodos para envio de comandos manuais
-    def enviar_comando_irrigacao(self, sessao_id, comando):
+    def _enviar_comando(self, tipo, topic, payload, qos, sessao_id=None, comando_id=None):
+        """Publica o comando com um comando_id e passa a aguardar a confirmação; retorna o id ou None"""
+        comando_id = comando_id or str(uuid.uuid4())
+        payload = dict(payload, comando_id=comando_id)
+        # Registrado antes de publicar: o status do dispositivo pode chegar antes de publish() retornar
+        self.comandos.registrar(comando_id, tipo, topic, payload, qos, sessao_id)
+        if not self.publish(topic, payload, qos=qos):
+            self.comandos.descartar(comando_id)
+            return None
+        return comando_id
+
+    def enviar_comando_irrigacao(self, sessao_id, comando, comando_id=None):
         """Enviar comando manual de irrigação"""
         topic = MQTT_TOPICS["irrigacao_manual"]
         payload = {
             "sessao_id": sessao_id,
             "comando": comando
         }
-        return self.publish(topic, payload, qos=2)
+        return self._enviar_comando("irrigacao", topic, payload, 2, sessao_id, comando_id)
 
-    def enviar_comando_ventilacao(self, comando):
+    def enviar_comando_ventilacao(self, comando, comando_id=None):
         """Enviar comando manual de ventilação"""
         topic = MQTT_TOPICS["ventilacao_manual"]
         payload = {
             "comando": comando
         }
-        return self.publish(topic, payload, qos=2)
+        return self._enviar_comando("ventilacao", topic, payload, 2, comando_id=comando_id)
 
-    def enviar_comando_iluminacao(self, comando):
+    def enviar_comando_iluminacao(self, comando, comando_id=None):
         """Enviar comando manual de iluminação"""
         topic = MQTT_TOPICS["iluminacao_manual"]
         payload = {
             "comando": comando
         }
-        return self.publish(topic, payload, qos=1)
+        return self._enviar_comando("iluminacao", topic, payload, 1, comando_id=comando_id)
+
+    def _confirmar_comando(self, tipo, data):
+        """Marca como confirmado o comando associado ao status recebido"""
+        from lib.models import ComandoDispositivo, db
+
+        confirmado = self.comandos.confirmar(tipo, data)
+        if confirmado is None:
+            return
+        comando_id, latencia = confirmado
+        db.session.execute(
+            update(ComandoDispositivo)
+            .where(ComandoDispositivo.uuid == comando_id, ComandoDispositivo.estado == "PENDENTE")
+            .values(estado="CONFIRMADO", executado=True, confirmado_em=datetime.now(), latencia_ms=latencia)
+        )
+
+    def verificar_comandos(self, forcar=False):
+        """Tarefa periódica: reenvia os comandos sem confirmação e expira os que esgotaram as tentativas"""
+        from lib.models import ComandoDispositivo, db
+
+        reenviar, expirados = self.comandos.vencidos()
+        if not reenviar and not expirados:
+            return
+        for pendente in reenviar:
+            logging.warning(f"Comando {pendente.comando_id} sem confirmação; reenvio {pendente.tentativas}")
+            self.publish(pendente.topic, pendente.payload, qos=pendente.qos)
+        for pendente in expirados:
+            logging.error(f"Comando {pendente.comando_id} para {pendente.tipo} expirou sem confirmação")
+
+        tabela = ComandoDispositivo.__table__
+        with self._transacao_lote():
+            if reenviar:
+                db.session.execute(
+                    update(tabela).where(tabela.c.uuid == bindparam("b_uuid")).values(tentativas=bindparam("b_tentativas")),
+                    [{"b_uuid": p.comando_id, "b_tentativas": p.tentativas} for p in reenviar],
+                )
+            if expirados:
+                db.session.execute(
+                    update(ComandoDispositivo)
+                    .where(ComandoDispositivo.uuid.in_([p.comando_id for p in expirados]), ComandoDispositivo.estado == "PENDENTE")
+                    .values(estado="EXPIRADO")
+                )
 
     def get_device_status(self, tipo_dispositivo=None):
         """Buscar status atual dos dispositivos"""
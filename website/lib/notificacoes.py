@@ -0,0 +1,92 @@
+"""
+Distribuição das notificações de alerta aos usuários.
+
+Cada alerta gera uma linha em notificacao e, com um único INSERT ... SELECT, uma linha em
+notificacao_usuario para cada destinatário: usuários cujo grupo tem o nível de acesso mínimo
+do alerta e usuários interessados na sessão do alerta. O total de não lidas de cada usuário
+fica desnormalizado em usuario.notificacoes_nao_lidas, lido sem COUNT pelo cabeçalho e pelo app.
+"""
+
+from os import getenv
+
+from sqlalchemy import and_, case, insert, literal, select, union, update
+
+# Nível de acesso mínimo para receber alertas sem nível próprio em NIVEL_ACESSO_ALERTAS
+NOTIFICACAO_NIVEL_MINIMO = int(getenv("NOTIFICACAO_NIVEL_MINIMO", 3))
+
+# Alertas graves alcançam grupos com menos acesso
+NIVEL_ACESSO_ALERTAS = {
+    "CRITICO": 1,
+    "CRÍTICO": 1,
+    "CRITICAL": 1,
+    "ERRO": 2,
+    "ERROR": 2,
+}
+
+
+def nivel_acesso_alerta(nivel, padrao=NOTIFICACAO_NIVEL_MINIMO):
+    """Nível de acesso mínimo dos destinatários de um alerta do nível informado"""
+    return NIVEL_ACESSO_ALERTAS.get(str(nivel).upper(), padrao)
+
+
+def _destinatarios(nivel_acesso, sessao_id=None):
+    from lib.models import Grupo, InteresseSessao, Usuario
+
+    por_nivel = (
+        select(Usuario.id.label("usuario_id"))
+        .join(Grupo, Usuario.grupo_id == Grupo.id)
+        .where(Grupo.nivel_acesso >= nivel_acesso)
+    )
+    if sessao_id is None:
+        return por_nivel
+    por_interesse = select(InteresseSessao.usuario_id).where(InteresseSessao.sessao_id == sessao_id)
+    # UNION elimina quem se enquadra nos dois critérios
+    return union(por_nivel, por_interesse)
+
+
+def notificar(session, titulo, mensagem, nivel_acesso=NOTIFICACAO_NIVEL_MINIMO, sessao_id=None):
+    """Cria a notificação e a entrega aos destinatários; retorna (notificacao_id, destinatarios)"""
+    from lib.models import Notificacao, NotificacaoUsuario, Usuario
+
+    notificacao_id = session.execute(
+        insert(Notificacao).values(titulo=titulo, mensagem=mensagem).returning(Notificacao.id)
+    ).scalar_one()
+
+    destinatarios = _destinatarios(nivel_acesso, sessao_id).subquery()
+    entregas = session.execute(
+        insert(NotificacaoUsuario).from_select(
+            ["notificacao_id", "usuario_id"],
+            select(literal(notificacao_id), destinatarios.c.usuario_id),
+        )
+    ).rowcount
+    if entregas:
+        session.execute(
+            update(Usuario)
+            .where(Usuario.id.in_(select(destinatarios.c.usuario_id)))
+            .values(notificacoes_nao_lidas=Usuario.notificacoes_nao_lidas + 1)
+        )
+    return notificacao_id, entregas
+
+
+def marcar_lidas(session, usuario_id, notificacoes=None):
+    """Marca como lidas as notificações do usuário (todas ou os ids de notificacao informados)
+
+    Retorna quantas deixaram de estar não lidas; o contador do usuário é reduzido no mesmo total.
+    """
+    from lib.models import NotificacaoUsuario, Usuario
+
+    condicao = and_(NotificacaoUsuario.usuario_id == usuario_id, NotificacaoUsuario.lida.is_(False))
+    if notificacoes is not None:
+        condicao = and_(condicao, NotificacaoUsuario.notificacao_id.in_(notificacoes))
+    lidas = session.execute(update(NotificacaoUsuario).where(condicao).values(lida=True)).rowcount
+    if lidas:
+        session.execute(
+            update(Usuario)
+            .where(Usuario.id == usuario_id)
+            .values(
+                notificacoes_nao_lidas=case(
+                    (Usuario.notificacoes_nao_lidas > lidas, Usuario.notificacoes_nao_lidas - lidas), else_=0
+                )
+            )
+        )
+    return lidas
@@ -0,0 +1,250 @@
+"""
+Particionamento mensal de dado_periodico por data_hora no PostgreSQL.
+
+Com a tabela particionada (init.sql ou `flask particionar-dados`), a tarefa periódica cria
+as partições dos próximos meses e desanexa ou remove as que saíram da retenção: descartar
+um mês inteiro vira uma operação de catálogo em vez de um DELETE. Antes disso as leituras
+dos meses expirados passam pelas mesmas etapas da retenção por linhas (arquivo colunar e
+garantia dos agregados em PARTICOES_RESUMO, lib/retencao.py), uma partição por execução e
+no máximo PARTICOES_TEMPO_MAX_S de preparo; o restante fica para a próxima. As partições herdam o
+índice BRIN em data_hora, pequeno e suficiente para varreduras por período em dados
+gravados em ordem de chegada. Em outros bancos (SQLite nos testes) nada é feito.
+"""
+
+import logging
+import re
+import time
+from datetime import date, datetime
+from os import getenv
+
+from sqlalchemy import text
+
+from lib.agregados import RESOLUCOES
+
+TABELA_PARTICIONADA = "dado_periodico"
+# Recebe as leituras fora das partições mensais; movidas quando o mês ganha sua partição
+PARTICAO_PADRAO = "dado_periodico_padrao"
+
+# Meses à frente do atual que já devem ter partição
+PARTICOES_MESES_FUTUROS = int(getenv("PARTICOES_MESES_FUTUROS", 3))
+# Meses completos mantidos antes do atual (0 = nunca expirar)
+PARTICOES_RETENCAO_MESES = int(getenv("PARTICOES_RETENCAO_MESES", 0))
+# O que fazer com as partições expiradas: desanexar (mantém a tabela) ou remover
+PARTICOES_EXPIRADAS = getenv("PARTICOES_EXPIRADAS", "desanexar").lower()
+PARTICOES_INTERVALO_S = float(getenv("PARTICOES_INTERVALO_S", 3600))
+# Resolução dos agregados garantida antes de expirar uma partição (vazio = não verificar)
+PARTICOES_RESUMO = getenv("PARTICOES_RESUMO", "hora") or None
+# Tempo de preparo (arquivo e agregados) por execução antes de expirar uma partição
+PARTICOES_TEMPO_MAX_S = float(getenv("PARTICOES_TEMPO_MAX_S", 2))
+
+_NOME_PARTICAO = re.compile(rf"^{TABELA_PARTICIONADA}_p(\d{{4}})(\d{{2}})$")
+
+
+def somar_meses(mes, meses):
+    total = mes.year * 12 + mes.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def nome_particao(mes):
+    return f"{TABELA_PARTICIONADA}_p{mes:%Y%m}"
+
+
+def mes_da_particao(nome):
+    """Primeiro dia do mês de uma partição mensal, ou None para outras partições"""
+    encontrado = _NOME_PARTICAO.match(nome)
+    return date(int(encontrado[1]), int(encontrado[2]), 1) if encontrado else None
+
+
+def planejar(existentes, agora, meses_futuros=PARTICOES_MESES_FUTUROS, retencao_meses=PARTICOES_RETENCAO_MESES, pendentes=()):
+    """(meses a criar, partições expiradas) a partir dos nomes das partições existentes
+
+    pendentes são os meses com linhas na partição padrão, que também ganham partição
+    se ainda estiverem dentro da retenção.
+    """
+    atual = date(agora.year, agora.month, 1)
+    limite = somar_meses(atual, -retencao_meses) if retencao_meses > 0 else None
+    por_mes = {mes_da_particao(nome): nome for nome in existentes if mes_da_particao(nome)}
+    futuros = {somar_meses(atual, i) for i in range(meses_futuros + 1)}
+    pendentes = {mes for mes in pendentes if limite is None or mes >= limite}
+    criar = sorted((futuros | pendentes) - por_mes.keys())
+    expiradas = [nome for mes, nome in sorted(por_mes.items()) if limite is not None and mes < limite]
+    return criar, expiradas
+
+
+class GerenciadorParticoes:
+    """Cria, desanexa e remove as partições mensais de dado_periodico"""
+
+    def __init__(
+        self,
+        meses_futuros=PARTICOES_MESES_FUTUROS,
+        retencao_meses=PARTICOES_RETENCAO_MESES,
+        expiradas=PARTICOES_EXPIRADAS,
+        resumo=PARTICOES_RESUMO,
+        preparar=None,
+        tempo_max_s=PARTICOES_TEMPO_MAX_S,
+    ):
+        if expiradas not in ("desanexar", "remover"):
+            raise ValueError(f"PARTICOES_EXPIRADAS deve ser desanexar ou remover, não {expiradas!r}")
+        if resumo is not None and resumo not in RESOLUCOES:
+            raise ValueError(f"PARTICOES_RESUMO deve ser minuto, hora, dia ou vazio, não {resumo!r}")
+        self.meses_futuros = meses_futuros
+        self.retencao_meses = retencao_meses
+        self.expiradas = expiradas
+        self.resumo = resumo
+        # preparar(session, corte, resumo, prazo_final) antes de expirar partições (MotorRetencao.preparar_remocao)
+        self.preparar = preparar
+        self.tempo_max_s = tempo_max_s
+
+        # Métricas expostas em status()
+        self.criadas = 0
+        self.desanexadas = 0
+        self.removidas = 0
+        self.ultima_execucao = None
+
+    @staticmethod
+    def particionada(session):
+        if session.get_bind().dialect.name != "postgresql":
+            return False
+        return session.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:tabela))"),
+            {"tabela": TABELA_PARTICIONADA},
+        ).scalar()
+
+    @staticmethod
+    def particoes(session):
+        return session.scalars(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:tabela) ORDER BY c.relname"
+            ),
+            {"tabela": TABELA_PARTICIONADA},
+        ).all()
+
+    def criar_particao(self, session, mes, padrao=True):
+        """Cria a partição do mês, trazendo as linhas do mês que estiverem na partição padrão
+
+        A tabela é criada avulsa e anexada depois: ATTACH PARTITION bloqueia dado_periodico
+        só contra outras alterações de estrutura, mas com a partição padrão existente também
+        a bloqueia por completo (ACCESS EXCLUSIVE) e a percorre para validar o intervalo.
+        Enquanto isso, leituras que iriam para a partição padrão (atrasadas ou fora dos meses
+        existentes) esperam; por isso as partições são criadas com meses de antecedência e a
+        partição padrão costuma ficar pequena.
+        """
+        nome, inicio, fim = nome_particao(mes), mes, somar_meses(mes, 1)
+        session.execute(text(f"CREATE TABLE {nome} (LIKE {TABELA_PARTICIONADA} INCLUDING DEFAULTS)"))
+        if padrao:
+            movidas = session.execute(
+                text(
+                    f"WITH movidas AS (DELETE FROM {PARTICAO_PADRAO} WHERE data_hora >= :inicio AND data_hora < :fim "
+                    f"RETURNING *) INSERT INTO {nome} SELECT * FROM movidas"
+                ),
+                {"inicio": inicio, "fim": fim},
+            ).rowcount
+            if movidas:
+                logging.info(f"{movidas} leituras movidas da partição padrão para {nome}")
+        session.execute(
+            text(f"ALTER TABLE {TABELA_PARTICIONADA} ATTACH PARTITION {nome} FOR VALUES FROM ('{inicio}') TO ('{fim}')")
+        )
+        self.criadas += 1
+        return nome
+
+    def manter(self, session, agora=None):
+        """Cria as partições que faltam e expira a mais antiga fora da retenção; None se a tabela não for particionada
+
+        As partições criadas são confirmadas antes do preparo da expirada, que confirma cada
+        etapa; a partição só sai quando o preparo chega ao fim do mês dela, talvez após
+        várias execuções. O chamador confirma a expiração.
+        """
+        if not self.particionada(session):
+            return None
+        agora = agora or datetime.now()
+        existentes = self.particoes(session)
+        padrao = PARTICAO_PADRAO in existentes
+        # Meses com leituras atrasadas ou gravadas antes de a partição existir
+        pendentes = (
+            session.scalars(text(f"SELECT DISTINCT date_trunc('month', data_hora)::date FROM {PARTICAO_PADRAO}")).all()
+            if padrao
+            else ()
+        )
+        criar, expiradas = planejar(existentes, agora, self.meses_futuros, self.retencao_meses, pendentes)
+
+        resultado = {
+            "criadas": [self.criar_particao(session, mes, padrao) for mes in criar],
+            "expiradas": [],
+            "acao": self.expiradas,
+        }
+        session.commit()
+        if expiradas and self.expirar(session, expiradas[0]):
+            resultado["expiradas"].append(expiradas[0])
+        self.ultima_execucao = agora
+        if resultado["criadas"] or resultado["expiradas"]:
+            logging.info(f"Partições de {TABELA_PARTICIONADA}: {resultado}")
+        return resultado
+
+    def expirar(self, session, nome):
+        """Prepara as leituras da partição e a desanexa ou remove; False se o preparo continua na próxima execução"""
+        if self.preparar is not None:
+            # Arquiva e resume as leituras do mês; um erro aqui mantém a partição
+            fim = somar_meses(mes_da_particao(nome), 1)
+            corte = datetime(fim.year, fim.month, 1)
+            pronto = self.preparar(session, corte, self.resumo, time.monotonic() + self.tempo_max_s)
+            if pronto < corte:
+                logging.info(f"Preparo de {nome} antes de expirar continua na próxima execução (até {pronto:%Y-%m-%d})")
+                return False
+        if self.expiradas == "remover":
+            session.execute(text(f"DROP TABLE {nome}"))
+            self.removidas += 1
+        else:
+            # A tabela desanexada continua disponível para arquivamento
+            session.execute(text(f"ALTER TABLE {TABELA_PARTICIONADA} DETACH PARTITION {nome}"))
+            self.desanexadas += 1
+        return True
+
+    def converter(self, session, manter_antiga=False):
+        """Converte dado_periodico em tabela particionada por mês, copiando as linhas existentes
+
+        Roda em uma única transação; a tabela original fica como dado_periodico_antigo
+        quando manter_antiga é verdadeiro. Retorna quantas linhas foram copiadas.
+        """
+        antiga = f"{TABELA_PARTICIONADA}_antigo"
+        sequencia = session.execute(
+            text("SELECT pg_get_serial_sequence(:tabela, 'id')"), {"tabela": TABELA_PARTICIONADA}
+        ).scalar()
+        for instrucao in (
+            f"ALTER TABLE {TABELA_PARTICIONADA} RENAME TO {antiga}",
+            f"ALTER TABLE {antiga} RENAME CONSTRAINT {TABELA_PARTICIONADA}_pkey TO {antiga}_pkey",
+            f"ALTER INDEX IF EXISTS idx_{TABELA_PARTICIONADA}_sessao_data RENAME TO idx_{antiga}_sessao_data",
+            f"CREATE TABLE {TABELA_PARTICIONADA} (LIKE {antiga} INCLUDING DEFAULTS) PARTITION BY RANGE (data_hora)",
+            # A chave de uma tabela particionada precisa incluir a coluna de partição
+            f"ALTER TABLE {TABELA_PARTICIONADA} ADD PRIMARY KEY (id, data_hora)",
+            f"ALTER TABLE {TABELA_PARTICIONADA} ADD FOREIGN KEY (cultura_id) REFERENCES cultura(id) ON DELETE CASCADE",
+            f"ALTER TABLE {TABELA_PARTICIONADA} ADD FOREIGN KEY (sessao_id) REFERENCES sessao(id) ON DELETE CASCADE",
+            f"CREATE INDEX idx_{TABELA_PARTICIONADA}_sessao_data ON {TABELA_PARTICIONADA}(sessao_id, data_hora DESC)",
+            f"CREATE INDEX idx_{TABELA_PARTICIONADA}_data_brin ON {TABELA_PARTICIONADA} USING brin (data_hora)",
+            f"CREATE TABLE {PARTICAO_PADRAO} PARTITION OF {TABELA_PARTICIONADA} DEFAULT",
+        ):
+            session.execute(text(instrucao))
+        if sequencia:
+            session.execute(text(f"ALTER SEQUENCE {sequencia} OWNED BY {TABELA_PARTICIONADA}.id"))
+
+        meses = session.scalars(text(f"SELECT DISTINCT date_trunc('month', data_hora)::date FROM {antiga}")).all()
+        for mes in sorted(meses):
+            self.criar_particao(session, mes, padrao=False)
+        copiadas = session.execute(text(f"INSERT INTO {TABELA_PARTICIONADA} SELECT * FROM {antiga}")).rowcount
+        if not manter_antiga:
+            session.execute(text(f"DROP TABLE {antiga}"))
+        logging.info(f"{TABELA_PARTICIONADA} particionada por mês: {copiadas} linhas em {len(meses)} partições")
+        return copiadas
+
+    def status(self):
+        return {
+            "meses_futuros": self.meses_futuros,
+            "retencao_meses": self.retencao_meses,
+            "expiradas": self.expiradas,
+            "resumo": self.resumo,
+            "tempo_max_s": self.tempo_max_s,
+            "criadas": self.criadas,
+            "desanexadas": self.desanexadas,
+            "removidas": self.removidas,
+            "ultima_execucao": self.ultima_execucao.isoformat() if self.ultima_execucao else None,
+        }
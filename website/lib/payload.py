@@ -0,0 +1,188 @@
+"""
+Decodificação dos payloads MQTT recebidos dos dispositivos.
+
+O primeiro byte define o formato, mantendo compatibilidade com os dispositivos que enviam JSON:
+
+- "{" ou "[" (após espaços): JSON, formato original
+- 0x01: leitura escalar em struct little-endian <BIf> = campo, timestamp (epoch, 0 = agora), valor
+- 0x02: imagem bruta: timestamp uint32 seguido dos bytes da imagem, sem base64
+- 0x03: lote de leituras: quantidade uint16 seguida de registros <BHIf> = campo, canteiro
+  (0 = todos), timestamp, valor; decodificado como {"leituras": [...]}
+- 0x04: parte de um quadro da câmera: <IHHII> = quadro, parte, total, timestamp, crc32 da
+  parte, seguido dos bytes da parte
+- 0x80-0x9f, 0xdc-0xdf: mapa ou array MessagePack (requer o pacote opcional msgpack)
+"""
+
+import json
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependência opcional
+    msgpack = None
+
+FORMATO_ESCALAR = 0x01
+FORMATO_IMAGEM = 0x02
+FORMATO_LOTE = 0x03
+FORMATO_PARTE = 0x04
+
+# Códigos de campo do formato escalar
+CAMPOS_ESCALARES = {
+    1: "temperatura",
+    2: "umidade_ar",
+    3: "umidade",
+}
+CODIGOS_CAMPOS = {campo: codigo for codigo, campo in CAMPOS_ESCALARES.items()}
+
+_ESCALAR = struct.Struct("<BIf")
+_TIMESTAMP = struct.Struct("<I")
+_QUANTIDADE = struct.Struct("<H")
+_REGISTRO_LOTE = struct.Struct("<BHIf")
+_PARTE = struct.Struct("<IHHII")
+_INICIO_JSON = frozenset(b"{[ \t\r\n")
+_NOMES = {
+    "json": "JSON",
+    "escalar": "escalar",
+    "imagem": "de imagem",
+    "lote": "de lote",
+    "parte": "de parte de imagem",
+    "msgpack": "MessagePack",
+}
+
+
+class PayloadInvalido(ValueError):
+    pass
+
+
+def _msgpack(byte):
+    return 0x80 <= byte <= 0x9F or 0xDC <= byte <= 0xDF
+
+
+def formato(payload):
+    """Nome do formato do payload a partir do primeiro byte"""
+    if not payload:
+        raise PayloadInvalido("Payload vazio")
+    primeiro = payload[0]
+    if primeiro in _INICIO_JSON:
+        return "json"
+    if primeiro == FORMATO_ESCALAR:
+        return "escalar"
+    if primeiro == FORMATO_IMAGEM:
+        return "imagem"
+    if primeiro == FORMATO_LOTE:
+        return "lote"
+    if primeiro == FORMATO_PARTE:
+        return "parte"
+    if _msgpack(primeiro):
+        return "msgpack"
+    # Formato desconhecido: tenta JSON como antes
+    return "json"
+
+
+def decodificar(payload):
+    """Retorna (formato, dados) de um payload em bytes ou str; PayloadInvalido se não decodificar"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    nome = formato(payload)
+    try:
+        if nome == "escalar":
+            codigo, timestamp, valor = _ESCALAR.unpack(payload[1:])
+            if codigo not in CAMPOS_ESCALARES:
+                raise PayloadInvalido(f"Campo escalar desconhecido: {codigo}")
+            dados = {CAMPOS_ESCALARES[codigo]: _valor_float32(valor)}
+        elif nome == "imagem":
+            (timestamp,) = _TIMESTAMP.unpack_from(payload, 1)
+            dados = {"imagem": bytes(payload[1 + _TIMESTAMP.size :])}
+        elif nome == "parte":
+            quadro, parte, total, timestamp, crc32 = _PARTE.unpack_from(payload, 1)
+            dados = {
+                "quadro": quadro,
+                "parte": parte,
+                "total": total,
+                "crc32": crc32,
+                "dados": bytes(payload[1 + _PARTE.size :]),
+            }
+        elif nome == "lote":
+            return nome, {"leituras": _decodificar_lote(payload)}
+        elif nome == "msgpack":
+            if msgpack is None:
+                raise PayloadInvalido("Payload MessagePack recebido, mas o pacote msgpack não está instalado")
+            return nome, msgpack.unpackb(payload, raw=False)
+        else:
+            return nome, json.loads(payload.decode())
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        if isinstance(e, PayloadInvalido):
+            raise
+        raise PayloadInvalido(f"Payload {_NOMES[nome]} inválido: {e}") from e
+
+    if timestamp:
+        dados["timestamp"] = timestamp
+    return nome, dados
+
+
+def chave_quadro(payload):
+    """(câmera, quadro) de uma parte de imagem; None se o payload não for uma parte válida
+
+    No formato binário só o cabeçalho é lido, sem copiar os bytes da parte.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    try:
+        if formato(payload) == "parte":
+            return None, _PARTE.unpack_from(payload, 1)[0]
+        _, dados = decodificar(payload)
+        return dados.get("camera"), dados["quadro"]
+    except (PayloadInvalido, struct.error, AttributeError, KeyError, TypeError):
+        return None
+
+
+def _valor_float32(valor):
+    # float32 tem ~7 dígitos significativos: evita 24.299999237060547 no lugar de 24.3
+    return float(f"{valor:.7g}")
+
+
+def _decodificar_lote(payload):
+    (quantidade,) = _QUANTIDADE.unpack_from(payload, 1)
+    inicio = 1 + _QUANTIDADE.size
+    if len(payload) != inicio + quantidade * _REGISTRO_LOTE.size:
+        raise PayloadInvalido(f"Lote com {quantidade} leituras e {len(payload)} bytes")
+
+    leituras = []
+    for codigo, canteiro, timestamp, valor in _REGISTRO_LOTE.iter_unpack(payload[inicio:]):
+        if codigo not in CAMPOS_ESCALARES:
+            raise PayloadInvalido(f"Campo escalar desconhecido: {codigo}")
+        leitura = {CAMPOS_ESCALARES[codigo]: _valor_float32(valor)}
+        if canteiro:
+            leitura["canteiro"] = canteiro
+        if timestamp:
+            leitura["timestamp"] = timestamp
+        leituras.append(leitura)
+    return leituras
+
+
+def codificar_escalar(campo, valor, timestamp=0):
+    """Monta o payload binário de uma leitura escalar (usado por simuladores e testes)"""
+    return bytes([FORMATO_ESCALAR]) + _ESCALAR.pack(CODIGOS_CAMPOS[campo], int(timestamp), valor)
+
+
+def codificar_imagem(imagem, timestamp=0):
+    return bytes([FORMATO_IMAGEM]) + _TIMESTAMP.pack(int(timestamp)) + bytes(imagem)
+
+
+def codificar_lote(leituras):
+    """Monta o payload binário de um lote a partir de tuplas (campo, valor, timestamp, canteiro)"""
+    registros = [
+        _REGISTRO_LOTE.pack(CODIGOS_CAMPOS[campo], canteiro or 0, int(timestamp), valor)
+        for campo, valor, timestamp, canteiro in leituras
+    ]
+    return bytes([FORMATO_LOTE]) + _QUANTIDADE.pack(len(registros)) + b"".join(registros)
+
+
+def codificar_partes(imagem, quadro, tamanho_parte=4096, timestamp=0):
+    """Divide uma imagem nos payloads binários das partes de um quadro"""
+    partes = [imagem[inicio : inicio + tamanho_parte] for inicio in range(0, len(imagem), tamanho_parte)] or [b""]
+    return [
+        bytes([FORMATO_PARTE]) + _PARTE.pack(quadro, indice, len(partes), int(timestamp), zlib.crc32(parte)) + parte
+        for indice, parte in enumerate(partes)
+    ]
@@ -0,0 +1,210 @@
+"""
+Políticas de retenção das tabelas que crescem com a ingestão.
+
+RETENCAO_POLITICAS declara, por tabela, por quanto tempo as linhas são mantidas, por
+exemplo "dado_periodico=30d>hora,agregado_leitura.hora=730d,log=365d": leituras brutas
+por 30 dias, depois apenas os agregados por hora (lib/agregados.py), removidos após dois
+anos. O arquivamento e os agregados são preparados em etapas, e as remoções feitas em
+lotes de RETENCAO_LOTE linhas, cada um na sua transação; cada execução para ao atingir
+RETENCAO_TEMPO_MAX_S (após ao menos uma etapa e um lote por tabela) e o restante fica
+para a próxima.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+from os import getenv
+
+from sqlalchemy import delete, select
+
+from lib.agregados import RESOLUCOES, AgregadorLeituras, intervalos_sem_resumo
+
+# Ex.: "dado_periodico=30d>hora,agregado_leitura.minuto=90d,status_mqtt=30d" (vazio = nada expira)
+RETENCAO_POLITICAS = getenv("RETENCAO_POLITICAS", "")
+RETENCAO_LOTE = int(getenv("RETENCAO_LOTE", 5000))
+RETENCAO_TEMPO_MAX_S = float(getenv("RETENCAO_TEMPO_MAX_S", 2))
+RETENCAO_INTERVALO_S = float(getenv("RETENCAO_INTERVALO_S", 300))
+
+UNIDADES = {"h": "hours", "d": "days"}
+
+
+def _alvo(nome):
+    """(modelo, coluna de data, condições extras) de um alvo de retenção"""
+    from lib.models import AgregadoLeitura, DadoPeriodico, Log, StatusDispositivo, StatusMQTT
+
+    tabela, _, resolucao = nome.partition(".")
+    if tabela == "agregado_leitura" and resolucao in RESOLUCOES:
+        return AgregadoLeitura, AgregadoLeitura.inicio, [AgregadoLeitura.resolucao == resolucao]
+    alvos = {
+        "dado_periodico": (DadoPeriodico, DadoPeriodico.data_hora),
+        "status_dispositivo": (StatusDispositivo, StatusDispositivo.data_hora),
+        "status_mqtt": (StatusMQTT, StatusMQTT.ultima_mensagem),
+        "log": (Log, Log.data_hora),
+    }
+    if resolucao or tabela not in alvos:
+        raise ValueError(f"Tabela sem política de retenção: {nome}")
+    return (*alvos[tabela], [])
+
+
+def _duracao(texto):
+    texto = texto.strip().lower()
+    if not texto or texto[-1] not in UNIDADES:
+        raise ValueError(f"Prazo de retenção inválido: {texto!r} (use horas ou dias, ex.: 12h, 30d)")
+    return timedelta(**{UNIDADES[texto[-1]]: float(texto[:-1])})
+
+
+class Politica:
+    __slots__ = ("nome", "manter", "resumo")
+
+    def __init__(self, nome, manter, resumo=None):
+        if resumo is not None and (nome != "dado_periodico" or resumo not in RESOLUCOES):
+            raise ValueError(f"Resumo {resumo!r} inválido para {nome}: só dado_periodico>minuto|hora|dia")
+        _alvo(nome)
+        self.nome = nome
+        self.manter = manter
+        self.resumo = resumo
+
+    def __repr__(self):
+        horas = self.manter / timedelta(hours=1)
+        prazo = f"{horas / 24:g}d" if horas % 24 == 0 else f"{horas:g}h"
+        return f"{self.nome}={prazo}{'>' + self.resumo if self.resumo else ''}"
+
+
+def ler_politicas(texto):
+    """Políticas a partir de "tabela=prazo[>resolução],..." (prazos em h ou d)"""
+    politicas = []
+    for item in filter(None, (parte.strip() for parte in texto.split(","))):
+        nome, _, regra = item.partition("=")
+        prazo, _, resumo = regra.partition(">")
+        politicas.append(Politica(nome.strip(), _duracao(prazo), resumo.strip() or None))
+    return politicas
+
+
+class MotorRetencao:
+    """Aplica as políticas de retenção em lotes com transações curtas"""
+
+    def __init__(self, politicas=None, lote=RETENCAO_LOTE, tempo_max_s=RETENCAO_TEMPO_MAX_S, agregador=None, arquivo=None):
+        self.politicas = ler_politicas(RETENCAO_POLITICAS) if politicas is None else list(politicas)
+        self.lote = lote
+        self.tempo_max_s = tempo_max_s
+        self.agregador = agregador or AgregadorLeituras()
+        # ArquivoColunar que recebe os meses de dado_periodico antes da remoção (lib/arquivo.py)
+        self.arquivo = arquivo
+
+        # Métricas expostas em status()
+        self.execucoes = 0
+        self.removidas = dict.fromkeys((politica.nome for politica in self.politicas), 0)
+        self.ultima_execucao = None
+
+    def preparar_remocao(self, session, corte, resumo=None, prazo_final=None):
+        """Arquiva e garante os agregados das leituras brutas anteriores a corte antes de removê-las
+
+        Usado pela retenção por linhas e pela expiração das partições mensais (lib/particoes.py).
+        O trabalho é feito em etapas (um mês de uma sessão arquivado, um dia de agregados), cada
+        uma na sua transação, até prazo_final (monotonic; ao menos uma etapa por chamada).
+        Retorna até quando as leituras estão prontas para remoção: corte, ou antes dele se o
+        prazo acabou, e o restante fica para a próxima execução.
+        """
+        pronto = corte
+        if self.arquivo is not None:
+            pronto = self._arquivar(session, pronto, prazo_final)
+        if resumo:
+            pronto = self._garantir_resumo(session, resumo, pronto, prazo_final)
+        return pronto
+
+    def _arquivar(self, session, corte, prazo_final):
+        """Exporta os meses pendentes antes de corte, um por transação; retorna até onde foi arquivado"""
+        for indice, (sessao_id, mes) in enumerate(self.arquivo.pendentes(session, ate=corte)):
+            if indice and prazo_final is not None and time.monotonic() >= prazo_final:
+                return min(corte, mes)
+            self.arquivo.exportar_mes(session, sessao_id, mes)
+            session.commit()
+        return corte
+
+    def _garantir_resumo(self, session, resumo, corte, prazo_final):
+        """Recalcula os agregados antes de remover leituras brutas que ainda não têm resumo
+
+        Os agregados são mantidos pela ingestão; cada intervalo entre a leitura mais antiga e
+        corte precisa de um agregado com ao menos tantas leituras quanto as brutas (falta em
+        leituras gravadas fora da ingestão ou antes de agregado_leitura existir). Os dias com
+        intervalos sem resumo são refeitos um por transação; retorna até onde há resumo.
+        """
+        dias = sorted({RESOLUCOES["dia"](inicio) for inicio in intervalos_sem_resumo(session, resumo, corte)})
+        if dias:
+            logging.info(
+                f"Agregando leituras de {dias[0]:%Y-%m-%d} a {corte:%Y-%m-%d} antes da retenção "
+                f"({len(dias)} dias sem resumo)"
+            )
+        for indice, dia in enumerate(dias):
+            if indice and prazo_final is not None and time.monotonic() >= prazo_final:
+                return min(corte, dia)
+            self.agregador.recalcular(session, dia, dia)
+            session.commit()
+        return corte
+
+    def aplicar(self, session, politica, agora, prazo_final):
+        """Remove as linhas expiradas da política até esgotar ou até prazo_final (monotonic)"""
+        modelo, coluna, condicoes = _alvo(politica.nome)
+        corte = agora - politica.manter
+        inicio = time.monotonic()
+        preparada = True
+        if politica.nome == "dado_periodico":
+            if self.arquivo is not None:
+                # Só meses fechados são arquivados: o mês atual fica inteiro no banco até fechar
+                corte = min(corte, datetime(agora.year, agora.month, 1))
+            pronto = self.preparar_remocao(session, corte, politica.resumo, prazo_final)
+            # Remove só o que já foi arquivado e resumido; o restante espera a próxima execução
+            preparada, corte = pronto >= corte, pronto
+
+        condicoes = [coluna < corte, *condicoes]
+        removidas, completa = 0, False
+        while True:
+            # Subconsulta com LIMIT: cada DELETE toca no máximo self.lote linhas
+            alvo = select(modelo.id).where(*condicoes).limit(self.lote)
+            removidas_lote = session.execute(delete(modelo).where(modelo.id.in_(alvo))).rowcount
+            session.commit()
+            removidas += removidas_lote
+            if removidas_lote < self.lote:
+                completa = preparada
+                break
+            if time.monotonic() >= prazo_final:
+                break
+        return {
+            "politica": repr(politica),
+            "removidas": removidas,
+            "segundos": round(time.monotonic() - inicio, 3),
+            "completa": completa,
+        }
+
+    def executar(self, session, agora=None):
+        """Aplica todas as políticas; retorna o relatório da execução"""
+        agora = agora or datetime.now()
+        inicio = time.monotonic()
+        prazo_final = inicio + self.tempo_max_s
+        relatorio = {"inicio": agora.isoformat(), "politicas": []}
+        for politica in self.politicas:
+            # Cada política remove ao menos um lote por execução, mesmo com o tempo esgotado
+            try:
+                resultado = self.aplicar(session, politica, agora, prazo_final)
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Erro ao aplicar a retenção de {politica.nome}: {e}")
+                resultado = {"politica": repr(politica), "removidas": 0, "segundos": 0, "completa": False, "erro": str(e)}
+            self.removidas[politica.nome] += resultado["removidas"]
+            relatorio["politicas"].append(resultado)
+        relatorio["removidas"] = sum(resultado["removidas"] for resultado in relatorio["politicas"])
+        relatorio["segundos"] = round(time.monotonic() - inicio, 3)
+        self.execucoes += 1
+        self.ultima_execucao = relatorio
+        if relatorio["removidas"]:
+            logging.info(f"Retenção: {relatorio['removidas']} linhas removidas em {relatorio['segundos']}s")
+        return relatorio
+
+    def status(self):
+        return {
+            "politicas": [repr(politica) for politica in self.politicas],
+            "execucoes": self.execucoes,
+            "removidas": dict(self.removidas),
+            "ultima_execucao": self.ultima_execucao,
+            "arquivo": self.arquivo.status() if self.arquivo is not None else None,
+        }
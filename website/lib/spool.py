@@ -0,0 +1,191 @@
+"""
+Spool local de mensagens para quando o banco de dados está indisponível.
+
+As mensagens de um lote que não pôde ser gravado são anexadas a um arquivo mapeado
+em memória (append-only) e reproduzidas em lotes quando o banco volta. O arquivo
+guarda no cabeçalho as posições de escrita e de leitura, então o spool sobrevive a
+reinícios do processo sem manter as mensagens em RAM.
+
+Formato: cabeçalho <4sQQ> = "SPL1", posição de escrita, posição de leitura; cada
+registro é <IIdH> = tamanho do payload, crc32 (tópico + payload), horário de
+recebimento (epoch), tamanho do tópico, seguido do tópico e do payload.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from os import getenv
+
+# Configurações do spool
+SPOOL_ARQUIVO = getenv("SPOOL_ARQUIVO", "spool/ingestao.spool")
+SPOOL_TAMANHO_MB = int(getenv("SPOOL_TAMANHO_MB", 64))
+
+_MAGICO = b"SPL1"
+_CABECALHO = struct.Struct("<4sQQ")
+_REGISTRO = struct.Struct("<IIdH")
+
+
+class SpoolIngestao:
+    """Arquivo de tamanho fixo com as mensagens pendentes; aberto apenas quando necessário"""
+
+    def __init__(self, arquivo=SPOOL_ARQUIVO, tamanho_mb=SPOOL_TAMANHO_MB):
+        self.arquivo = arquivo
+        self.capacidade = max(1, tamanho_mb) * 1024 * 1024
+        self._mapa = None
+        self._escrita = _CABECALHO.size
+        self._leitura = _CABECALHO.size
+        self._lock = threading.Lock()
+
+        # Métricas expostas em status()
+        self.pendentes = 0
+        self.anexadas = 0
+        self.reproduzidas = 0
+        self.descartadas = 0
+        self.ultima_reproducao = None
+
+    @property
+    def aberto(self):
+        return self._mapa is not None
+
+    def abrir(self):
+        """Mapeia o arquivo, criando-o se preciso, e recupera as mensagens pendentes"""
+        with self._lock:
+            if self.aberto:
+                return
+            diretorio = os.path.dirname(self.arquivo)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            novo = not os.path.exists(self.arquivo)
+            with open(self.arquivo, "a+b") as arquivo:
+                if os.path.getsize(self.arquivo) < self.capacidade:
+                    arquivo.truncate(self.capacidade)
+                self._mapa = mmap.mmap(arquivo.fileno(), 0)
+            self.capacidade = len(self._mapa)
+
+            magico, escrita, leitura = _CABECALHO.unpack_from(self._mapa, 0)
+            if novo or magico != _MAGICO or not _CABECALHO.size <= leitura <= escrita <= self.capacidade:
+                self._escrita = self._leitura = _CABECALHO.size
+                self._gravar_cabecalho()
+            else:
+                self._escrita, self._leitura = escrita, leitura
+                self._recuperar()
+        if self.pendentes:
+            logging.warning(f"Spool de ingestão com {self.pendentes} mensagens pendentes em {self.arquivo}")
+
+    def abrir_existente(self):
+        """Abre o spool deixado por uma execução anterior, se houver"""
+        if not self.aberto and os.path.exists(self.arquivo):
+            self.abrir()
+        return self.aberto
+
+    def fechar(self):
+        with self._lock:
+            if self._mapa is not None:
+                self._mapa.flush()
+                self._mapa.close()
+                self._mapa = None
+
+    def anexar(self, mensagens, recebida_em=None):
+        """Anexa (topic, payload[, recebida_em]) ao final do spool; retorna quantas couberam"""
+        if not self.aberto:
+            self.abrir()
+        recebida_em = time.time() if recebida_em is None else recebida_em
+        with self._lock:
+            anexadas = 0
+            for mensagem in mensagens:
+                topic, payload = mensagem[0], mensagem[1]
+                instante = mensagem[2] if len(mensagem) > 2 and mensagem[2] is not None else recebida_em
+                topico = topic.encode()
+                payload = payload.encode() if isinstance(payload, str) else bytes(payload)
+                tamanho = _REGISTRO.size + len(topico) + len(payload)
+                if self._escrita + tamanho > self.capacidade:
+                    self.descartadas += 1
+                    logging.error(f"Spool de ingestão cheio ({self.capacidade} bytes); mensagem de {topic} perdida")
+                    continue
+                crc = zlib.crc32(payload, zlib.crc32(topico))
+                _REGISTRO.pack_into(self._mapa, self._escrita, len(payload), crc, instante, len(topico))
+                inicio = self._escrita + _REGISTRO.size
+                self._mapa[inicio : inicio + len(topico)] = topico
+                self._mapa[inicio + len(topico) : inicio + len(topico) + len(payload)] = payload
+                self._escrita += tamanho
+                anexadas += 1
+            if anexadas:
+                self.pendentes += anexadas
+                self.anexadas += anexadas
+                self._gravar_cabecalho()
+                self._mapa.flush()
+        return anexadas
+
+    def ler(self, limite):
+        """Retorna até limite registros (topic, payload, recebida_em) e a posição após o último, sem consumir"""
+        with self._lock:
+            registros = []
+            posicao = self._leitura
+            while len(registros) < limite and posicao < self._escrita:
+                registro, proxima = self._ler_registro(posicao)
+                if registro is None:
+                    break
+                registros.append(registro)
+                posicao = proxima
+            return registros, posicao
+
+    def consumir(self, posicao, quantidade):
+        """Marca como reproduzidos os registros até posicao; o arquivo é reaproveitado quando esvazia"""
+        with self._lock:
+            self._leitura = posicao
+            self.pendentes = max(0, self.pendentes - quantidade)
+            self.reproduzidas += quantidade
+            self.ultima_reproducao = time.time()
+            if self._leitura >= self._escrita:
+                self._escrita = self._leitura = _CABECALHO.size
+                self.pendentes = 0
+            self._gravar_cabecalho()
+            self._mapa.flush()
+
+    def _ler_registro(self, posicao):
+        if posicao + _REGISTRO.size > self._escrita:
+            return None, posicao
+        tamanho, crc, recebida_em, tamanho_topico = _REGISTRO.unpack_from(self._mapa, posicao)
+        inicio = posicao + _REGISTRO.size
+        fim = inicio + tamanho_topico + tamanho
+        if fim > self._escrita:
+            return None, posicao
+        topico = self._mapa[inicio : inicio + tamanho_topico]
+        payload = self._mapa[inicio + tamanho_topico : fim]
+        if zlib.crc32(payload, zlib.crc32(topico)) != crc:
+            return None, posicao
+        return (topico.decode(), payload, recebida_em), fim
+
+    def _recuperar(self):
+        """Conta os registros pendentes e descarta o final corrompido de uma escrita interrompida"""
+        self.pendentes = 0
+        posicao = self._leitura
+        while posicao < self._escrita:
+            registro, proxima = self._ler_registro(posicao)
+            if registro is None:
+                logging.error(f"Spool de ingestão corrompido a partir do byte {posicao}; final descartado")
+                self._escrita = posicao
+                self._gravar_cabecalho()
+                break
+            self.pendentes += 1
+            posicao = proxima
+
+    def _gravar_cabecalho(self):
+        _CABECALHO.pack_into(self._mapa, 0, _MAGICO, self._escrita, self._leitura)
+
+    def status(self):
+        return {
+            "arquivo": self.arquivo,
+            "aberto": self.aberto,
+            "capacidade_bytes": self.capacidade,
+            "usados_bytes": self._escrita - self._leitura,
+            "pendentes": self.pendentes,
+            "anexadas": self.anexadas,
+            "reproduzidas": self.reproduzidas,
+            "descartadas": self.descartadas,
+            "ultima_reproducao": self.ultima_reproducao,
+        }
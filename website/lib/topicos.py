@@ -0,0 +1,221 @@
+"""
+Tópicos MQTT do sistema, roteador de mensagens baseado em trie com curingas e
+particionamento dos tópicos entre workers com assinaturas compartilhadas.
+"""
+
+import zlib
+
+MQTT_TOPICS = {
+    "temperatura": "estufa/temperatura",
+    "umidade_ar": "estufa/umidade/ar",
+    "umidade_solo": "estufa/umidade/solo/#",
+    "camera": "estufa/camera/imagem",
+    "camera_parte": "estufa/camera/parte",
+    "irrigacao_status": "estufa/irrigacao/status",
+    "ventilacao_status": "estufa/ventilacao/status",
+    "iluminacao_status": "estufa/iluminacao/status",
+    "alerta": "estufa/alerta",
+    "leituras": "estufa/leituras",
+    "irrigacao_manual": "estufa/irrigacao/manual",
+    "ventilacao_manual": "estufa/ventilacao/manual",
+    "iluminacao_manual": "estufa/iluminacao/manual",
+}
+
+# Distribuição de cada tópico entre os workers no modo de assinatura compartilhada:
+# - "sessao": todos os workers recebem e cada um processa apenas as sessões da sua partição
+# - "dono": o tópico inteiro pertence a uma única partição, preservando a ordem do dispositivo
+# - "compartilhado": $share/<grupo>/..., o broker entrega cada mensagem a um único worker
+# Tópicos ausentes (comandos publicados pelo próprio servidor) não são assinados nesse modo.
+DISTRIBUICAO_TOPICOS = {
+    "temperatura": "sessao",
+    "umidade_ar": "sessao",
+    "umidade_solo": "sessao",
+    "camera": "sessao",
+    "camera_parte": "sessao",
+    "irrigacao_status": "dono",
+    "ventilacao_status": "dono",
+    "iluminacao_status": "dono",
+    "alerta": "compartilhado",
+    "leituras": "sessao",
+}
+
+
+def particao(chave, total):
+    """Partição estável de uma chave (id da sessão/canteiro ou tópico) entre total workers"""
+    return zlib.crc32(str(chave).encode()) % total
+
+
+class Particionamento:
+    """Divisão do tráfego de ingestão entre os workers de um grupo de assinatura compartilhada"""
+
+    def __init__(self, grupo=None, indice=0, total=1):
+        if total < 1 or not 0 <= indice < total:
+            raise ValueError(f"Worker {indice} inválido para {total} workers")
+        self.grupo = grupo or None
+        self.indice = indice
+        self.total = total
+        self.ignoradas = 0
+
+    @property
+    def ativo(self):
+        return self.grupo is not None
+
+    def possui(self, chave):
+        return not self.ativo or particao(chave, self.total) == self.indice
+
+    def assinaturas(self, topicos=None):
+        """Filtros a assinar neste worker; sem grupo, todos os tópicos como antes"""
+        topicos = MQTT_TOPICS if topicos is None else topicos
+        if not self.ativo:
+            return list(topicos.values())
+
+        filtros = []
+        for nome, topico in topicos.items():
+            modo = DISTRIBUICAO_TOPICOS.get(nome)
+            if modo == "compartilhado":
+                filtros.append(f"$share/{self.grupo}/{topico}")
+            elif modo == "sessao" or (modo == "dono" and self.possui(topico)):
+                filtros.append(topico)
+        return filtros
+
+    def status(self):
+        return {
+            "grupo": self.grupo,
+            "indice": self.indice,
+            "total": self.total,
+            "ignoradas": self.ignoradas,
+        }
+
+
+def filtro_mqtt(padrao):
+    """Converte um padrão de rota ("estufa/umidade/solo/{canteiro}") no filtro MQTT equivalente"""
+    return "/".join("+" if _nome_parametro(nivel) else nivel for nivel in padrao.split("/"))
+
+
+def _nome_parametro(nivel):
+    if len(nivel) > 2 and nivel[0] == "{" and nivel[-1] == "}":
+        return nivel[1:-1]
+    return None
+
+
+class Rota:
+    __slots__ = ("padrao", "handler", "parametros", "prioridade", "acertos")
+
+    def __init__(self, padrao, handler, parametros, prioridade=None):
+        self.padrao = padrao
+        self.handler = handler
+        self.parametros = parametros
+        self.prioridade = prioridade
+        self.acertos = 0
+
+
+class _No:
+    __slots__ = ("filhos", "curinga", "multinivel", "rota")
+
+    def __init__(self):
+        self.filhos = {}
+        self.curinga = None
+        self.multinivel = None
+        self.rota = None
+
+
+class RoteadorTopicos:
+    """Despacha tópicos para handlers registrados com filtros MQTT (+ e #) e parâmetros nomeados
+
+    O custo de resolução depende apenas da profundidade do tópico, não do número de rotas.
+    Precedência por nível: literal, depois + (ou {parametro}), depois #.
+    """
+
+    def __init__(self):
+        self._raiz = _No()
+        self.rotas = []
+        self.nao_roteadas = 0
+
+    def registrar(self, padrao, handler, prioridade=None):
+        niveis = padrao.split("/")
+        if "#" in niveis[:-1]:
+            raise ValueError(f"'#' só pode ser o último nível do filtro: {padrao}")
+
+        no = self._raiz
+        parametros = []
+        for nivel in niveis:
+            nome = _nome_parametro(nivel)
+            if nivel == "#":
+                no.multinivel = no.multinivel or _No()
+                no = no.multinivel
+                parametros.append("#")
+            elif nivel == "+" or nome:
+                no.curinga = no.curinga or _No()
+                no = no.curinga
+                parametros.append(nome)
+            else:
+                no = no.filhos.setdefault(nivel, _No())
+
+        if no.rota is not None:
+            raise ValueError(f"Rota já registrada para o filtro {filtro_mqtt(padrao)}")
+        no.rota = Rota(padrao, handler, tuple(parametros), prioridade)
+        self.rotas.append(no.rota)
+        return no.rota
+
+    def filtros(self):
+        return [filtro_mqtt(rota.padrao) for rota in self.rotas]
+
+    def resolver(self, topic):
+        """Retorna (rota, parametros) para o tópico ou (None, {}) se nenhuma rota casar"""
+        niveis = topic.split("/")
+        capturas = []
+        # Tópicos de sistema ($SYS/...) não casam com curingas no primeiro nível
+        rota = self._buscar(self._raiz, niveis, 0, capturas, not topic.startswith("$"))
+        if rota is None:
+            return None, {}
+
+        parametros = {}
+        for nome, valor in zip(rota.parametros, capturas):
+            if nome:
+                parametros[nome] = valor
+        return rota, parametros
+
+    def _buscar(self, no, niveis, indice, capturas, curingas=True):
+        if indice == len(niveis):
+            if no.rota is not None:
+                return no.rota
+            # "a/#" também casa com "a"
+            if no.multinivel is not None and no.multinivel.rota is not None:
+                capturas.append("")
+                return no.multinivel.rota
+            return None
+
+        nivel = niveis[indice]
+        filho = no.filhos.get(nivel)
+        if filho is not None:
+            rota = self._buscar(filho, niveis, indice + 1, capturas)
+            if rota is not None:
+                return rota
+
+        if curingas and no.curinga is not None:
+            capturas.append(nivel)
+            rota = self._buscar(no.curinga, niveis, indice + 1, capturas)
+            if rota is not None:
+                return rota
+            capturas.pop()
+
+        if curingas and no.multinivel is not None and no.multinivel.rota is not None:
+            capturas.append("/".join(niveis[indice:]))
+            return no.multinivel.rota
+        return None
+
+    def despachar(self, topic, data):
+        """Chama o handler da rota com o payload e os parâmetros extraídos; False se não houver rota"""
+        rota, parametros = self.resolver(topic)
+        if rota is None:
+            self.nao_roteadas += 1
+            return False
+        rota.acertos += 1
+        rota.handler(data, **parametros)
+        return True
+
+    def estatisticas(self):
+        return {
+            "rotas": {rota.padrao: rota.acertos for rota in self.rotas},
+            "nao_roteadas": self.nao_roteadas,
+        }
@@ -0,0 +1,171 @@
+"""
+Última leitura de cada sessão, materializada em ultimo_dado_sessao.
+
+Cada leitura gravada atualiza a linha da sessão com um upsert na mesma transação: o lote
+da ingestão chama registrar() antes de descarregar e as gravações pelo ORM passam pelo
+evento after_insert de DadoPeriodico (lib/models.py). A linha guarda também a imagem mais
+recente e o estado da última SessaoIrrigacao, e a página inicial, o dashboard móvel e o
+cache de leituras da ingestão leem só esta tabela. O estado da irrigação não é tocado pelas
+leituras: alterações em sessao_irrigacao chegam pelos eventos do ORM (registrar_irrigacao)
+e, no PostgreSQL, também por um gatilho (init.sql), com a mesma ordem para a mais recente.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import and_, case, delete, func, insert, or_, select
+from sqlalchemy.orm import aliased
+
+CAMPOS_ULTIMO = ("data_hora", "temperatura", "umidade_ar", "umidade_solo", "exaustor_ligado")
+CAMPOS_IMAGEM = ("imagem_sha256", "imagem_data_hora")
+
+
+def _upsert(conexao, modelo):
+    if conexao.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+    else:
+        from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+    return insert_dialeto(modelo)
+
+
+def estado_irrigacao(conexao, sessoes):
+    """{sessao_id: (status, data_inicio)} da SessaoIrrigacao mais recente de cada sessão
+
+    Uma linha por sessão, pelo índice (sessao_id, data_inicio). A mais recente é a de maior
+    data_inicio, com data_inicio nulo por último e id como desempate, como no gatilho de init.sql.
+    """
+    from lib.models import SessaoIrrigacao
+
+    recente = aliased(SessaoIrrigacao)
+    ultima = (
+        select(recente.id)
+        .where(recente.sessao_id == SessaoIrrigacao.sessao_id)
+        .order_by(recente.data_inicio.desc().nulls_last(), recente.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    consulta = select(SessaoIrrigacao.sessao_id, SessaoIrrigacao.status, SessaoIrrigacao.data_inicio).where(
+        SessaoIrrigacao.id == ultima
+    )
+    if sessoes is not None:
+        consulta = consulta.where(SessaoIrrigacao.sessao_id.in_(sessoes))
+    return {linha.sessao_id: (linha.status, linha.data_inicio) for linha in conexao.execute(consulta)}
+
+
+def linhas_ultimos(leituras, irrigacao, sessoes=()):
+    """Linhas de ultimo_dado_sessao com a leitura e a imagem mais recentes de cada sessão"""
+    por_sessao = {}
+    for sessao_id in (*sessoes, *(leitura["sessao_id"] for leitura in leituras)):
+        if sessao_id not in por_sessao:
+            status, inicio = irrigacao.get(sessao_id, (False, None))
+            por_sessao[sessao_id] = dict.fromkeys(CAMPOS_ULTIMO + CAMPOS_IMAGEM)
+            por_sessao[sessao_id].update(sessao_id=sessao_id, esta_irrigando=bool(status), irrigacao_inicio=inicio)
+
+    for leitura in leituras:
+        linha = por_sessao[leitura["sessao_id"]]
+        data_hora = leitura.get("data_hora") or datetime.now()
+        if linha["data_hora"] is None or data_hora >= linha["data_hora"]:
+            linha.update({campo: leitura.get(campo) for campo in CAMPOS_ULTIMO}, data_hora=data_hora)
+        # Leituras antigas podem ter os bytes na coluna imagem, sem sha256
+        tem_imagem = leitura.get("imagem_sha256") or leitura.get("imagem") is not None
+        if tem_imagem and (linha["imagem_data_hora"] is None or data_hora >= linha["imagem_data_hora"]):
+            linha.update(imagem_sha256=leitura.get("imagem_sha256"), imagem_data_hora=data_hora)
+    return list(por_sessao.values())
+
+
+def registrar(conexao, leituras):
+    """Atualiza as sessões das leituras, mantendo o que for mais recente; retorna as sessões afetadas
+
+    Não consulta sessao_irrigacao: o estado da irrigação de uma linha existente é mantido.
+    """
+    from lib.models import UltimoDadoSessao
+
+    if not leituras:
+        return 0
+    linhas = linhas_ultimos(leituras, {})
+
+    instrucao = _upsert(conexao, UltimoDadoSessao)
+    novo = instrucao.excluded
+    tabela = UltimoDadoSessao.__table__.c
+    # No SET as colunas da tabela ainda têm os valores anteriores ao upsert
+    leitura_recente = or_(tabela.data_hora.is_(None), novo.data_hora >= tabela.data_hora)
+    imagem_recente = and_(
+        novo.imagem_data_hora.isnot(None),
+        or_(tabela.imagem_data_hora.is_(None), novo.imagem_data_hora >= tabela.imagem_data_hora),
+    )
+    valores = {campo: case((leitura_recente, novo[campo]), else_=tabela[campo]) for campo in CAMPOS_ULTIMO}
+    valores.update({campo: case((imagem_recente, novo[campo]), else_=tabela[campo]) for campo in CAMPOS_IMAGEM})
+    conexao.execute(instrucao.on_conflict_do_update(index_elements=["sessao_id"], set_=valores), linhas)
+    return len(linhas)
+
+
+def registrar_irrigacao(conexao, sessoes):
+    """Atualiza só o estado da irrigação das sessões, criando a linha se ainda não existir"""
+    from lib.models import UltimoDadoSessao
+
+    sessoes = set(sessoes)
+    if not sessoes:
+        return 0
+    linhas = linhas_ultimos([], estado_irrigacao(conexao, sessoes), sessoes)
+    instrucao = _upsert(conexao, UltimoDadoSessao)
+    valores = {"esta_irrigando": instrucao.excluded.esta_irrigando, "irrigacao_inicio": instrucao.excluded.irrigacao_inicio}
+    conexao.execute(instrucao.on_conflict_do_update(index_elements=["sessao_id"], set_=valores), linhas)
+    return len(linhas)
+
+
+def recalcular(conexao, sessoes=None):
+    """Refaz as linhas das sessões (todas, se None) a partir de dado_periodico e sessao_irrigacao"""
+    from lib.models import DadoPeriodico, Sessao, UltimoDadoSessao
+
+    if sessoes is None:
+        sessoes = conexao.scalars(select(Sessao.id)).all()
+    sessoes = list(sessoes)
+    if not sessoes:
+        return 0
+
+    colunas = [DadoPeriodico.sessao_id, *[getattr(DadoPeriodico, campo) for campo in CAMPOS_ULTIMO]]
+    ultima = (
+        select(DadoPeriodico.sessao_id, func.max(DadoPeriodico.data_hora).label("data_hora"))
+        .where(DadoPeriodico.sessao_id.in_(sessoes))
+        .group_by(DadoPeriodico.sessao_id)
+        .subquery()
+    )
+    com_imagem = or_(DadoPeriodico.imagem_sha256.isnot(None), DadoPeriodico.imagem.isnot(None))
+    ultima_imagem = (
+        select(DadoPeriodico.sessao_id, func.max(DadoPeriodico.data_hora).label("data_hora"))
+        .where(DadoPeriodico.sessao_id.in_(sessoes), com_imagem)
+        .group_by(DadoPeriodico.sessao_id)
+        .subquery()
+    )
+    leituras = conexao.execute(
+        select(*colunas)
+        .join(ultima, and_(DadoPeriodico.sessao_id == ultima.c.sessao_id, DadoPeriodico.data_hora == ultima.c.data_hora))
+        .order_by(DadoPeriodico.id)
+    )
+    linhas = linhas_ultimos([linha._asdict() for linha in leituras], estado_irrigacao(conexao, sessoes), sessoes)
+
+    por_sessao = {linha["sessao_id"]: linha for linha in linhas}
+    imagens = conexao.execute(
+        select(DadoPeriodico.sessao_id, DadoPeriodico.data_hora, DadoPeriodico.imagem_sha256)
+        .join(
+            ultima_imagem,
+            and_(DadoPeriodico.sessao_id == ultima_imagem.c.sessao_id, DadoPeriodico.data_hora == ultima_imagem.c.data_hora),
+        )
+        .where(com_imagem)
+        .order_by(DadoPeriodico.id)
+    )
+    for imagem in imagens:
+        por_sessao[imagem.sessao_id].update(imagem_sha256=imagem.imagem_sha256, imagem_data_hora=imagem.data_hora)
+
+    conexao.execute(delete(UltimoDadoSessao).where(UltimoDadoSessao.sessao_id.in_(sessoes)))
+    conexao.execute(insert(UltimoDadoSessao), linhas)
+    return len(linhas)
+
+
+def preencher(conexao):
+    """Cria as linhas das sessões que ainda não têm (tabela nova ou sessão criada sem leituras)"""
+    from lib.models import Sessao, UltimoDadoSessao
+
+    faltantes = conexao.scalars(
+        select(Sessao.id).where(~select(UltimoDadoSessao.sessao_id).where(UltimoDadoSessao.sessao_id == Sessao.id).exists())
+    ).all()
+    return recalcular(conexao, faltantes) if faltantes else 0
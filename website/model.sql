@@ -191,9 +191,9 @@ INSERT INTO status_dispositivo (tipo_dispositivo, status, sessao_id, usuario_id)
 ('iluminacao', 'DESLIGADO', NULL, NULL);
 
 -- Comandos de exemplo (histórico)
-INSERT INTO comando_dispositivo (tipo_dispositivo, comando, sessao_id, usuario_id, executado) VALUES
-('ventilacao', 'ON', NULL, (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true),
-('ventilacao', 'OFF', NULL, (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true),
-('iluminacao', 'ON', NULL, (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true),
-('irrigacao', 'ON', (SELECT id FROM sessao WHERE nome = 'Seção A - Tomates'), (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true),
-('irrigacao', 'OFF', (SELECT id FROM sessao WHERE nome = 'Seção A - Tomates'), (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true);
\ No newline at end of file
+INSERT INTO comando_dispositivo (tipo_dispositivo, comando, sessao_id, usuario_id, executado, estado) VALUES
+('ventilacao', 'ON', NULL, (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true, 'CONFIRMADO'),
+('ventilacao', 'OFF', NULL, (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true, 'CONFIRMADO'),
+('iluminacao', 'ON', NULL, (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true, 'CONFIRMADO'),
+('irrigacao', 'ON', (SELECT id FROM sessao WHERE nome = 'Seção A - Tomates'), (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true, 'CONFIRMADO'),
+('irrigacao', 'OFF', (SELECT id FROM sessao WHERE nome = 'Seção A - Tomates'), (SELECT id FROM usuario WHERE email = 'admin@siia.ifpb.edu.br'), true, 'CONFIRMADO');
\ No newline at end of file
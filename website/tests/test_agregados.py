@@ -0,0 +1,207 @@
+"""
+Testes para os agregados das leituras por minuto, hora e dia.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from lib.agregados import AgregadorLeituras, agregar, consultar, escolher_resolucao
+from lib.models import AgregadoLeitura, Cultura, DadoPeriodico, Sessao, SessaoUsuario
+
+INICIO = datetime(2024, 1, 1, 12)
+
+
+def _leitura(sessao_id, segundos, temperatura, umidade_ar=60.0, umidade_solo=40.0):
+    return {
+        "sessao_id": sessao_id,
+        "data_hora": INICIO + timedelta(seconds=segundos),
+        "temperatura": temperatura,
+        "umidade_ar": umidade_ar,
+        "umidade_solo": umidade_solo,
+    }
+
+
+@pytest.fixture
+def sessao_agregados(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+def _agregado(sessao_id, resolucao, inicio):
+    return AgregadoLeitura.query.filter_by(sessao_id=sessao_id, resolucao=resolucao, inicio=inicio).one()
+
+
+@pytest.mark.unit
+class TestAgregar:
+    def test_intervalos_por_resolucao(self):
+        linhas = agregar([_leitura(1, 10, 20.0), _leitura(1, 50, 24.0), _leitura(1, 70, 22.0)])
+        por_chave = {(linha["resolucao"], linha["inicio"]): linha for linha in linhas}
+
+        assert len(linhas) == 4
+        primeiro_minuto = por_chave[("minuto", INICIO)]
+        assert primeiro_minuto["contagem"] == 2
+        assert primeiro_minuto["temperatura_min"] == 20.0
+        assert primeiro_minuto["temperatura_max"] == 24.0
+        assert primeiro_minuto["temperatura_soma"] == 44.0
+        assert primeiro_minuto["temperatura_ultimo"] == 24.0
+        assert por_chave[("hora", INICIO)]["contagem"] == 3
+        assert por_chave[("dia", INICIO.replace(hour=0))]["temperatura_ultimo"] == 22.0
+
+    def test_ultimo_pela_data_hora(self):
+        # Leituras fora de ordem: o último valor é o da leitura mais recente
+        (linha,) = agregar([_leitura(1, 50, 24.0), _leitura(1, 10, 20.0)], resolucoes=("minuto",))
+
+        assert linha["temperatura_ultimo"] == 24.0
+        assert linha["ultima_data_hora"] == INICIO + timedelta(seconds=50)
+
+    def test_escolher_resolucao(self):
+        assert escolher_resolucao(INICIO, INICIO + timedelta(hours=6), max_pontos=1500) == "minuto"
+        assert escolher_resolucao(INICIO, INICIO + timedelta(days=30), max_pontos=1500) == "hora"
+        assert escolher_resolucao(INICIO, INICIO + timedelta(days=365), max_pontos=1500) == "dia"
+
+
+@pytest.mark.integration
+class TestAgregadorLeituras:
+    def test_lotes_somados_ao_intervalo(self, db_session, sessao_agregados):
+        agregador = AgregadorLeituras()
+        agregador.registrar(db_session.session, [_leitura(sessao_agregados.id, 30, 22.0)])
+        agregador.registrar(db_session.session, [_leitura(sessao_agregados.id, 10, 18.0, umidade_solo=50.0)])
+        db_session.session.commit()
+
+        minuto = _agregado(sessao_agregados.id, "minuto", INICIO)
+        assert minuto.contagem == 2
+        assert (minuto.temperatura_min, minuto.temperatura_max) == (18.0, 22.0)
+        assert minuto.umidade_solo_soma == 90.0
+        # O segundo lote é mais antigo e não substitui o último valor
+        assert minuto.temperatura_ultimo == 22.0
+        assert AgregadoLeitura.query.count() == 3
+
+    def test_recalcular_sem_contar_em_dobro(self, db_session, sessao_agregados):
+        for segundos, temperatura in ((0, 20.0), (90, 26.0), (4000, 23.0)):
+            db_session.session.add(
+                DadoPeriodico(
+                    data_hora=INICIO + timedelta(seconds=segundos),
+                    temperatura=temperatura,
+                    umidade_ar=60.0,
+                    umidade_solo=40.0,
+                    cultura_id=sessao_agregados.cultura_id,
+                    sessao_id=sessao_agregados.id,
+                    exaustor_ligado=False,
+                )
+            )
+        db_session.session.commit()
+
+        agregador = AgregadorLeituras()
+        for _ in range(2):
+            assert agregador.recalcular(db_session.session, INICIO + timedelta(hours=1)) == 3
+            db_session.session.commit()
+
+        dia = _agregado(sessao_agregados.id, "dia", INICIO.replace(hour=0))
+        assert dia.contagem == 3
+        assert dia.temperatura_max == 26.0
+        assert dia.temperatura_ultimo == 23.0
+        assert AgregadoLeitura.query.filter_by(resolucao="hora").count() == 2
+
+    def test_recuperar_parada_longa(self, db_session, sessao_agregados):
+        agregador = AgregadorLeituras()
+        agregador.registrar(db_session.session, [_leitura(sessao_agregados.id, 0, 20.0)])
+        # Leituras gravadas durante uma parada de vários dias, sem passar pela ingestão
+        for dias in range(1, 5):
+            db_session.session.add(
+                DadoPeriodico(
+                    cultura_id=sessao_agregados.cultura_id,
+                    exaustor_ligado=False,
+                    **_leitura(sessao_agregados.id, dias * 86400, 20.0 + dias),
+                )
+            )
+        db_session.session.commit()
+
+        lidas = agregador.recuperar(db_session.session, dias=2, agora=INICIO + timedelta(days=4))
+
+        assert lidas == 4
+        assert agregador.recalculos == 3
+        horas = AgregadoLeitura.query.filter_by(sessao_id=sessao_agregados.id, resolucao="hora").all()
+        # O agregado sem leitura bruta por trás (dia 0) é mantido
+        assert sorted(hora.inicio for hora in horas) == [INICIO + timedelta(days=dias) for dias in range(5)]
+
+    def test_recalcular_mantem_agregados_sem_leituras_brutas(self, db_session, sessao_agregados):
+        agregador = AgregadorLeituras()
+        leituras = [_leitura(sessao_agregados.id, segundos, 20.0) for segundos in (0, 1800, 3600, 5400)]
+        agregador.registrar(db_session.session, leituras)
+        # Só as duas últimas continuam em dado_periodico, como depois da retenção
+        for leitura in leituras[1:]:
+            db_session.session.add(DadoPeriodico(cultura_id=sessao_agregados.cultura_id, exaustor_ligado=False, **leitura))
+        db_session.session.commit()
+        DadoPeriodico.query.filter(DadoPeriodico.data_hora < INICIO + timedelta(seconds=3600)).delete()
+        db_session.session.commit()
+
+        agregador.recalcular(db_session.session, INICIO - timedelta(days=30))
+        db_session.session.commit()
+
+        assert _agregado(sessao_agregados.id, "minuto", INICIO).contagem == 1
+        # O dia e a primeira hora perderam leituras brutas: o agregado existente continua valendo
+        assert _agregado(sessao_agregados.id, "hora", INICIO).contagem == 2
+        assert _agregado(sessao_agregados.id, "dia", INICIO.replace(hour=0)).contagem == 4
+        assert _agregado(sessao_agregados.id, "hora", INICIO + timedelta(hours=1)).contagem == 2
+
+    def test_ingestao_mantem_agregados(self, cliente_mqtt, db_session, sessao_agregados):
+        cliente_mqtt.coalescedor.janela_padrao_ms = 0
+        inicio = int(INICIO.timestamp())
+        leituras = [{"timestamp": inicio + i * 20, "temperatura": 20.0 + i} for i in range(4)]
+        cliente_mqtt.process_message("estufa/leituras", json.dumps({"leituras": leituras}).encode())
+
+        gravadas = DadoPeriodico.query.filter_by(sessao_id=sessao_agregados.id).all()
+        hora = _agregado(sessao_agregados.id, "hora", INICIO)
+        assert hora.contagem == len(gravadas) == 4
+        assert hora.temperatura_soma == pytest.approx(sum(dado.temperatura for dado in gravadas))
+        assert cliente_mqtt.status()["agregados"]["leituras"] == 4
+
+    def test_consultar(self, db_session, sessao_agregados):
+        AgregadorLeituras().registrar(
+            db_session.session,
+            [_leitura(sessao_agregados.id, 0, 20.0), _leitura(sessao_agregados.id, 3600, 30.0)],
+        )
+        db_session.session.commit()
+
+        resolucao, serie = consultar(db_session.session, sessao_agregados.id, INICIO, INICIO + timedelta(days=1))
+        assert resolucao == "minuto"
+        assert [ponto["temperatura"]["media"] for ponto in serie] == [20.0, 30.0]
+
+        resolucao, serie = consultar(
+            db_session.session, sessao_agregados.id, INICIO, INICIO + timedelta(days=1), resolucao="dia"
+        )
+        assert resolucao == "dia"
+        assert serie[0]["contagem"] == 2
+        assert serie[0]["temperatura"] == {"min": 20.0, "max": 30.0, "media": 25.0, "ultimo": 30.0}
+
+
+@pytest.mark.integration
+class TestHistoricoEndpoint:
+    def test_historico(self, client, db_session, sessao_agregados, usuario_operador):
+        sessao_usuario = SessaoUsuario(
+            token="tok_historico", usuario_id=usuario_operador.id, data_expiracao=datetime.now() + timedelta(days=1)
+        )
+        db_session.session.add(sessao_usuario)
+        AgregadorLeituras().registrar(db_session.session, [_leitura(sessao_agregados.id, 0, 21.0)])
+        db_session.session.commit()
+        cabecalho = {"Authorization": "Bearer tok_historico"}
+        url = f"/api/sessoes/{sessao_agregados.id}/historico"
+        periodo = {"inicio": INICIO.isoformat(), "fim": (INICIO + timedelta(hours=2)).isoformat()}
+
+        res = client.get(url, query_string=dict(periodo, resolucao="hora"), headers=cabecalho)
+        assert res.status_code == 200
+        body = res.get_json()
+        assert body["resolucao"] == "hora"
+        assert body["serie"][0]["inicio"] == INICIO.isoformat()
+        assert body["serie"][0]["temperatura"]["ultimo"] == 21.0
+
+        assert client.get(url, query_string=dict(periodo, resolucao="semana"), headers=cabecalho).status_code == 400
+        assert client.get(url, query_string={"inicio": "ontem"}, headers=cabecalho).status_code == 400
+        assert client.get(url, query_string=periodo).status_code == 401
@@ -0,0 +1,129 @@
+"""
+Testes para o arquivo colunar de dado_periodico.
+"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import lib.arquivo
+from lib.arquivo import ArquivoColunar
+from lib.models import Cultura, DadoPeriodico, Sessao
+from lib.retencao import MotorRetencao, ler_politicas
+
+
+@pytest.fixture
+def sessao_arquivo(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+def _leituras(db_session, sessao, datas):
+    for indice, data_hora in enumerate(datas):
+        db_session.session.add(
+            DadoPeriodico(
+                data_hora=data_hora,
+                temperatura=20.0 + indice,
+                umidade_ar=60.0,
+                umidade_solo=40.0 - indice,
+                cultura_id=sessao.cultura_id,
+                sessao_id=sessao.id,
+                exaustor_ligado=False,
+            )
+        )
+    db_session.session.commit()
+
+
+@pytest.mark.integration
+class TestArquivoColunar:
+    def test_exporta_e_le_por_mes(self, db_session, sessao_arquivo, tmp_path):
+        numpy = pytest.importorskip("numpy")
+        _leituras(db_session, sessao_arquivo, [datetime(2024, 1, 31, 23), datetime(2024, 1, 5), datetime(2024, 2, 1)])
+        arquivo = ArquivoColunar(str(tmp_path), lote=1)
+
+        exportados = arquivo.exportar_pendentes(db_session.session)
+
+        assert exportados == {(sessao_arquivo.id, "2024-01"): 2, (sessao_arquivo.id, "2024-02"): 1}
+        assert arquivo.meses(sessao_arquivo.id) == [date(2024, 1, 1), date(2024, 2, 1)]
+        janeiro = arquivo.ler_mes(sessao_arquivo.id, date(2024, 1, 1))
+        assert isinstance(janeiro["temperatura"], numpy.memmap)
+        # Ordenado por data_hora
+        assert janeiro["temperatura"].tolist() == [21.0, 20.0]
+        assert janeiro["data_hora"][0] == numpy.datetime64("2024-01-05T00:00")
+
+        # Meses já arquivados não são exportados de novo
+        assert arquivo.exportar_pendentes(db_session.session) == {}
+
+    def test_ler_periodo(self, db_session, sessao_arquivo, tmp_path):
+        pytest.importorskip("numpy")
+        _leituras(db_session, sessao_arquivo, [datetime(2024, 1, 10), datetime(2024, 2, 10), datetime(2024, 3, 10)])
+        arquivo = ArquivoColunar(str(tmp_path))
+        arquivo.exportar_pendentes(db_session.session)
+
+        serie = arquivo.ler(sessao_arquivo.id, datetime(2024, 1, 15), datetime(2024, 3, 10), colunas=("umidade_solo",))
+        assert serie["umidade_solo"].tolist() == [39.0]
+        assert arquivo.ler(sessao_arquivo.id + 1)["temperatura"].size == 0
+
+    def test_retencao_arquiva_antes_de_remover(self, db_session, sessao_arquivo, tmp_path):
+        pytest.importorskip("numpy")
+        agora = datetime(2024, 6, 15)
+        _leituras(db_session, sessao_arquivo, [datetime(2024, 4, 1), datetime(2024, 6, 1)])
+        arquivo = ArquivoColunar(str(tmp_path))
+
+        MotorRetencao(ler_politicas("dado_periodico=10d"), arquivo=arquivo).executar(db_session.session, agora=agora)
+
+        # O mês atual fica no banco até fechar
+        assert [dado.data_hora for dado in DadoPeriodico.query.all()] == [datetime(2024, 6, 1)]
+        assert arquivo.ler(sessao_arquivo.id)["temperatura"].tolist() == [20.0]
+
+
+@pytest.mark.integration
+def test_retencao_mantem_leituras_sem_arquivo(db_session, sessao_arquivo, tmp_path, monkeypatch):
+    monkeypatch.setattr(lib.arquivo, "numpy", None)
+    _leituras(db_session, sessao_arquivo, [datetime.now() - timedelta(days=90)])
+
+    motor = MotorRetencao(ler_politicas("dado_periodico=10d"), arquivo=ArquivoColunar(str(tmp_path)))
+    relatorio = motor.executar(db_session.session)
+
+    assert "numpy" in relatorio["politicas"][0]["erro"]
+    assert DadoPeriodico.query.count() == 1
+
+
+@pytest.mark.integration
+def test_comando_retencao_arquiva_antes_de_remover(runner, db_session, sessao_arquivo, monkeypatch):
+    _leituras(db_session, sessao_arquivo, [datetime.now() - timedelta(days=90)])
+    exportados = []
+
+    def exportar_mes(self, session, sessao_id, mes, substituir=False):
+        exportados.append((sessao_id, DadoPeriodico.query.count()))
+        return 1
+
+    monkeypatch.setattr(ArquivoColunar, "exportar_mes", exportar_mes)
+    resultado = runner.invoke(args=["aplicar-retencao", "--politicas", "dado_periodico=10d"])
+
+    assert resultado.exit_code == 0, resultado.output
+    # O mês é exportado enquanto a leitura ainda está no banco
+    assert exportados == [(sessao_arquivo.id, 1)]
+    assert DadoPeriodico.query.count() == 0
+
+
+@pytest.mark.integration
+def test_retencao_arquiva_um_mes_por_etapa(db_session, sessao_arquivo, tmp_path, monkeypatch):
+    _leituras(db_session, sessao_arquivo, [datetime(2024, 3, 10), datetime(2024, 4, 10)])
+    exportados = []
+    monkeypatch.setattr(
+        ArquivoColunar, "exportar_mes", lambda self, session, sessao_id, mes, substituir=False: exportados.append(mes)
+    )
+    motor = MotorRetencao(ler_politicas("dado_periodico=10d"), tempo_max_s=0, arquivo=ArquivoColunar(str(tmp_path)))
+
+    relatorio = motor.executar(db_session.session, agora=datetime(2024, 6, 15))
+
+    # Com o tempo esgotado, só o mês arquivado sai do banco
+    assert exportados == [datetime(2024, 3, 1)]
+    assert [dado.data_hora for dado in DadoPeriodico.query.all()] == [datetime(2024, 4, 10)]
+    assert not relatorio["politicas"][0]["completa"]
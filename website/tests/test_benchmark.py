@@ -0,0 +1,99 @@
+"""
+Testes para o benchmark de vazão da ingestão MQTT (execuções curtas em SQLite).
+"""
+
+import json
+
+import pytest
+
+from lib.benchmark import GeradorCarga, MedidorLatencia, executar, main, percentil
+
+
+@pytest.mark.unit
+class TestAuxiliaresBenchmark:
+    def test_percentil(self):
+        valores = list(range(1, 101))
+        assert percentil(valores, 0.5) == 50
+        assert percentil(valores, 0.99) == 99
+        assert percentil([], 0.5) is None
+
+    def test_rodada_envia_um_valor_por_sessao_e_sensor_global(self):
+        gerador = GeradorCarga([1, 2, 3])
+        topicos = [topic for topic, _ in gerador.rodada()]
+        assert topicos.count("estufa/temperatura") == 1
+        assert topicos.count("estufa/umidade/ar") == 1
+        assert sorted(t for t in topicos if t.startswith("estufa/umidade/solo/")) == [
+            "estufa/umidade/solo/1",
+            "estufa/umidade/solo/2",
+            "estufa/umidade/solo/3",
+        ]
+
+    def test_lote_acumula_rodadas(self):
+        gerador = GeradorCarga([1, 2], lote=3)
+        assert gerador.rodada() == []
+        assert gerador.rodada() == []
+        mensagens = gerador.rodada()
+        assert [topic for topic, _ in mensagens] == ["estufa/leituras", "estufa/leituras"]
+        assert len(json.loads(mensagens[0][1])["leituras"]) == 3
+
+    def test_quadro_em_partes(self):
+        gerador = GeradorCarga([1], imagem_kb=10, parte_kb=4)
+        assert [topic for topic, _ in gerador.quadro()] == ["estufa/camera/parte"] * 3
+
+    def test_medidor_associa_pelo_payload(self):
+        medidor = MedidorLatencia()
+        medidor.enviada(b"a")
+        medidor.enviada(b"b")
+        medidor.processadas_no_lote([("t", b"a"), ("t", b"b")])
+        resumo = medidor.resumo()
+        assert medidor.processadas == 2
+        assert resumo["amostras"] == 2
+        assert resumo["p50"] >= 0
+
+
+@pytest.mark.integration
+class TestExecucaoBenchmark:
+    @pytest.mark.parametrize("modo", ["direto", "fila"])
+    def test_execucao_curta(self, tmp_path, modo):
+        resultado = executar(
+            modo=modo,
+            sessoes=2,
+            taxa=50,
+            duracao=0.3,
+            imagens_por_s=5,
+            imagem_kb=4,
+            banco=f"sqlite:///{tmp_path / 'benchmark.db'}",
+        )
+
+        mensagens = resultado["mensagens"]
+        assert mensagens["enviadas"] > 0
+        assert mensagens["processadas"] == mensagens["enviadas"]
+        assert resultado["latencia_ms"]["amostras"] == mensagens["processadas"]
+        assert resultado["latencia_ms"]["p99"] >= resultado["latencia_ms"]["p50"]
+        assert resultado["linhas"]["dado_periodico"] > 0
+
+    def test_main_exporta_json(self, tmp_path, capsys):
+        saida = tmp_path / "resultado.json"
+        main(
+            [
+                "--modo",
+                "direto",
+                "--sessoes",
+                "1",
+                "--taxa",
+                "20",
+                "--duracao",
+                "0.2",
+                "--formato",
+                "binario",
+                "--banco",
+                f"sqlite:///{tmp_path / 'benchmark.db'}",
+                "--saida",
+                str(saida),
+            ]
+        )
+
+        resultado = json.loads(saida.read_text(encoding="utf-8"))
+        assert resultado["config"]["formato"] == "binario"
+        assert resultado["vazao_msg_s"] > 0
+        assert "msg/s" in capsys.readouterr().out
@@ -0,0 +1,82 @@
+"""
+Testes para a coalescência de leituras parciais em DadoPeriodico.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from lib.coalescencia import Coalescedor
+
+INICIO = datetime(2025, 1, 1, 12, 0, 0)
+
+
+@pytest.mark.unit
+class TestCoalescedor:
+    def test_mescla_leituras_da_mesma_janela(self):
+        coalescedor = Coalescedor(janela_ms=5000, atraso_ms=1000, janelas_sessao={})
+
+        assert coalescedor.adicionar(1, 10, INICIO, {"temperatura": 22.0}) == []
+        assert coalescedor.adicionar(1, 10, INICIO + timedelta(seconds=1), {"umidade_ar": 60.0}) == []
+        assert coalescedor.adicionar(1, 10, INICIO + timedelta(seconds=2), {"umidade_solo": 40.0}) == []
+
+        linhas = coalescedor.expirar(forcar=True)
+        assert len(linhas) == 1
+        assert linhas[0]["temperatura"] == 22.0
+        assert linhas[0]["umidade_ar"] == 60.0
+        assert linhas[0]["umidade_solo"] == 40.0
+        assert linhas[0]["data_hora"] == INICIO + timedelta(seconds=2)
+
+    def test_leitura_apos_a_janela_fecha_a_anterior(self):
+        coalescedor = Coalescedor(janela_ms=5000, atraso_ms=1000, janelas_sessao={})
+
+        coalescedor.adicionar(1, 10, INICIO, {"temperatura": 22.0})
+        linhas = coalescedor.adicionar(1, 10, INICIO + timedelta(seconds=6), {"temperatura": 23.0})
+
+        assert [linha["temperatura"] for linha in linhas] == [22.0]
+        assert coalescedor.expirar(forcar=True)[0]["temperatura"] == 23.0
+
+    def test_chegada_tardia(self):
+        coalescedor = Coalescedor(janela_ms=5000, atraso_ms=1000, janelas_sessao={})
+        coalescedor.adicionar(1, 10, INICIO, {"temperatura": 22.0})
+
+        # Dentro da tolerância: mescla sem sobrescrever o valor mais novo
+        assert (
+            coalescedor.adicionar(1, 10, INICIO - timedelta(milliseconds=500), {"temperatura": 21.0, "umidade_ar": 61.0}) == []
+        )
+
+        # Fora da tolerância: vira uma linha própria
+        tardias = coalescedor.adicionar(1, 10, INICIO - timedelta(seconds=30), {"umidade_solo": 35.0})
+        assert len(tardias) == 1
+        assert tardias[0]["data_hora"] == INICIO - timedelta(seconds=30)
+        assert coalescedor.status()["atrasadas"] == 1
+
+        linha = coalescedor.expirar(forcar=True)[0]
+        assert linha["temperatura"] == 22.0
+        assert linha["umidade_ar"] == 61.0
+
+    def test_janela_por_sessao(self):
+        coalescedor = Coalescedor(janela_ms=5000, janelas_sessao={2: 0})
+
+        assert coalescedor.adicionar(1, 10, INICIO, {"temperatura": 22.0}) == []
+        assert len(coalescedor.adicionar(2, 10, INICIO, {"temperatura": 22.0})) == 1
+
+        coalescedor.definir_janela(1, 0)
+        assert len(coalescedor.adicionar(1, 10, INICIO + timedelta(seconds=1), {"temperatura": 22.5})) == 1
+
+    def test_intervalo_verificacao(self):
+        assert Coalescedor(janela_ms=5000, janelas_sessao={}).intervalo_verificacao_s() == 1.0
+        assert Coalescedor(janela_ms=0, janelas_sessao={3: 400}).intervalo_verificacao_s() == 0.2
+        # Sem janelas configuradas a verificação continua, para as definidas em execução
+        assert Coalescedor(janela_ms=0, janelas_sessao={}).intervalo_verificacao_s() == 1.0
+
+    def test_expirar_respeita_tempo_maximo_de_retencao(self):
+        coalescedor = Coalescedor(janela_ms=60000, janelas_sessao={})
+        coalescedor.adicionar(1, 10, INICIO, {"temperatura": 22.0})
+
+        assert coalescedor.expirar() == []
+
+        coalescedor.definir_janela(1, 1)
+        time.sleep(0.01)
+        assert len(coalescedor.expirar()) == 1
@@ -0,0 +1,161 @@
+"""
+Testes para o rastreamento de comandos enviados aos dispositivos.
+"""
+
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from lib.comandos import RastreadorComandos
+from lib.models import ComandoDispositivo, Grupo, Usuario
+
+
+@pytest.mark.unit
+class TestRastreadorComandos:
+    def test_confirma_pelo_comando_id(self):
+        rastreador = RastreadorComandos()
+        rastreador.registrar("a", "ventilacao", "estufa/ventilacao/manual", {}, 2)
+        rastreador.registrar("b", "ventilacao", "estufa/ventilacao/manual", {}, 2)
+
+        comando_id, latencia = rastreador.confirmar("ventilacao", {"status": "LIGADO", "comando_id": "b"})
+
+        assert comando_id == "b"
+        assert latencia >= 0
+        assert rastreador.pendente("a") is not None
+        assert rastreador.status()["confirmados"] == 1
+
+    def test_sem_comando_id_confirma_o_mais_antigo_do_tipo(self):
+        rastreador = RastreadorComandos()
+        rastreador.registrar("a", "irrigacao", "t", {}, 2, sessao_id=1)
+        rastreador.registrar("b", "irrigacao", "t", {}, 2, sessao_id=2)
+        rastreador.registrar("c", "iluminacao", "t", {}, 1)
+
+        assert rastreador.confirmar("irrigacao", {"status": "ABERTO", "sessao_id": 2})[0] == "b"
+        assert rastreador.confirmar("iluminacao", {"status": "LIGADO"})[0] == "c"
+        assert rastreador.confirmar("ventilacao", {"status": "LIGADO"}) is None
+
+    def test_comando_desconhecido_devolve_id_sem_latencia(self):
+        assert RastreadorComandos().confirmar("ventilacao", {"comando_id": "x"}) == ("x", None)
+
+    def test_reenvia_e_depois_expira(self):
+        rastreador = RastreadorComandos(timeout_s=0, tentativas=2)
+        rastreador.registrar("a", "ventilacao", "t", {}, 2)
+
+        reenviar, expirados = rastreador.vencidos()
+        assert [p.comando_id for p in reenviar] == ["a"]
+        assert reenviar[0].tentativas == 2
+        assert expirados == []
+
+        reenviar, expirados = rastreador.vencidos()
+        assert reenviar == []
+        assert [p.comando_id for p in expirados] == ["a"]
+        assert rastreador.pendente("a") is None
+
+    def test_descartar_nao_conta_como_expirado(self):
+        rastreador = RastreadorComandos()
+        rastreador.registrar("a", "ventilacao", "t", {}, 2)
+
+        assert rastreador.descartar("a").comando_id == "a"
+        assert rastreador.descartar("a") is None
+        assert rastreador.status()["pendentes"] == rastreador.status()["expirados"] == 0
+
+
+@pytest.fixture
+def gerente(client, db_session):
+    grupo = Grupo(nome="Gerente", nivel_acesso=4)
+    db_session.session.add(grupo)
+    db_session.session.commit()
+    usuario = Usuario(nome="Gerente", email="gerente@teste.com", senha="x", grupo_id=grupo.id)
+    db_session.session.add(usuario)
+    db_session.session.commit()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(usuario.id)
+        sess["_fresh"] = True
+    return usuario
+
+
+@pytest.fixture
+def mqtt_conectado():
+    from app import mqtt_client
+
+    paho = MagicMock()
+    paho.publish.return_value.rc = 0
+    with patch.object(mqtt_client, "mqtt_client", paho), patch.object(mqtt_client, "connected", True):
+        yield mqtt_client
+    mqtt_client.comandos = RastreadorComandos()
+
+
+@pytest.mark.integration
+class TestComandosRotas:
+    def test_envio_retorna_id_e_confirmacao_pelo_status(self, client, gerente, mqtt_conectado):
+        response = client.post(
+            "/admin/mqtt/command",
+            data=json.dumps({"device_type": "ventilacao", "command": "ON"}),
+            content_type="application/json",
+        )
+        assert response.status_code == 202
+        resultado = json.loads(response.data)
+        comando_id = resultado["comando_id"]
+        mqtt_conectado.mqtt_client.publish.return_value.wait_for_publish.assert_not_called()
+
+        estado = json.loads(client.get(resultado["status_url"]).data)
+        assert estado["estado"] == "PENDENTE"
+        assert estado["executado"] is False
+
+        payload = json.dumps({"status": "LIGADO", "comando_id": comando_id}).encode()
+        mqtt_conectado.processar_lote([("estufa/ventilacao/status", payload)])
+
+        estado = json.loads(client.get(f"/admin/mqtt/command/{comando_id}").data)
+        assert estado["estado"] == "CONFIRMADO"
+        assert estado["executado"] is True
+        assert estado["latencia_ms"] is not None
+
+    def test_falha_na_publicacao_marca_comando(self, client, gerente, mqtt_conectado):
+        mqtt_conectado.mqtt_client.publish.return_value.rc = 4
+
+        response = client.post(
+            "/admin/mqtt/command",
+            data=json.dumps({"device_type": "iluminacao", "command": "ON"}),
+            content_type="application/json",
+        )
+
+        assert response.status_code == 500
+        assert ComandoDispositivo.query.one().estado == "FALHOU"
+        assert mqtt_conectado.comandos.status()["pendentes"] == 0
+
+    def test_status_antes_do_fim_da_publicacao(self, mqtt_conectado):
+        def publicar(topic, payload, qos):
+            # O dispositivo responde enquanto publish() ainda não retornou
+            comando_id = json.loads(payload)["comando_id"]
+            assert (
+                mqtt_conectado.comandos.confirmar("ventilacao", {"status": "LIGADO", "comando_id": comando_id})[1] is not None
+            )
+            return MagicMock(rc=0)
+
+        mqtt_conectado.mqtt_client.publish.side_effect = publicar
+
+        assert mqtt_conectado.enviar_comando_ventilacao("ON") is not None
+        assert mqtt_conectado.comandos.status()["confirmados"] == 1
+        assert mqtt_conectado.comandos.status()["pendentes"] == 0
+
+    def test_comando_inexistente(self, client, gerente):
+        assert client.get("/admin/mqtt/command/nao-existe").status_code == 404
+
+    def test_verificar_comandos_reenvia_e_expira(self, client, gerente, mqtt_conectado, db_session):
+        mqtt_conectado.comandos = RastreadorComandos(timeout_s=0, tentativas=2)
+        response = client.post(
+            "/admin/mqtt/command",
+            data=json.dumps({"device_type": "ventilacao", "command": "OFF"}),
+            content_type="application/json",
+        )
+        comando_id = json.loads(response.data)["comando_id"]
+
+        mqtt_conectado.verificar_comandos()
+        assert mqtt_conectado.mqtt_client.publish.call_count == 2
+        db_session.session.expire_all()
+        assert ComandoDispositivo.query.filter_by(uuid=comando_id).one().tentativas == 2
+
+        mqtt_conectado.verificar_comandos()
+        db_session.session.expire_all()
+        assert ComandoDispositivo.query.filter_by(uuid=comando_id).one().estado == "EXPIRADO"
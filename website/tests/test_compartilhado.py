@@ -0,0 +1,162 @@
+"""
+Testes para a ingestão com assinaturas compartilhadas entre workers.
+"""
+
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from lib.models import Cultura, Sessao
+from lib.topicos import MQTT_TOPICS, Particionamento, particao
+
+MQTT_TESTE_BROKER = os.getenv("MQTT_TESTE_BROKER")
+
+
+def canteiros_por_worker(total, quantidade=20):
+    return {indice: [c for c in range(1, quantidade + 1) if particao(c, total) == indice] for indice in range(total)}
+
+
+@pytest.mark.unit
+class TestParticionamento:
+    def test_sem_grupo_assina_todos_os_topicos(self):
+        assert Particionamento().assinaturas() == list(MQTT_TOPICS.values())
+
+    def test_assinaturas_do_grupo(self):
+        filtros = [Particionamento("siia", indice, 2).assinaturas() for indice in range(2)]
+
+        for assinaturas in filtros:
+            assert "$share/siia/estufa/alerta" in assinaturas
+            assert "estufa/umidade/solo/#" in assinaturas
+            assert "estufa/temperatura" in assinaturas
+            assert MQTT_TOPICS["irrigacao_manual"] not in assinaturas
+
+        # Cada tópico de status tem exatamente um dono
+        for topico in ("estufa/irrigacao/status", "estufa/ventilacao/status", "estufa/iluminacao/status"):
+            assert sum(topico in assinaturas for assinaturas in filtros) == 1
+
+    def test_cada_sessao_pertence_a_um_worker(self):
+        workers = [Particionamento("siia", indice, 3) for indice in range(3)]
+        for sessao_id in range(1, 50):
+            assert sum(worker.possui(sessao_id) for worker in workers) == 1
+
+    def test_indice_invalido(self):
+        with pytest.raises(ValueError):
+            Particionamento("siia", 2, 2)
+
+
+@pytest.fixture
+def worker_compartilhado(app):
+    with patch("paho.mqtt.client.Client") as cliente:
+        from lib.mqtt_new import MQTTClient
+
+        client = MQTTClient(particionamento=Particionamento("siia", 0, 2))
+        client.app = app
+        client.cliente_paho = cliente
+        yield client
+
+
+@pytest.mark.integration
+class TestWorkerCompartilhado:
+    def test_usa_mqttv5(self, worker_compartilhado):
+        import paho.mqtt.client as mqtt
+
+        assert worker_compartilhado.cliente_paho.call_args.kwargs["protocol"] == mqtt.MQTTv5
+
+    def test_descarta_canteiros_de_outra_particao(self, worker_compartilhado):
+        proprios, alheios = canteiros_por_worker(2)[0], canteiros_por_worker(2)[1]
+
+        assert worker_compartilhado.pertence(f"estufa/umidade/solo/{proprios[0]}")
+        assert not worker_compartilhado.pertence(f"estufa/umidade/solo/{alheios[0]}")
+        assert worker_compartilhado.pertence("estufa/temperatura")
+
+    def test_registro_contem_apenas_sessoes_da_particao(self, worker_compartilhado, db_session):
+        cultura = Cultura(nome="Alface")
+        db_session.session.add(cultura)
+        db_session.session.commit()
+        for i in range(6):
+            db_session.session.add(Sessao(nome=f"Canteiro {i}", cultura_id=cultura.id))
+        db_session.session.commit()
+
+        ids = [sessao.id for sessao in worker_compartilhado.sessoes.ativas()]
+        assert ids
+        assert all(particao(sessao_id, 2) == 0 for sessao_id in ids)
+
+
+@pytest.mark.integration
+@pytest.mark.skipif(not MQTT_TESTE_BROKER, reason="Defina MQTT_TESTE_BROKER=host:porta para testar com um broker local")
+class TestAssinaturaCompartilhadaBroker:
+    def test_workers_dividem_o_trafego(self, app, monkeypatch):
+        import paho.mqtt.client as mqtt
+
+        import lib.mqtt_new as mqtt_new
+
+        host, _, porta = MQTT_TESTE_BROKER.partition(":")
+        monkeypatch.setattr(mqtt_new, "MQTT_BROKER", host)
+        monkeypatch.setattr(mqtt_new, "MQTT_PORT", int(porta or 1883))
+        monkeypatch.setattr(mqtt_new, "MQTT_TLS", False)
+        monkeypatch.setattr(mqtt_new, "MQTT_USERNAME", None)
+
+        grupo = f"siia-teste-{os.getpid()}"
+        recebidas = {0: [], 1: []}
+        lock = threading.Lock()
+
+        def registrar(indice):
+            def enfileirar(topic, payload):
+                with lock:
+                    recebidas[indice].append((topic, payload))
+                return True
+
+            return enfileirar
+
+        workers = []
+        for indice in range(2):
+            worker = mqtt_new.MQTTClient(particionamento=Particionamento(grupo, indice, 2))
+            worker.app = app
+            worker.ingestao.enfileirar = registrar(indice)
+            worker.connect_broker()
+            workers.append(worker)
+
+        publicador = mqtt.Client(protocol=mqtt.MQTTv5)
+        try:
+            limite = time.monotonic() + 10
+            while not all(worker.connected for worker in workers) and time.monotonic() < limite:
+                time.sleep(0.05)
+            assert all(worker.connected for worker in workers)
+            time.sleep(0.5)
+
+            publicador.connect(host, int(porta or 1883))
+            publicador.loop_start()
+            for i in range(20):
+                publicador.publish("estufa/alerta", f'{{"mensagem": "{i}"}}', qos=1).wait_for_publish()
+            for canteiro in range(1, 11):
+                for leitura in range(3):
+                    publicador.publish(
+                        f"estufa/umidade/solo/{canteiro}", f'{{"umidade": {leitura}}}', qos=1
+                    ).wait_for_publish()
+
+            esperadas = 20 + 10 * 3
+            limite = time.monotonic() + 10
+            while sum(map(len, recebidas.values())) < esperadas and time.monotonic() < limite:
+                time.sleep(0.05)
+        finally:
+            publicador.loop_stop()
+            publicador.disconnect()
+            for worker in workers:
+                worker.parar()
+
+        # Alertas entregues uma única vez ao grupo
+        alertas = [payload for lote in recebidas.values() for topic, payload in lote if topic == "estufa/alerta"]
+        assert len(alertas) == 20
+
+        # Cada canteiro processado por um único worker, na ordem de publicação
+        for indice, lote in recebidas.items():
+            por_canteiro = {}
+            for topic, payload in lote:
+                if topic.startswith("estufa/umidade/solo/"):
+                    por_canteiro.setdefault(int(topic.rsplit("/", 1)[1]), []).append(payload)
+            for canteiro, payloads in por_canteiro.items():
+                assert particao(canteiro, 2) == indice
+                assert payloads == [f'{{"umidade": {leitura}}}'.encode() for leitura in range(3)]
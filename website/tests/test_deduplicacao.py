@@ -0,0 +1,128 @@
+"""
+Testes para a supressão de reentregas QoS 1 pela identidade das mensagens.
+"""
+
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+
+from lib.deduplicacao import FiltroDuplicatas, identidade
+from lib.models import Cultura, DadoPeriodico, MensagemRecebida, Notificacao, Sessao, StatusDispositivo
+
+
+@pytest.mark.unit
+class TestFiltroDuplicatas:
+    def test_identidade_do_payload(self):
+        assert identidade("estufa/alerta", {"msg_id": "a1"}) == ("estufa/alerta", "a1")
+        assert identidade("estufa/alerta", {"seq": 7, "dispositivo": "esp32-1"}) == ("esp32-1", "7")
+        assert identidade("estufa/alerta", {"seq": 7, "boot": 3}) == ("estufa/alerta", "3:7")
+        assert identidade("estufa/alerta", {"mensagem": "sem id"}) is None
+        assert identidade("estufa/leituras", [{"temperatura": 20}]) is None
+
+    def test_janela_deslizante_por_dispositivo(self):
+        filtro = FiltroDuplicatas(janela=2)
+
+        assert filtro.registrar(("a", "1"))
+        assert filtro.registrar(("b", "1"))
+        assert not filtro.registrar(("a", "1"))
+        assert filtro.registrar(("a", "2"))
+        assert filtro.registrar(("a", "3"))
+        # "1" saiu da janela de "a"
+        assert filtro.registrar(("a", "1"))
+        assert filtro.status()["duplicadas"] == 1
+
+    def test_dispositivos_em_lru(self):
+        filtro = FiltroDuplicatas(max_dispositivos=2)
+        filtro.registrar(("a", "1"))
+        filtro.registrar(("b", "1"))
+        filtro.registrar(("a", "2"))
+        filtro.registrar(("c", "1"))
+
+        assert filtro.status()["dispositivos"] == 2
+        assert not filtro.registrar(("a", "1"))
+        assert filtro.registrar(("b", "1"))
+
+    def test_esquecer(self):
+        filtro = FiltroDuplicatas()
+        filtro.registrar(("a", "1"))
+        filtro.esquecer([("a", "1")])
+
+        assert filtro.registrar(("a", "1"))
+
+
+@pytest.fixture
+def sessao_dedup(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+@pytest.mark.integration
+class TestDeduplicacaoNaIngestao:
+    def test_reentrega_no_mesmo_lote_e_em_outro(self, cliente_mqtt, db_session):
+        mensagem = ("estufa/ventilacao/status", b'{"status": "LIGADO", "msg_id": "m-1"}')
+
+        cliente_mqtt.processar_lote([mensagem, mensagem])
+        cliente_mqtt.processar_lote([mensagem, ("estufa/ventilacao/status", b'{"status": "LIGADO"}')])
+
+        assert StatusDispositivo.query.count() == 2
+        assert MensagemRecebida.query.count() == 1
+        assert cliente_mqtt.status()["duplicatas"]["duplicadas"] == 2
+
+    def test_guarda_do_banco_apos_reiniciar(self, cliente_mqtt, db_session):
+        mensagem = ("estufa/alerta", b'{"mensagem": "Porta aberta", "dispositivo": "porta", "seq": 41}')
+        cliente_mqtt.processar_lote([mensagem])
+
+        # Janela em memória perdida, como após reiniciar sem aquecer
+        cliente_mqtt.duplicatas.esquecer([("porta", "41")])
+        with patch.object(MensagemRecebida, "query") as query:
+            cliente_mqtt.processar_lote([mensagem])
+            query.filter.assert_not_called()
+
+        assert Notificacao.query.count() == 1
+        assert cliente_mqtt.duplicatas.status()["duplicadas_banco"] == 1
+
+    def test_aquecer_carrega_identidades_recentes(self, cliente_mqtt, db_session):
+        db_session.session.add_all(
+            [
+                MensagemRecebida(dispositivo="porta", mensagem="1", recebida_em=datetime.now()),
+                MensagemRecebida(dispositivo="porta", mensagem="0", recebida_em=datetime.now() - timedelta(days=2)),
+                MensagemRecebida(particao=1, dispositivo="porta", mensagem="2", recebida_em=datetime.now()),
+            ]
+        )
+        db_session.session.commit()
+
+        cliente_mqtt.aquecer_cache()
+
+        assert not cliente_mqtt.duplicatas.registrar(("porta", "1"))
+        assert cliente_mqtt.duplicatas.registrar(("porta", "0"))
+        assert cliente_mqtt.duplicatas.registrar(("porta", "2"))
+
+    def test_lote_com_erro_aceita_reentrega(self, cliente_mqtt, db_session, sessao_dedup):
+        mensagem = ("estufa/temperatura", b'{"temperatura": 21.0, "msg_id": "t-1"}')
+
+        with patch.object(cliente_mqtt, "_gravar_janelas", side_effect=RuntimeError("banco indisponível")):
+            with pytest.raises(RuntimeError):
+                cliente_mqtt.processar_lote([mensagem])
+        cliente_mqtt.processar_lote([mensagem], descarregar_janelas=True)
+
+        assert MensagemRecebida.query.count() == 1
+        assert DadoPeriodico.query.filter_by(sessao_id=sessao_dedup.id, temperatura=21.0).count() == 1
+
+    def test_limpeza_remove_identidades_antigas(self, cliente_mqtt, db_session):
+        db_session.session.add_all(
+            [
+                MensagemRecebida(dispositivo="porta", mensagem="1", recebida_em=datetime.now()),
+                MensagemRecebida(dispositivo="porta", mensagem="0", recebida_em=datetime.now() - timedelta(days=2)),
+            ]
+        )
+        db_session.session.commit()
+
+        cliente_mqtt.limpar_duplicatas()
+
+        assert [m.mensagem for m in MensagemRecebida.query.all()] == ["1"]
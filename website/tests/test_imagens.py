@@ -0,0 +1,310 @@
+"""
+Testes para o armazenamento de imagens em disco e a remontagem de quadros em partes.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from lib import miniaturas
+from lib.imagens import ArmazemImagens, MontadorQuadros
+from lib.miniaturas import GeradorMiniaturas
+from lib.models import Cultura, DadoPeriodico, Sessao
+from lib.payload import codificar_partes, decodificar
+
+
+@pytest.mark.unit
+class TestArmazemImagens:
+    def test_conteudo_repetido_gravado_uma_vez(self, tmp_path):
+        armazem = ArmazemImagens(str(tmp_path))
+
+        sha256 = armazem.salvar(b"quadro")
+        assert armazem.salvar(b"quadro") == sha256
+
+        assert sha256 == hashlib.sha256(b"quadro").hexdigest()
+        assert os.listdir(tmp_path / sha256[:2]) == [sha256]
+        assert armazem.ler(sha256) == b"quadro"
+        assert (armazem.gravadas, armazem.reaproveitadas) == (1, 1)
+
+    def test_referencia_invalida_nao_sai_do_diretorio(self, tmp_path):
+        armazem = ArmazemImagens(str(tmp_path))
+
+        assert armazem.ler("../" * 10 + "etc/passwd") is None
+        assert armazem.ler("0" * 64) is None
+
+    def test_versao_redimensionada_com_retorno_ao_original(self, tmp_path):
+        armazem = ArmazemImagens(str(tmp_path))
+        sha256 = armazem.salvar(b"original")
+
+        assert armazem.ler(sha256, "miniatura") == b"original"
+        armazem.salvar_derivado(sha256, "miniatura", b"pequena")
+        assert os.path.exists(os.path.join(tmp_path, sha256[:2], f"{sha256}_miniatura"))
+        assert armazem.ler(sha256, "miniatura") == b"pequena"
+        assert armazem.ler(sha256) == b"original"
+        with pytest.raises(ValueError):
+            armazem.caminho_derivado(sha256, "../x")
+
+
+@pytest.mark.unit
+class TestGeradorMiniaturas:
+    @pytest.mark.skipif(miniaturas.cv2 is not None, reason="OpenCV instalado")
+    def test_sem_opencv_nao_agenda(self, tmp_path):
+        gerador = GeradorMiniaturas(ArmazemImagens(str(tmp_path)))
+
+        assert not gerador.disponivel
+        assert gerador.enfileirar("0" * 64) is None
+
+    def test_gera_versoes_em_pool(self, tmp_path):
+        cv2 = pytest.importorskip("cv2")
+        numpy = pytest.importorskip("numpy")
+        armazem = ArmazemImagens(str(tmp_path))
+        _, png = cv2.imencode(".png", numpy.full((480, 1280, 3), 127, dtype=numpy.uint8))
+        sha256 = armazem.salvar(png.tobytes())
+        gerador = GeradorMiniaturas(armazem, tamanhos={"miniatura": 160, "media": 640}, formato="jpeg")
+
+        assert gerador.enfileirar(sha256).result(timeout=10) == 2
+        gerador.parar()
+
+        miniatura = cv2.imdecode(numpy.frombuffer(armazem.ler(sha256, "miniatura"), numpy.uint8), cv2.IMREAD_COLOR)
+        assert miniatura.shape[:2] == (60, 160)
+        assert gerador.gerar(sha256) == 0
+        assert gerador.status()["geradas"] == 2
+
+
+@pytest.mark.unit
+class TestMontadorQuadros:
+    def test_partes_fora_de_ordem_e_repetidas(self):
+        montador = MontadorQuadros()
+        imagem = bytes(range(256)) * 4
+        partes = [imagem[i : i + 300] for i in range(0, len(imagem), 300)]
+        sha256 = hashlib.sha256(imagem).hexdigest()
+
+        assert montador.adicionar("q", 3, 4, partes[3], sha256=sha256) is None
+        assert montador.adicionar("q", 0, 4, partes[0], crc32=zlib.crc32(partes[0])) is None
+        assert montador.adicionar("q", 0, 4, partes[0]) is None
+        assert montador.adicionar("q", 2, 4, partes[2]) is None
+        assert montador.adicionar("q", 1, 4, partes[1], timestamp=10) == (imagem, 10)
+        assert montador.status()["pendentes"] == 0
+
+    def test_checksum_invalido(self):
+        montador = MontadorQuadros()
+
+        with pytest.raises(ValueError):
+            montador.adicionar("q", 0, 2, b"abc", crc32=zlib.crc32(b"abd"))
+        montador.adicionar("q", 0, 2, b"abc")
+        with pytest.raises(ValueError):
+            montador.adicionar("q", 1, 2, b"def", sha256="0" * 64)
+        assert montador.status()["corrompidos"] == 2
+
+    def test_quadros_incompletos_expiram(self):
+        montador = MontadorQuadros(timeout_s=0, max_pendentes=2)
+        for quadro in range(3):
+            montador.adicionar(quadro, 0, 2, b"x")
+
+        assert montador.expirar() == 2
+        assert montador.status()["expirados"] == 3
+
+
+@pytest.fixture
+def sessao_imagem(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+@pytest.mark.integration
+class TestQuadrosNaIngestao:
+    def test_quadro_binario_remontado_e_referenciado(self, cliente_mqtt, db_session, sessao_imagem):
+        imagem = os.urandom(10000)
+        partes = codificar_partes(imagem, quadro=7, tamanho_parte=4096, timestamp=1700000000)
+        assert decodificar(partes[0])[1]["total"] == 3
+
+        cliente_mqtt.processar_lote([("estufa/camera/parte", parte) for parte in reversed(partes)], descarregar_janelas=True)
+
+        dado = DadoPeriodico.query.one()
+        assert dado.imagem is None
+        assert dado.imagem_sha256 == hashlib.sha256(imagem).hexdigest()
+        assert cliente_mqtt.imagens.imagem_de(dado) == imagem
+        assert cliente_mqtt.status()["imagens"]["quadros"]["completos"] == 1
+
+    def test_partes_json_com_sha256(self, cliente_mqtt, db_session, sessao_imagem):
+        imagem = b"\xff\xd8" + bytes(500)
+        mensagens = [
+            (
+                "estufa/camera/parte",
+                json.dumps(
+                    {
+                        "camera": "cam-1",
+                        "quadro": "abc",
+                        "parte": indice,
+                        "total": 2,
+                        "dados": base64.b64encode(imagem[indice * 251 : (indice + 1) * 251]).decode(),
+                        "sha256": hashlib.sha256(imagem).hexdigest(),
+                    }
+                ).encode(),
+            )
+            for indice in range(2)
+        ]
+
+        cliente_mqtt.processar_lote(mensagens, descarregar_janelas=True)
+
+        assert cliente_mqtt.imagens.imagem_de(DadoPeriodico.query.one()) == imagem
+
+    def test_parte_corrompida_nao_grava(self, cliente_mqtt, db_session, sessao_imagem):
+        partes = codificar_partes(b"imagem" * 100, quadro=1, tamanho_parte=400)
+        corrompida = partes[1][:-1] + b"?"
+
+        cliente_mqtt.processar_lote([("estufa/camera/parte", partes[0]), ("estufa/camera/parte", corrompida)])
+        cliente_mqtt.descarregar_janelas(forcar=True)
+
+        assert DadoPeriodico.query.count() == 0
+        assert cliente_mqtt.atividade.topicos()["estufa/camera/parte"]["erro_ultimo"].startswith("Checksum inválido")
+
+
+@pytest.mark.integration
+class TestColunaAntigaDeImagem:
+    def _dado(self, db_session, sessao, imagem):
+        dado = DadoPeriodico(
+            temperatura=20.0,
+            umidade_ar=60.0,
+            umidade_solo=40.0,
+            imagem=imagem,
+            cultura_id=sessao.cultura_id,
+            sessao_id=sessao.id,
+            exaustor_ligado=False,
+        )
+        db_session.session.add(dado)
+        db_session.session.commit()
+        return dado.id
+
+    def test_imagem_carregada_apenas_quando_acessada(self, db_session, sessao_imagem):
+        dado_id = self._dado(db_session, sessao_imagem, b"jpeg antigo")
+        db_session.session.expunge_all()
+
+        dado = DadoPeriodico.query.get(dado_id)
+        assert "imagem" not in dado.__dict__
+        assert dado.imagem == b"jpeg antigo"
+
+    def test_migrar_coluna_para_o_disco(self, db_session, sessao_imagem, tmp_path):
+        armazem = ArmazemImagens(str(tmp_path / "imagens"))
+        for _ in range(3):
+            self._dado(db_session, sessao_imagem, b"mesma imagem")
+        self._dado(db_session, sessao_imagem, None)
+
+        assert armazem.migrar_coluna(db_session.session, lote=2) == 3
+        assert armazem.migrar_coluna(db_session.session) == 0
+
+        dados = DadoPeriodico.query.filter(DadoPeriodico.imagem_sha256.isnot(None)).all()
+        assert len(dados) == 3
+        assert all(dado.imagem is None and armazem.imagem_de(dado) == b"mesma imagem" for dado in dados)
+        assert armazem.status()["gravadas"] == 1
+
+
+@pytest.mark.integration
+class TestEndpointsDeImagem:
+    @pytest.fixture
+    def armazem(self, tmp_path, monkeypatch):
+        import app as aplicacao
+
+        armazem = ArmazemImagens(str(tmp_path / "imagens"))
+        monkeypatch.setattr(aplicacao, "armazem_imagens", armazem)
+        return armazem
+
+    @pytest.fixture
+    def token(self, db_session, usuario_visualizador):
+        from lib.models import SessaoUsuario
+
+        db_session.session.add(
+            SessaoUsuario(
+                token="tok_imagens", usuario_id=usuario_visualizador.id, data_expiracao=datetime.now() + timedelta(days=1)
+            )
+        )
+        db_session.session.commit()
+        return "tok_imagens"
+
+    def _dado(self, db_session, sessao, **campos):
+        db_session.session.add(
+            DadoPeriodico(
+                temperatura=20.0,
+                umidade_ar=60.0,
+                umidade_solo=40.0,
+                cultura_id=sessao.cultura_id,
+                sessao_id=sessao.id,
+                exaustor_ligado=False,
+                **campos,
+            )
+        )
+        db_session.session.commit()
+
+    def test_imagem_da_sessao_com_etag(self, client, db_session, sessao_imagem, armazem):
+        png = b"\x89PNG\r\n\x1a\n" + bytes(100)
+        sha256 = armazem.salvar(png)
+        self._dado(db_session, sessao_imagem, imagem_sha256=sha256)
+        url = f"/api/sessoes/{sessao_imagem.id}/imagem"
+
+        res = client.get(url)
+        assert res.status_code == 200
+        assert res.data == png
+        assert res.mimetype == "image/png"
+        assert res.headers["ETag"] == f'"{sha256}"'
+        assert "no-cache" in res.headers["Cache-Control"]
+
+        assert client.get(url, headers={"If-None-Match": res.headers["ETag"]}).status_code == 304
+
+        # A miniatura tem ETag próprio; sem ela, o original é servido
+        assert client.get(f"{url}?tamanho=miniatura").data == png
+        armazem.salvar_derivado(sha256, "miniatura", b"pequena")
+        miniatura = client.get(f"{url}?tamanho=miniatura", headers={"If-None-Match": res.headers["ETag"]})
+        assert miniatura.status_code == 200
+        assert miniatura.data == b"pequena"
+
+    def test_imagem_da_coluna_antiga_e_sessao_sem_imagem(self, client, db_session, sessao_imagem, armazem):
+        url = f"/api/sessoes/{sessao_imagem.id}/imagem"
+        assert client.get(url).status_code == 404
+
+        self._dado(db_session, sessao_imagem, imagem=b"\xff\xd8\xff antigo")
+        res = client.get(url)
+        assert res.mimetype == "image/jpeg"
+        assert client.get(url, headers={"If-None-Match": res.headers["ETag"]}).status_code == 304
+
+    def test_dashboard_movel_envia_urls(self, client, db_session, sessao_imagem, armazem, token):
+        sha256 = armazem.salvar(b"original")
+        armazem.salvar_derivado(sha256, "miniatura", b"pequena")
+        self._dado(db_session, sessao_imagem, imagem_sha256=sha256)
+        cabecalho = {"Authorization": f"Bearer {token}"}
+
+        padrao = client.get("/api/mobile/dashboard", headers=cabecalho).get_json()["data"][0]
+        original = client.get("/api/mobile/dashboard?tamanho_imagem=original", headers=cabecalho).get_json()["data"][0]
+
+        assert "imagem_base64" not in padrao
+        assert client.get(padrao["imagem_url"]).data == b"pequena"
+        assert client.get(original["imagem_url"]).data == b"original"
+
+    def test_foto_do_usuario(self, client, db_session, usuario_visualizador, token):
+        from lib.models import Usuario
+
+        usuario = Usuario.query.get(usuario_visualizador.id)
+        usuario.foto = b"\xff\xd8\xff foto"
+        db_session.session.commit()
+        assert usuario.foto_sha256 == hashlib.sha256(b"\xff\xd8\xff foto").hexdigest()
+        url = f"/api/usuarios/{usuario.id}/foto"
+
+        assert client.get(url).status_code == 401
+        cabecalho = {"Authorization": f"Bearer {token}"}
+        res = client.get(url, headers=cabecalho)
+        assert res.data == b"\xff\xd8\xff foto"
+        assert "private" in res.headers["Cache-Control"]
+        assert client.get(url, headers=dict(cabecalho, **{"If-None-Match": res.headers["ETag"]})).status_code == 304
+
+        perfil = client.get("/api/mobile/perfil", headers=cabecalho).get_json()["usuario"]
+        versionada = client.get(perfil["foto_url"], headers=cabecalho)
+        assert "immutable" in versionada.headers["Cache-Control"]
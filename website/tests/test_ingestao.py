@@ -0,0 +1,419 @@
+"""
+Testes para a fila de ingestão em lote do cliente MQTT.
+"""
+
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from lib.ingestao import PRIORIDADE_ALTA, PRIORIDADE_IMAGENS, PRIORIDADE_SENSORES, FilaIngestao, LoteEscrita
+from lib.models import Cultura, DadoPeriodico, Notificacao, Sessao, StatusDispositivo, StatusMQTT
+from lib.payload import codificar_partes
+
+
+@pytest.fixture
+def sessao_ingestao(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+@pytest.mark.unit
+class TestLoteEscrita:
+    def test_descarregar_insere_todas_as_linhas(self, db_session):
+        lote = LoteEscrita()
+        lote.adicionar(StatusDispositivo, tipo_dispositivo="ventilacao", status="LIGADO")
+        lote.adicionar(StatusDispositivo, tipo_dispositivo="iluminacao", status="DESLIGADO")
+        lote.adicionar(Notificacao, titulo="Alerta", mensagem="Teste")
+        assert len(lote) == 3
+
+        assert lote.descarregar(db_session.session) == 3
+        db_session.session.commit()
+
+        assert len(lote) == 0
+        assert StatusDispositivo.query.count() == 2
+        assert Notificacao.query.count() == 1
+
+
+@pytest.mark.unit
+class TestFilaIngestao:
+    def test_descarrega_ao_atingir_n_mensagens(self):
+        lotes = []
+        evento = threading.Event()
+
+        def processar(lote):
+            lotes.append(list(lote))
+            evento.set()
+
+        fila = FilaIngestao(processar, lote_mensagens=3, lote_ms=60000)
+        fila.iniciar()
+        for i in range(3):
+            assert fila.enfileirar("estufa/temperatura", str(i))
+        assert evento.wait(2)
+        fila.parar()
+
+        assert len(lotes[0]) == 3
+        assert fila.status()["processadas"] == 3
+
+    def test_parar_drena_a_fila(self):
+        processadas = []
+        fila = FilaIngestao(processadas.extend, lote_mensagens=100, lote_ms=60000)
+        fila.iniciar()
+        for i in range(10):
+            fila.enfileirar("estufa/alerta", str(i))
+        fila.parar()
+
+        assert len(processadas) == 10
+        assert not fila.ativa
+
+    def test_tarefas_agendadas_rodam_no_worker(self):
+        chamadas = []
+        evento = threading.Event()
+
+        def tarefa(forcar=False):
+            chamadas.append(forcar)
+            evento.set()
+
+        fila = FilaIngestao(lambda lote: None)
+        fila.agendar(0.01, tarefa)
+        fila.iniciar()
+        assert evento.wait(2)
+        fila.parar()
+
+        assert chamadas[0] is False
+        assert chamadas[-1] is True
+
+    def test_tarefa_com_trabalho_pendente_roda_de_novo(self):
+        chamadas = []
+        evento = threading.Event()
+
+        def tarefa(forcar=False):
+            chamadas.append(forcar)
+            if len(chamadas) == 3:
+                evento.set()
+            # Trabalho pendente nas duas primeiras chamadas
+            return len(chamadas) < 3
+
+        fila = FilaIngestao(lambda lote: None)
+        fila.agendar(3600, tarefa)
+        fila._tarefas[0][1] = 0
+        fila.iniciar()
+        # As chamadas seguintes não esperam o intervalo de uma hora
+        assert evento.wait(2)
+        fila.parar()
+
+        assert chamadas == [False, False, False, True]
+
+    def test_fila_cheia_descarta(self):
+        fila = FilaIngestao(lambda lote: None, max_fila=2)
+        assert fila.enfileirar("t", "1")
+        assert fila.enfileirar("t", "2")
+        assert not fila.enfileirar("t", "3")
+
+        status = fila.status()
+        assert status["profundidade"] == 2
+        assert status["descartadas"] == 1
+
+
+def classificar(topic):
+    return {
+        "estufa/alerta": PRIORIDADE_ALTA,
+        "estufa/camera/imagem": PRIORIDADE_IMAGENS,
+        "estufa/camera/parte": PRIORIDADE_IMAGENS,
+    }.get(topic, PRIORIDADE_SENSORES)
+
+
+def quadro(topic, payload):
+    return payload.partition(":")[0] if topic == "estufa/camera/parte" else None
+
+
+@pytest.mark.unit
+class TestPrioridadeIngestao:
+    def test_classes_mais_urgentes_primeiro(self):
+        processadas = []
+        fila = FilaIngestao(processadas.extend, lote_mensagens=100, lote_ms=60000, classificar=classificar)
+        fila.enfileirar("estufa/camera/imagem", "1")
+        fila.enfileirar("estufa/temperatura", "2")
+        fila.enfileirar("estufa/alerta", "3")
+        fila.enfileirar("estufa/temperatura", "4")
+        fila.iniciar()
+        fila.parar()
+
+        assert [payload for _, payload in processadas] == ["3", "2", "4", "1"]
+
+    def test_descarte_por_limiar(self):
+        fila = FilaIngestao(
+            lambda lote: None, max_fila=10, classificar=classificar, limiar_imagens=0.2, limiar_amostragem=0.4, amostragem=3
+        )
+        for i in range(2):
+            assert fila.enfileirar("estufa/temperatura", str(i))
+        # Acima de 20% da capacidade as imagens são descartadas
+        assert not fila.enfileirar("estufa/camera/imagem", "img")
+        for i in range(2, 4):
+            assert fila.enfileirar("estufa/temperatura", str(i))
+
+        # Acima de 40%, apenas 1 de cada 3 leituras escalares por tópico entra
+        aceitas = [fila.enfileirar("estufa/umidade/ar", str(i)) for i in range(6)]
+        assert aceitas == [False, False, True, False, False, True]
+
+        status = fila.status()
+        assert status["profundidade"] == 6
+        assert status["descartes"] == {"imagens": 1, "amostragem": 4}
+
+    def test_descarte_por_quadro_inteiro(self):
+        fila = FilaIngestao(lambda lote: None, max_fila=10, classificar=classificar, limiar_imagens=0.2, quadro=quadro)
+        assert fila.enfileirar("estufa/camera/parte", "q1:0")
+        for i in range(2):
+            assert fila.enfileirar("estufa/temperatura", str(i))
+
+        # Acima do limiar, as partes do quadro já aceito continuam entrando e novos quadros são recusados
+        assert fila.enfileirar("estufa/camera/parte", "q1:1")
+        assert not fila.enfileirar("estufa/camera/parte", "q2:0")
+        assert not fila.enfileirar("estufa/camera/imagem", "img")
+        while fila.fila.qsize():
+            fila.fila.get_nowait()
+        # Um quadro recusado não entra pela metade quando a fila baixa
+        assert not fila.enfileirar("estufa/camera/parte", "q2:1")
+        assert fila.enfileirar("estufa/camera/parte", "q3:0")
+        assert fila.status()["descartes"] == {"imagens": 3}
+
+    def test_lotes_nao_sao_amostrados(self):
+        fila = FilaIngestao(
+            lambda lote: None,
+            max_fila=10,
+            classificar=classificar,
+            limiar_amostragem=0.0,
+            amostragem=2,
+            amostravel=lambda topic: topic != "estufa/leituras",
+        )
+
+        assert [fila.enfileirar("estufa/leituras", str(i)) for i in range(3)] == [True, True, True]
+        assert [fila.enfileirar("estufa/temperatura", str(i)) for i in range(2)] == [False, True]
+
+    def test_reserva_para_alertas_com_fila_cheia(self):
+        fila = FilaIngestao(lambda lote: None, max_fila=10, classificar=classificar, limiar_amostragem=1.0)
+        for i in range(10):
+            assert fila.enfileirar("estufa/temperatura", str(i))
+
+        assert not fila.enfileirar("estufa/temperatura", "11")
+        assert fila.enfileirar("estufa/alerta", "Porta aberta")
+        assert not fila.enfileirar("estufa/alerta", "Porta aberta")
+        assert fila.status()["descartes"] == {"fila_cheia": 2}
+
+
+@pytest.mark.integration
+class TestProcessarLote:
+    def test_lote_grava_todas_as_tabelas_em_uma_transacao(self, cliente_mqtt, db_session, sessao_ingestao):
+        cliente_mqtt.processar_lote(
+            [
+                ("estufa/temperatura", b'{"temperatura": 24.0}'),
+                ("estufa/umidade/ar", b'{"umidade_ar": 70.0}'),
+                ("estufa/alerta", b'{"mensagem": "Porta aberta"}'),
+            ],
+            descarregar_janelas=True,
+        )
+
+        dados = DadoPeriodico.query.all()
+        assert len(dados) == 1
+        assert dados[0].temperatura == 24.0
+        assert dados[0].umidade_ar == 70.0
+        assert Notificacao.query.count() == 1
+
+    def test_payload_invalido_nao_interrompe_lote(self, cliente_mqtt, db_session, sessao_ingestao):
+        cliente_mqtt.processar_lote(
+            [
+                ("estufa/temperatura", b"nao-e-json"),
+                ("estufa/ventilacao/status", b'{"status": "LIGADO"}'),
+            ]
+        )
+
+        assert StatusDispositivo.query.count() == 1
+
+    def test_prioridade_pelas_rotas(self, cliente_mqtt):
+        assert cliente_mqtt.prioridade("estufa/iluminacao/status") == PRIORIDADE_ALTA
+        assert cliente_mqtt.prioridade("estufa/umidade/solo/3") == PRIORIDADE_SENSORES
+        assert cliente_mqtt.prioridade("estufa/camera/parte") == PRIORIDADE_IMAGENS
+        assert cliente_mqtt.prioridade("estufa/desconhecido") == PRIORIDADE_SENSORES
+
+    def test_quadro_das_partes_de_imagem(self, cliente_mqtt):
+        assert cliente_mqtt.quadro("estufa/camera/parte", codificar_partes(b"imagem", quadro=7)[0]) == (None, 7)
+        assert cliente_mqtt.quadro("estufa/camera/imagem", b'{"quadro": 7}') is None
+
+    def test_lotes_de_leituras_nao_amostraveis(self, cliente_mqtt):
+        assert not cliente_mqtt.amostravel("estufa/leituras")
+        assert cliente_mqtt.amostravel("estufa/temperatura")
+        assert cliente_mqtt.amostravel("estufa/umidade/solo/3")
+
+    def test_status_expoe_metricas_da_fila(self, cliente_mqtt):
+        status = cliente_mqtt.status()
+        assert "ingestao" in status
+        assert status["ingestao"]["profundidade"] == 0
+
+
+@pytest.mark.integration
+class TestAtividadeTopicos:
+    def test_mensagens_nao_consultam_status_mqtt(self, cliente_mqtt, db_session):
+        with patch.object(StatusMQTT, "query") as query:
+            cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "Teste"}')] * 3)
+            cliente_mqtt.update_mqtt_status("CONECTADO")
+            query.filter_by.assert_not_called()
+            query.first.assert_not_called()
+
+        assert StatusMQTT.query.count() == 0
+        topico = cliente_mqtt.atividade.topicos()["estufa/alerta"]
+        assert topico["mensagens"] == 3
+        assert topico["bytes"] == 3 * len(b'{"mensagem": "Teste"}')
+
+    def test_persistir_faz_upsert_em_lote(self, cliente_mqtt, db_session):
+        cliente_mqtt.update_mqtt_status("CONECTADO")
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "A"}'), ("estufa/temperatura", b"invalido")])
+        cliente_mqtt.persistir_atividade()
+
+        status = {s.topico: s for s in StatusMQTT.query.all()}
+        assert status["estufa/alerta"].mensagens == 1
+        assert status["estufa/alerta"].status_conexao is True
+        assert status["estufa/temperatura"].erro_ultimo.startswith("Payload JSON inválido")
+
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "B"}')])
+        cliente_mqtt.update_mqtt_status("DESCONECTADO", "Servidor indisponível")
+        cliente_mqtt.persistir_atividade()
+        db_session.session.expire_all()
+
+        alerta = StatusMQTT.query.filter_by(topico="estufa/alerta").one()
+        assert alerta.mensagens == 2
+        assert alerta.status_conexao is False
+        assert alerta.erro_ultimo == "Servidor indisponível"
+
+    def test_totais_continuam_do_banco(self, cliente_mqtt, db_session):
+        db_session.session.add(StatusMQTT(topico="estufa/alerta", mensagens=10, bytes_recebidos=100))
+        db_session.session.commit()
+
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "A"}')])
+        cliente_mqtt.persistir_atividade()
+        db_session.session.expire_all()
+
+        alerta = StatusMQTT.query.filter_by(topico="estufa/alerta").one()
+        assert alerta.mensagens == 11
+        assert alerta.bytes_recebidos == 100 + len(b'{"mensagem": "A"}')
+
+    def test_persistir_soma_incrementos(self, cliente_mqtt, db_session):
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "A"}')])
+        cliente_mqtt.persistir_atividade()
+        # Outro worker soma as suas mensagens à mesma linha
+        StatusMQTT.query.filter_by(topico="estufa/alerta").update({"mensagens": StatusMQTT.mensagens + 5})
+        db_session.session.commit()
+
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "B"}')] * 2)
+        cliente_mqtt.persistir_atividade()
+        db_session.session.expire_all()
+
+        assert StatusMQTT.query.filter_by(topico="estufa/alerta").one().mensagens == 8
+
+    def test_linha_removida_e_inserida_de_novo(self, cliente_mqtt, db_session):
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "A"}')])
+        cliente_mqtt.persistir_atividade()
+        StatusMQTT.query.delete()
+        db_session.session.commit()
+
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "B"}')])
+        cliente_mqtt.persistir_atividade()
+        db_session.session.expire_all()
+
+        (alerta,) = StatusMQTT.query.all()
+        assert (alerta.topico, alerta.mensagens) == ("estufa/alerta", 1)
+
+
+@pytest.mark.integration
+class TestCacheLeituras:
+    def test_aquecer_carrega_ultima_leitura_por_sessao(self, db_session, sessao_ingestao):
+        from datetime import datetime, timedelta
+
+        from lib.cache import CacheLeituras
+
+        agora = datetime.now()
+        for i, temperatura in enumerate([20.0, 22.0]):
+            db_session.session.add(
+                DadoPeriodico(
+                    sessao_id=sessao_ingestao.id,
+                    cultura_id=sessao_ingestao.cultura_id,
+                    data_hora=agora + timedelta(minutes=i),
+                    temperatura=temperatura,
+                    umidade_ar=60.0,
+                    umidade_solo=40.0,
+                    exaustor_ligado=False,
+                )
+            )
+        db_session.session.commit()
+
+        cache = CacheLeituras()
+        cache.aquecer()
+
+        assert cache.aquecido
+        assert cache.obter(sessao_ingestao.id)["temperatura"] == 22.0
+
+    def test_ingestao_nao_consulta_ultimo_dado(self, cliente_mqtt, db_session, sessao_ingestao):
+        cliente_mqtt.processar_lote([("estufa/umidade/ar", b'{"umidade_ar": 55.0}')], descarregar_janelas=True)
+
+        with patch.object(DadoPeriodico, "query") as query:
+            cliente_mqtt.processar_lote([("estufa/temperatura", b'{"temperatura": 19.5}')], descarregar_janelas=True)
+            query.filter_by.assert_not_called()
+
+        ultimo = DadoPeriodico.query.order_by(DadoPeriodico.id.desc()).first()
+        assert ultimo.temperatura == 19.5
+        assert ultimo.umidade_ar == 55.0
+        assert cliente_mqtt.leituras.obter(sessao_ingestao.id)["temperatura"] == 19.5
+
+
+@pytest.fixture
+def login_gerente(client, db_session):
+    from lib.models import Grupo, Usuario
+
+    grupo = Grupo(nome="Gerente", nivel_acesso=4)
+    db_session.session.add(grupo)
+    db_session.session.commit()
+    usuario = Usuario(nome="Gerente", email="gerente@teste.com", senha="x", grupo_id=grupo.id)
+    db_session.session.add(usuario)
+    db_session.session.commit()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(usuario.id)
+        sess["_fresh"] = True
+    return usuario
+
+
+@pytest.mark.integration
+class TestRegistroSessoes:
+    def test_apenas_sessoes_ativas_recebem_leituras(self, cliente_mqtt, db_session, sessao_ingestao):
+        inativa = Sessao(nome="Canteiro 2", cultura_id=sessao_ingestao.cultura_id, ativa=False)
+        db_session.session.add(inativa)
+        db_session.session.commit()
+
+        cliente_mqtt.processar_lote([("estufa/temperatura", b'{"temperatura": 25.0}')], descarregar_janelas=True)
+
+        assert [dado.sessao_id for dado in DadoPeriodico.query.all()] == [sessao_ingestao.id]
+
+    def test_fan_out_sem_consultas_apos_carregar(self, cliente_mqtt, db_session, sessao_ingestao):
+        assert [sessao.id for sessao in cliente_mqtt.sessoes.ativas()] == [sessao_ingestao.id]
+
+        with patch.object(Sessao, "query") as query:
+            assert cliente_mqtt.sessoes.obter(sessao_ingestao.id).cultura_id == sessao_ingestao.cultura_id
+            cliente_mqtt.sessoes.ativas()
+            query.with_entities.assert_not_called()
+        assert cliente_mqtt.sessoes.carregamentos == 1
+
+    def test_rotas_de_sessao_invalidam_o_registro(self, client, login_gerente, sessao_ingestao):
+        from app import mqtt_client
+
+        mqtt_client.sessoes.ativas()
+        response = client.post(
+            f"/admin/sessoes/{sessao_ingestao.id}/edit",
+            data={"nome": "Canteiro 1", "cultura_id": sessao_ingestao.cultura_id, "ativa": ["0"]},
+        )
+        assert response.status_code == 302
+
+        assert Sessao.query.get(sessao_ingestao.id).ativa is False
+        assert mqtt_client.sessoes.ativas() == []
@@ -0,0 +1,90 @@
+"""
+Testes para os lotes de leituras com timestamp (tópico estufa/leituras).
+"""
+
+import json
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.orm import Session
+
+from lib.models import Cultura, DadoPeriodico, Sessao
+from lib.payload import codificar_lote, decodificar
+
+
+@pytest.fixture
+def sessoes_lote(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessoes = [Sessao(nome=f"Canteiro {i}", cultura_id=cultura.id) for i in (1, 2)]
+    db_session.session.add_all(sessoes)
+    db_session.session.commit()
+    return sessoes
+
+
+@pytest.mark.unit
+class TestCodificarLote:
+    def test_lote_binario(self):
+        payload = codificar_lote([("temperatura", 24.5, 1700000000, None), ("umidade", 41.5, 1700000010, 2)])
+
+        assert len(payload) == 3 + 2 * 11
+        assert decodificar(payload) == (
+            "lote",
+            {
+                "leituras": [
+                    {"temperatura": 24.5, "timestamp": 1700000000},
+                    {"umidade": 41.5, "canteiro": 2, "timestamp": 1700000010},
+                ]
+            },
+        )
+
+
+@pytest.mark.integration
+class TestProcessarLeituras:
+    def test_lote_gravado_em_um_insert(self, cliente_mqtt, db_session, sessoes_lote):
+        cliente_mqtt.coalescedor.janela_padrao_ms = 0
+        primeira, segunda = sessoes_lote
+        inicio = int(datetime(2024, 1, 1, 12).timestamp())
+        leituras = [{"timestamp": inicio + i * 10, "temperatura": 20.0 + i} for i in range(3)]
+        leituras.append({"timestamp": inicio, "canteiro": segunda.id, "umidade": 35.0})
+        payload = json.dumps({"leituras": leituras}).encode()
+
+        with patch.object(Session, "execute", autospec=True, side_effect=Session.execute) as execute:
+            cliente_mqtt.process_message("estufa/leituras", payload)
+        inserts = [c for c in execute.call_args_list if str(c.args[1]).startswith("INSERT INTO dado_periodico")]
+
+        assert len(inserts) == 1
+        assert DadoPeriodico.query.filter_by(sessao_id=primeira.id).count() == 3
+        assert DadoPeriodico.query.filter_by(sessao_id=segunda.id).count() == 4
+        dados = DadoPeriodico.query.filter_by(sessao_id=segunda.id).order_by(DadoPeriodico.id).all()
+        assert [d.umidade_solo for d in dados] == [0.0, 35.0, 35.0, 35.0]
+        assert dados[1].data_hora == datetime(2024, 1, 1, 12)
+
+    def test_leituras_fora_de_ordem_mescladas_por_janela(self, cliente_mqtt, db_session, sessoes_lote):
+        primeira, _ = sessoes_lote
+        inicio = int(datetime(2024, 1, 1, 12).timestamp())
+        payload = codificar_lote(
+            [
+                ("umidade_ar", 70.0, inicio + 2, None),
+                ("temperatura", 21.0, inicio, None),
+                ("umidade", 40.0, inicio + 1, primeira.id),
+                ("temperatura", 22.0, inicio + 30, None),
+            ]
+        )
+
+        cliente_mqtt.process_message("estufa/leituras", payload)
+
+        dados = DadoPeriodico.query.filter_by(sessao_id=primeira.id).order_by(DadoPeriodico.data_hora).all()
+        assert [(d.temperatura, d.umidade_ar, d.umidade_solo) for d in dados] == [(21.0, 70.0, 40.0), (22.0, 70.0, 40.0)]
+
+    def test_leituras_invalidas_descartadas(self, cliente_mqtt, db_session, sessoes_lote):
+        payload = json.dumps(
+            [{"temperatura": 23.0}, {"umidade": 40.0}, {"canteiro": "x", "umidade": 1.0}, {"canteiro": 999, "umidade": 1.0}, 5]
+        )
+
+        cliente_mqtt.process_message("estufa/leituras", payload.encode())
+
+        assert DadoPeriodico.query.count() == 2
+        assert cliente_mqtt.status()["lotes_leituras"] == {"mensagens": 1, "leituras": 1, "descartadas": 4}
@@ -52,7 +52,7 @@ class TestMQTTClient:
         # Mock do publish
         mqtt_client.mqtt_client.publish = Mock()
         mqtt_client.mqtt_client.publish.return_value = Mock()
-        mqtt_client.mqtt_client.publish.return_value.wait_for_publish = Mock()
+        mqtt_client.mqtt_client.publish.return_value.rc = 0
         mqtt_client.connected = True
 
         # Testar publish
@@ -144,25 +144,31 @@ class TestMQTTClient:
         """Testa envio de comando de irrigação"""
         mqtt_client.mqtt_client.publish = Mock()
         mqtt_client.mqtt_client.publish.return_value = Mock()
-        mqtt_client.mqtt_client.publish.return_value.wait_for_publish = Mock()
+        mqtt_client.mqtt_client.publish.return_value.rc = 0
         mqtt_client.connected = True
 
         result = mqtt_client.enviar_comando_irrigacao(1, "ON")
         
-        assert result is True
+        # A publicação não bloqueia: retorna o id usado para acompanhar a confirmação
+        assert result
         mqtt_client.mqtt_client.publish.assert_called_once()
+        assert json.loads(mqtt_client.mqtt_client.publish.call_args[0][1])["comando_id"] == result
+        assert mqtt_client.comandos.pendente(result) is not None
 
     def test_enviar_comando_ventilacao(self, mqtt_client):
         """Testa envio de comando de ventilação"""
         mqtt_client.mqtt_client.publish = Mock()
         mqtt_client.mqtt_client.publish.return_value = Mock()
-        mqtt_client.mqtt_client.publish.return_value.wait_for_publish = Mock()
+        mqtt_client.mqtt_client.publish.return_value.rc = 0
         mqtt_client.connected = True
 
         result = mqtt_client.enviar_comando_ventilacao("OFF")
         
-        assert result is True
+        # A publicação não bloqueia: retorna o id usado para acompanhar a confirmação
+        assert result
         mqtt_client.mqtt_client.publish.assert_called_once()
+        assert json.loads(mqtt_client.mqtt_client.publish.call_args[0][1])["comando_id"] == result
+        assert mqtt_client.comandos.pendente(result) is not None
 
     def test_get_device_status(self, mqtt_client, db_session):
         """Testa busca de status dos dispositivos"""
@@ -0,0 +1,110 @@
+"""
+Testes para o motor asyncio do cliente MQTT.
+"""
+
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+
+from lib.mqtt_async import FilaIngestaoAsync, MotorAsyncio, backoff
+
+
+def aguardar(condicao, limite=5.0):
+    fim = time.monotonic() + limite
+    while not condicao() and time.monotonic() < fim:
+        time.sleep(0.01)
+    return condicao()
+
+
+@pytest.mark.unit
+class TestBackoff:
+    def test_cresce_exponencialmente_ate_o_maximo(self):
+        with patch("lib.mqtt_async.random.uniform", side_effect=lambda a, b: b):
+            assert [backoff(t, base=1, maximo=10) for t in range(6)] == [1, 2, 4, 8, 10, 10]
+
+    def test_jitter_dentro_do_intervalo(self):
+        for tentativa in range(10):
+            assert 0 <= backoff(tentativa, base=0.5, maximo=30) <= 30
+
+
+@pytest.mark.unit
+class TestFilaIngestaoAsync:
+    def test_drena_em_lotes_e_executa_tarefas_ao_encerrar(self):
+        lotes = []
+        tarefas = []
+
+        async def cenario():
+            fila = FilaIngestaoAsync(lotes.append, lote_mensagens=4, lote_ms=60000)
+            fila.agendar(60, lambda forcar=False: tarefas.append(forcar))
+            fila.iniciar_no_loop(asyncio.get_running_loop())
+            for i in range(10):
+                assert fila.enfileirar("estufa/alerta", str(i))
+            await fila.encerrar()
+            return fila
+
+        fila = asyncio.run(cenario())
+
+        assert [len(lote) for lote in lotes] == [4, 4, 2]
+        assert tarefas == [True]
+        assert fila.status()["processadas"] == 10
+        assert not fila.ativa
+
+    def test_fila_cheia_descarta(self):
+        fila = FilaIngestaoAsync(lambda lote: None, max_fila=1)
+        assert fila.enfileirar("t", "1")
+        assert not fila.enfileirar("t", "2")
+        assert fila.status()["descartadas"] == 1
+
+
+@pytest.fixture
+def cliente_async(app):
+    with patch("paho.mqtt.client.Client"):
+        from lib.mqtt_new import MQTTClient
+
+        client = MQTTClient(motor="asyncio")
+        client.app = app
+        client.motor.base_backoff = 0.001
+        client.motor.intervalo_manutencao = 0.01
+        yield client
+        client.parar()
+
+
+@pytest.mark.integration
+class TestMotorAsyncio:
+    def test_reconecta_com_backoff_apos_falhas(self, cliente_async):
+        paho = cliente_async.mqtt_client
+        paho.connect.side_effect = [OSError("recusada"), OSError("recusada"), None]
+
+        cliente_async.motor.iniciar("broker.local", 1883)
+
+        assert aguardar(lambda: paho.connect.call_count == 3)
+        assert aguardar(lambda: cliente_async.motor.proxima_espera_s is None)
+        status = cliente_async.status()["motor"]
+        assert status["tipo"] == "asyncio"
+        assert status["tentativas"] == 3
+        assert cliente_async.atividade.erro_conexao == "recusada"
+        assert aguardar(lambda: paho.loop_misc.called)
+
+    def test_desconexao_nao_cria_timers(self, cliente_async):
+        paho = cliente_async.mqtt_client
+        cliente_async.motor.iniciar("broker.local", 1883)
+        assert aguardar(lambda: paho.connect.call_count == 1)
+
+        with patch("lib.mqtt_new.threading.Timer") as timer:
+            cliente_async.on_disconnect(paho, None, 7)
+            assert aguardar(lambda: paho.connect.call_count == 2)
+            timer.assert_not_called()
+        assert aguardar(lambda: cliente_async.motor.reconexoes == 1)
+
+    def test_mensagens_gravadas_pelo_event_loop(self, cliente_async, db_session):
+        from lib.models import StatusDispositivo
+
+        cliente_async.motor.iniciar("broker.local", 1883)
+        mensagem = type("Mensagem", (), {"topic": "estufa/ventilacao/status", "payload": b'{"status": "LIGADO"}'})
+        cliente_async.motor.loop.call_soon_threadsafe(cliente_async.on_message, None, None, mensagem)
+        cliente_async.parar()
+
+        assert StatusDispositivo.query.count() == 1
+        assert not cliente_async.motor.ativo
@@ -0,0 +1,145 @@
+"""
+Testes para a distribuição das notificações de alerta e os contadores de não lidas.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from lib.models import (
+    Cultura,
+    InteresseSessao,
+    Notificacao,
+    NotificacaoUsuario,
+    Sessao,
+    SessaoUsuario,
+    Usuario,
+)
+from lib.notificacoes import marcar_lidas, nivel_acesso_alerta, notificar
+
+
+@pytest.fixture
+def sessao_alerta(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+def _nao_lidas(usuario):
+    return Usuario.query.get(usuario.id).notificacoes_nao_lidas
+
+
+@pytest.mark.unit
+def test_nivel_acesso_alerta():
+    assert nivel_acesso_alerta("CRÍTICO") == 1
+    assert nivel_acesso_alerta("erro") == 2
+    assert nivel_acesso_alerta("INFO", padrao=3) == 3
+
+
+@pytest.mark.integration
+class TestDistribuicaoNotificacoes:
+    def test_entrega_por_nivel_de_acesso(self, db_session, usuario_admin, usuario_operador, usuario_visualizador):
+        _, entregas = notificar(db_session.session, "Alerta", "Porta aberta", nivel_acesso=2)
+        db_session.session.commit()
+
+        assert entregas == 2
+        assert {linha.usuario_id for linha in NotificacaoUsuario.query.all()} == {
+            usuario_admin.id,
+            usuario_operador.id,
+        }
+        assert _nao_lidas(usuario_admin) == 1
+        assert _nao_lidas(usuario_visualizador) == 0
+
+    def test_interesse_na_sessao(self, db_session, sessao_alerta, usuario_admin, usuario_visualizador):
+        db_session.session.add(InteresseSessao(usuario_id=usuario_visualizador.id, sessao_id=sessao_alerta.id))
+        db_session.session.add(InteresseSessao(usuario_id=usuario_admin.id, sessao_id=sessao_alerta.id))
+        db_session.session.commit()
+
+        _, entregas = notificar(db_session.session, "Alerta", "Solo seco", nivel_acesso=3, sessao_id=sessao_alerta.id)
+        db_session.session.commit()
+
+        # O administrador se enquadra pelos dois critérios e recebe uma única vez
+        assert entregas == 2
+        assert _nao_lidas(usuario_admin) == 1
+        assert _nao_lidas(usuario_visualizador) == 1
+
+    def test_marcar_lidas_reduz_contador(self, db_session, usuario_admin):
+        primeira, _ = notificar(db_session.session, "Alerta", "A", nivel_acesso=1)
+        notificar(db_session.session, "Alerta", "B", nivel_acesso=1)
+        db_session.session.commit()
+        assert _nao_lidas(usuario_admin) == 2
+
+        assert marcar_lidas(db_session.session, usuario_admin.id, [primeira]) == 1
+        assert marcar_lidas(db_session.session, usuario_admin.id, [primeira]) == 0
+        db_session.session.commit()
+        assert _nao_lidas(usuario_admin) == 1
+
+        assert marcar_lidas(db_session.session, usuario_admin.id) == 1
+        db_session.session.commit()
+        assert _nao_lidas(usuario_admin) == 0
+
+    def test_alerta_mqtt_notifica_usuarios(self, cliente_mqtt, db_session, usuario_admin, usuario_visualizador):
+        cliente_mqtt.processar_lote(
+            [
+                ("estufa/alerta", b'{"mensagem": "Temperatura alta", "nivel": "AVISO"}'),
+                ("estufa/alerta", b'{"mensagem": "Sensor desligado", "nivel": "CRITICO"}'),
+            ]
+        )
+
+        assert Notificacao.query.count() == 2
+        assert _nao_lidas(usuario_admin) == 2
+        assert _nao_lidas(usuario_visualizador) == 1
+
+    def test_alerta_mqtt_ignora_nivel_e_sessao_do_payload(self, cliente_mqtt, db_session, usuario_admin, usuario_visualizador):
+        cliente_mqtt.processar_lote(
+            [("estufa/alerta", b'{"mensagem": "Porta aberta", "nivel": "CRITICO", "nivel_acesso": 99, "canteiro": "A"}')]
+        )
+
+        assert Notificacao.query.count() == 1
+        assert _nao_lidas(usuario_admin) == 1
+        assert _nao_lidas(usuario_visualizador) == 1
+
+
+@pytest.mark.integration
+class TestNotificacoesMobile:
+    @pytest.fixture
+    def token(self, db_session, usuario_operador):
+        sessao = SessaoUsuario(
+            token="tok_notificacoes", usuario_id=usuario_operador.id, data_expiracao=datetime.now() + timedelta(days=1)
+        )
+        db_session.session.add(sessao)
+        db_session.session.commit()
+        return sessao.token
+
+    def test_caixa_e_marcar_lidas(self, client, db_session, usuario_operador, token):
+        notificar(db_session.session, "Alerta", "A", nivel_acesso=1)
+        notificar(db_session.session, "Alerta", "B", nivel_acesso=1)
+        db_session.session.commit()
+        cabecalho = {"Authorization": f"Bearer {token}"}
+
+        res = client.get("/api/mobile/notificacoes", headers=cabecalho)
+        assert res.status_code == 200
+        body = res.get_json()
+        assert body["nao_lidas"] == 2
+        assert [n["mensagem"] for n in body["notificacoes"]] == ["B", "A"]
+
+        res = client.post("/api/mobile/notificacoes/lidas", json={}, headers=cabecalho)
+        assert res.get_json()["lidas"] == 2
+        assert client.get("/api/mobile/notificacoes", headers=cabecalho).get_json()["nao_lidas"] == 0
+
+    def test_interesse_na_sessao(self, client, db_session, sessao_alerta, usuario_operador, token):
+        cabecalho = {"Authorization": f"Bearer {token}"}
+
+        assert client.post(f"/api/mobile/sessoes/{sessao_alerta.id}/interesse", headers=cabecalho).status_code == 200
+        assert client.post(f"/api/mobile/sessoes/{sessao_alerta.id}/interesse", headers=cabecalho).status_code == 200
+        assert InteresseSessao.query.filter_by(usuario_id=usuario_operador.id).count() == 1
+
+        assert client.delete(f"/api/mobile/sessoes/{sessao_alerta.id}/interesse", headers=cabecalho).status_code == 200
+        assert InteresseSessao.query.count() == 0
+
+    def test_requer_token(self, client):
+        assert client.get("/api/mobile/notificacoes").status_code == 401
@@ -0,0 +1,109 @@
+"""
+Testes para o planejamento das partições mensais de dado_periodico.
+"""
+
+from datetime import date, datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from lib.particoes import GerenciadorParticoes, mes_da_particao, nome_particao, planejar, somar_meses
+
+
+@pytest.mark.unit
+class TestPlanejarParticoes:
+    def test_nomes_e_meses(self):
+        assert nome_particao(date(2024, 3, 1)) == "dado_periodico_p202403"
+        assert mes_da_particao("dado_periodico_p202403") == date(2024, 3, 1)
+        assert mes_da_particao("dado_periodico_padrao") is None
+        assert somar_meses(date(2024, 11, 1), 3) == date(2025, 2, 1)
+        assert somar_meses(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+    def test_cria_meses_futuros_que_faltam(self):
+        existentes = ["dado_periodico_padrao", "dado_periodico_p202411"]
+
+        criar, expiradas = planejar(existentes, datetime(2024, 11, 20), meses_futuros=2, retencao_meses=0)
+
+        assert criar == [date(2024, 12, 1), date(2025, 1, 1)]
+        assert expiradas == []
+
+    def test_expira_meses_fora_da_retencao(self):
+        existentes = [nome_particao(date(2024, mes, 1)) for mes in range(1, 7)]
+
+        criar, expiradas = planejar(existentes, datetime(2024, 6, 5), meses_futuros=0, retencao_meses=3)
+
+        assert criar == []
+        assert expiradas == ["dado_periodico_p202401", "dado_periodico_p202402"]
+
+    def test_meses_da_particao_padrao(self):
+        # Leituras atrasadas ganham partição, exceto as de meses já expirados
+        criar, _ = planejar(
+            ["dado_periodico_p202406"],
+            datetime(2024, 6, 5),
+            meses_futuros=0,
+            retencao_meses=3,
+            pendentes=[date(2024, 1, 1), date(2024, 4, 1)],
+        )
+
+        assert criar == [date(2024, 4, 1)]
+
+
+@pytest.mark.integration
+def test_manter_ignora_tabela_nao_particionada(db_session):
+    particoes = GerenciadorParticoes()
+
+    assert particoes.manter(db_session.session) is None
+    assert particoes.status()["criadas"] == 0
+
+
+@pytest.mark.unit
+def test_acao_invalida_para_expiradas():
+    with pytest.raises(ValueError):
+        GerenciadorParticoes(expiradas="arquivar")
+    with pytest.raises(ValueError):
+        GerenciadorParticoes(resumo="semana")
+
+
+def _manter(particoes, session, existentes, agora):
+    with (
+        patch.object(GerenciadorParticoes, "particionada", return_value=True),
+        patch.object(GerenciadorParticoes, "particoes", return_value=existentes),
+    ):
+        return particoes.manter(session, agora=agora)
+
+
+@pytest.mark.unit
+def test_expiradas_preparadas_antes_de_desanexar():
+    eventos = []
+    session = MagicMock()
+    session.execute.side_effect = lambda instrucao, *args: eventos.append(str(instrucao))
+    session.commit.side_effect = lambda: eventos.append("commit")
+
+    def preparar(session, corte, resumo, prazo_final):
+        eventos.append(("preparar", corte, resumo))
+        return corte
+
+    particoes = GerenciadorParticoes(meses_futuros=0, retencao_meses=1, preparar=preparar)
+    existentes = ["dado_periodico_p202401", "dado_periodico_p202402", "dado_periodico_p202404"]
+
+    resultado = _manter(particoes, session, existentes, datetime(2024, 4, 10))
+
+    # Uma partição por execução: fevereiro fica para a próxima
+    assert resultado == {"criadas": [], "expiradas": ["dado_periodico_p202401"], "acao": "desanexar"}
+    # As leituras de janeiro são arquivadas e resumidas antes de a partição sair
+    assert eventos[:2] == ["commit", ("preparar", datetime(2024, 2, 1), "hora")]
+    assert "DETACH PARTITION dado_periodico_p202401" in eventos[2]
+
+
+@pytest.mark.unit
+def test_expirada_mantida_com_preparo_incompleto():
+    session = MagicMock()
+    particoes = GerenciadorParticoes(
+        meses_futuros=0, retencao_meses=1, preparar=lambda session, corte, resumo, prazo_final: datetime(2024, 1, 20)
+    )
+
+    resultado = _manter(particoes, session, ["dado_periodico_p202401", "dado_periodico_p202404"], datetime(2024, 4, 10))
+
+    assert resultado["expiradas"] == []
+    assert not any("DETACH" in str(chamada) for chamada in session.execute.call_args_list)
+    assert particoes.status()["desanexadas"] == 0
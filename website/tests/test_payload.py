@@ -0,0 +1,84 @@
+"""
+Testes para a decodificação dos payloads MQTT (JSON, struct binário e MessagePack).
+"""
+
+import pytest
+
+from lib.models import Cultura, DadoPeriodico, Sessao
+from lib.payload import PayloadInvalido, chave_quadro, codificar_escalar, codificar_imagem, codificar_partes, decodificar
+
+
+@pytest.mark.unit
+class TestDecodificar:
+    def test_json_continua_aceito(self):
+        assert decodificar(b'{"temperatura": 24.5}') == ("json", {"temperatura": 24.5})
+        assert decodificar(' {"umidade": 40}') == ("json", {"umidade": 40})
+
+    def test_escalar_binario(self):
+        payload = codificar_escalar("temperatura", 24.3, timestamp=1700000000)
+
+        assert len(payload) == 10
+        assert decodificar(payload) == ("escalar", {"temperatura": 24.3, "timestamp": 1700000000})
+
+    def test_escalar_sem_timestamp_usa_horario_de_chegada(self):
+        assert decodificar(codificar_escalar("umidade", 41.5)) == ("escalar", {"umidade": 41.5})
+
+    def test_imagem_binaria(self):
+        imagem = b"\xff\xd8\xff\xe0" + bytes(range(256))
+
+        formato, dados = decodificar(codificar_imagem(imagem, timestamp=5))
+
+        assert formato == "imagem"
+        assert dados == {"imagem": imagem, "timestamp": 5}
+
+    def test_msgpack(self):
+        msgpack = pytest.importorskip("msgpack")
+
+        payload = msgpack.packb({"umidade_ar": 70.0, "imagem": b"\x00\x01"})
+
+        assert decodificar(payload) == ("msgpack", {"umidade_ar": 70.0, "imagem": b"\x00\x01"})
+
+    @pytest.mark.parametrize(
+        "payload", [b"", b"nao-e-json", b"\x01\x01\x00", b"\x01\x09" + bytes(8), b"\x02\x00", b"\x03\x02\x00" + bytes(11)]
+    )
+    def test_payload_invalido(self, payload):
+        with pytest.raises(PayloadInvalido):
+            decodificar(payload)
+
+    def test_chave_quadro(self):
+        assert chave_quadro(codificar_partes(b"imagem", quadro=7)[0]) == (None, 7)
+        assert chave_quadro('{"camera": "c1", "quadro": 3, "parte": 0, "total": 2}') == ("c1", 3)
+        assert chave_quadro(b'{"temperatura": 20}') is None
+        assert chave_quadro(b"\x04\x00") is None
+
+
+@pytest.fixture
+def sessao_payload(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+@pytest.mark.integration
+class TestPayloadBinarioNaIngestao:
+    def test_leituras_binarias_gravadas(self, cliente_mqtt, db_session, sessao_payload):
+        imagem = b"\xff\xd8" + bytes(100)
+        cliente_mqtt.processar_lote(
+            [
+                ("estufa/temperatura", codificar_escalar("temperatura", 22.5)),
+                (f"estufa/umidade/solo/{sessao_payload.id}", codificar_escalar("umidade", 38.0)),
+                ("estufa/camera/imagem", codificar_imagem(imagem)),
+            ],
+            descarregar_janelas=True,
+        )
+
+        dado = DadoPeriodico.query.one()
+        assert dado.temperatura == 22.5
+        assert dado.umidade_solo == 38.0
+        assert dado.imagem is None
+        assert cliente_mqtt.imagens.ler(dado.imagem_sha256) == imagem
+        assert cliente_mqtt.status()["formatos"] == {"escalar": 2, "imagem": 1}
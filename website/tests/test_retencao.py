@@ -0,0 +1,156 @@
+"""
+Testes para as políticas de retenção.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from lib.agregados import AgregadorLeituras
+from lib.models import AgregadoLeitura, Cultura, DadoPeriodico, Log, Sessao, StatusDispositivo
+from lib.retencao import MotorRetencao, ler_politicas
+
+AGORA = datetime(2024, 6, 1, 12)
+
+
+@pytest.fixture
+def sessao_retencao(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+def _leituras(db_session, sessao, dias):
+    for dia in dias:
+        db_session.session.add(
+            DadoPeriodico(
+                data_hora=AGORA - timedelta(days=dia),
+                temperatura=20.0 + dia,
+                umidade_ar=60.0,
+                umidade_solo=40.0,
+                cultura_id=sessao.cultura_id,
+                sessao_id=sessao.id,
+                exaustor_ligado=False,
+            )
+        )
+    db_session.session.commit()
+
+
+@pytest.mark.unit
+class TestLerPoliticas:
+    def test_formato(self):
+        bruto, status, horas = ler_politicas("dado_periodico=30d>hora, status_dispositivo=12h,agregado_leitura.hora=730d")
+
+        assert (bruto.nome, bruto.manter, bruto.resumo) == ("dado_periodico", timedelta(days=30), "hora")
+        assert status.manter == timedelta(hours=12)
+        assert horas.nome == "agregado_leitura.hora"
+
+    @pytest.mark.parametrize(
+        "texto", ["usuario=30d", "log=30", "log=30d>hora", "dado_periodico=30d>semana", "agregado_leitura.semana=1d"]
+    )
+    def test_invalidas(self, texto):
+        with pytest.raises(ValueError):
+            ler_politicas(texto)
+
+
+@pytest.mark.integration
+class TestMotorRetencao:
+    def test_remove_em_lotes(self, db_session, usuario_admin):
+        for dia in range(7):
+            db_session.session.add(Log(data_hora=AGORA - timedelta(days=dia * 10), usuario_id=usuario_admin.id, mensagem="x"))
+            db_session.session.add(StatusDispositivo(tipo_dispositivo="irrigacao", status="LIGADO", data_hora=AGORA))
+        db_session.session.commit()
+
+        motor = MotorRetencao(ler_politicas("log=25d,status_dispositivo=1d"), lote=2, tempo_max_s=60)
+        relatorio = motor.executar(db_session.session, agora=AGORA)
+
+        assert Log.query.count() == 3
+        assert StatusDispositivo.query.count() == 7
+        assert relatorio["removidas"] == 4
+        assert [resultado["removidas"] for resultado in relatorio["politicas"]] == [4, 0]
+        assert all(resultado["completa"] for resultado in relatorio["politicas"])
+        assert motor.status()["removidas"]["log"] == 4
+
+    def test_tempo_esgotado_continua_na_proxima(self, db_session, usuario_admin):
+        for dia in range(5):
+            db_session.session.add(Log(data_hora=AGORA - timedelta(days=30 + dia), usuario_id=usuario_admin.id, mensagem="x"))
+        db_session.session.commit()
+
+        motor = MotorRetencao(ler_politicas("log=1d"), lote=2, tempo_max_s=0)
+        primeira = motor.executar(db_session.session, agora=AGORA)
+
+        # Um lote por política sempre roda; o restante fica para as próximas execuções
+        assert primeira["politicas"][0]["removidas"] == 2
+        assert not primeira["politicas"][0]["completa"]
+        while Log.query.count():
+            motor.executar(db_session.session, agora=AGORA)
+        assert motor.status()["removidas"]["log"] == 5
+
+    def test_bruto_resumido_por_hora(self, db_session, sessao_retencao):
+        _leituras(db_session, sessao_retencao, [1, 40, 41])
+
+        motor = MotorRetencao(ler_politicas("dado_periodico=30d>hora"), tempo_max_s=60)
+        motor.executar(db_session.session, agora=AGORA)
+
+        # As leituras antigas não tinham agregados: foram resumidas antes de sair
+        assert [dado.temperatura for dado in DadoPeriodico.query.all()] == [21.0]
+        horas = AgregadoLeitura.query.filter_by(resolucao="hora").order_by(AgregadoLeitura.inicio).all()
+        assert [hora.temperatura_soma for hora in horas] == [61.0, 60.0]
+
+    def test_bruto_ja_resumido_nao_recalcula(self, db_session, sessao_retencao):
+        _leituras(db_session, sessao_retencao, [40])
+        agregador = AgregadorLeituras()
+        agregador.recalcular(db_session.session, AGORA - timedelta(days=41))
+        db_session.session.commit()
+
+        MotorRetencao(ler_politicas("dado_periodico=30d>hora"), agregador=agregador).executar(db_session.session, agora=AGORA)
+
+        assert DadoPeriodico.query.count() == 0
+        assert agregador.recalculos == 1
+        assert AgregadoLeitura.query.filter_by(resolucao="hora").count() == 1
+
+    def test_lacuna_nos_agregados_e_recalculada(self, db_session, sessao_retencao):
+        _leituras(db_session, sessao_retencao, [40, 35])
+        agregador = AgregadorLeituras()
+        # Só a leitura mais antiga foi agregada pela ingestão
+        agregador.registrar(
+            db_session.session,
+            [
+                {
+                    "sessao_id": sessao_retencao.id,
+                    "data_hora": AGORA - timedelta(days=40),
+                    "temperatura": 60.0,
+                    "umidade_ar": 60.0,
+                    "umidade_solo": 40.0,
+                }
+            ],
+        )
+        db_session.session.commit()
+
+        MotorRetencao(ler_politicas("dado_periodico=30d>hora"), agregador=agregador).executar(db_session.session, agora=AGORA)
+
+        assert DadoPeriodico.query.count() == 0
+        horas = AgregadoLeitura.query.filter_by(resolucao="hora").order_by(AgregadoLeitura.inicio).all()
+        assert [hora.inicio for hora in horas] == [AGORA - timedelta(days=40), AGORA - timedelta(days=35)]
+
+    def test_resumo_em_etapas_com_tempo_esgotado(self, db_session, sessao_retencao):
+        _leituras(db_session, sessao_retencao, [1, 35, 40])
+        agregador = AgregadorLeituras()
+        motor = MotorRetencao(ler_politicas("dado_periodico=30d>hora"), tempo_max_s=0, agregador=agregador)
+
+        primeira = motor.executar(db_session.session, agora=AGORA)
+
+        # Um dia resumido por execução: só as leituras dele saem, o restante espera a próxima
+        assert agregador.recalculos == 1
+        assert [dado.temperatura for dado in DadoPeriodico.query.order_by(DadoPeriodico.data_hora)] == [55.0, 21.0]
+        assert (primeira["politicas"][0]["removidas"], primeira["politicas"][0]["completa"]) == (1, False)
+
+        segunda = motor.executar(db_session.session, agora=AGORA)
+
+        assert agregador.recalculos == 2
+        assert [dado.temperatura for dado in DadoPeriodico.query.all()] == [21.0]
+        assert (segunda["politicas"][0]["removidas"], segunda["politicas"][0]["completa"]) == (1, True)
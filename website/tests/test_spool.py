@@ -0,0 +1,138 @@
+"""
+Testes para o spool local de mensagens usado quando o banco está indisponível.
+"""
+
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from lib.ingestao import LoteEscrita
+from lib.models import Cultura, DadoPeriodico, Notificacao, Sessao
+from lib.spool import SpoolIngestao
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = SpoolIngestao(str(tmp_path / "spool" / "ingestao.spool"), tamanho_mb=1)
+    yield spool
+    spool.fechar()
+
+
+@pytest.mark.unit
+class TestSpoolIngestao:
+    def test_arquivo_criado_apenas_quando_necessario(self, spool):
+        assert not spool.abrir_existente()
+        assert spool.anexar([("estufa/alerta", b'{"mensagem": "A"}')]) == 1
+        assert spool.aberto
+
+    def test_ler_e_consumir_em_ordem(self, spool):
+        spool.anexar([("estufa/alerta", b"1"), ("estufa/alerta", "2")], recebida_em=100.0)
+        spool.anexar([("estufa/temperatura", b"3", 200.0)])
+
+        registros, posicao = spool.ler(2)
+        assert registros == [("estufa/alerta", b"1", 100.0), ("estufa/alerta", b"2", 100.0)]
+        spool.consumir(posicao, len(registros))
+
+        registros, posicao = spool.ler(10)
+        assert registros == [("estufa/temperatura", b"3", 200.0)]
+        spool.consumir(posicao, 1)
+        assert spool.status()["pendentes"] == 0
+        assert spool.status()["usados_bytes"] == 0
+
+    def test_pendentes_sobrevivem_ao_reinicio(self, spool):
+        spool.anexar([("estufa/alerta", b"1"), ("estufa/alerta", b"2")])
+        registros, posicao = spool.ler(1)
+        spool.consumir(posicao, 1)
+        spool.fechar()
+
+        reaberto = SpoolIngestao(spool.arquivo, tamanho_mb=1)
+        assert reaberto.abrir_existente()
+        assert reaberto.pendentes == 1
+        assert reaberto.ler(10)[0][0][1] == b"2"
+        reaberto.fechar()
+
+    def test_final_corrompido_descartado(self, spool):
+        spool.anexar([("estufa/alerta", b"1"), ("estufa/alerta", b"2")])
+        _, posicao = spool.ler(1)
+        spool._mapa[posicao + 30] ^= 0xFF
+        spool.fechar()
+
+        reaberto = SpoolIngestao(spool.arquivo, tamanho_mb=1)
+        reaberto.abrir()
+        assert reaberto.pendentes == 1
+        reaberto.fechar()
+
+    def test_spool_cheio_descarta(self, spool):
+        grande = bytes(400 * 1024)
+        assert spool.anexar([("estufa/camera/imagem", grande)] * 3) == 2
+        assert spool.status()["descartadas"] == 1
+
+
+def banco_fora_do_ar(*args, **kwargs):
+    raise OperationalError("INSERT", {}, Exception("conexão recusada"))
+
+
+@pytest.fixture
+def sessao_spool(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+@pytest.mark.integration
+class TestSpoolNaIngestao:
+    def test_banco_fora_do_ar_envia_ao_spool_e_reproduz(self, cliente_mqtt, db_session, sessao_spool):
+        with patch.object(LoteEscrita, "descarregar", side_effect=banco_fora_do_ar):
+            cliente_mqtt.processar_lote([("estufa/temperatura", b'{"temperatura": 21.0}')], descarregar_janelas=True)
+        # Com mensagens no spool, as próximas vão direto para ele
+        cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "Porta aberta"}')])
+
+        assert cliente_mqtt.status()["spool"]["pendentes"] == 2
+        assert DadoPeriodico.query.count() == 0
+        assert cliente_mqtt.coalescedor.status()["abertas"] == 0
+
+        cliente_mqtt.reproduzir_spool()
+        cliente_mqtt.descarregar_janelas(forcar=True)
+
+        dado = DadoPeriodico.query.one()
+        assert dado.temperatura == 21.0
+        assert abs((dado.data_hora - datetime.now()).total_seconds()) < 60
+        assert Notificacao.query.count() == 1
+        assert cliente_mqtt.spool.status()["reproduzidas"] == 2
+        assert cliente_mqtt.spool.pendentes == 0
+
+    def test_reproducao_aguarda_o_banco(self, cliente_mqtt, db_session):
+        cliente_mqtt.spool.anexar([("estufa/alerta", b'{"mensagem": "A"}')])
+
+        with patch.object(cliente_mqtt, "_banco_disponivel", return_value=False):
+            cliente_mqtt.reproduzir_spool()
+        assert cliente_mqtt.spool.pendentes == 1
+
+        cliente_mqtt.reproduzir_spool()
+        assert cliente_mqtt.spool.pendentes == 0
+        assert Notificacao.query.count() == 1
+
+    def test_reproducao_continua_ate_esvaziar(self, cliente_mqtt, db_session):
+        cliente_mqtt.ingestao.lote_mensagens = 2
+        cliente_mqtt.spool.anexar([("estufa/alerta", f'{{"mensagem": "{i}"}}'.encode()) for i in range(30)])
+
+        # Sem tempo sobrando, um lote por vez, e a fila chama de novo enquanto houver pendentes
+        assert cliente_mqtt.reproduzir_spool(tempo_max_s=0) is True
+        assert cliente_mqtt.spool.pendentes == 28
+        # Com tempo, reproduz até esvaziar, sem limite de lotes
+        assert cliente_mqtt.reproduzir_spool(tempo_max_s=60) is False
+        assert cliente_mqtt.spool.pendentes == 0
+        assert Notificacao.query.count() == 30
+
+    def test_erro_de_dados_nao_vai_ao_spool(self, cliente_mqtt, db_session):
+        with patch.object(LoteEscrita, "descarregar", side_effect=ValueError("linha inválida")):
+            with pytest.raises(ValueError):
+                cliente_mqtt.processar_lote([("estufa/alerta", b'{"mensagem": "A"}')])
+
+        assert cliente_mqtt.spool.pendentes == 0
@@ -0,0 +1,59 @@
+"""
+Testes para o roteador de tópicos MQTT.
+"""
+
+import pytest
+
+from lib.topicos import MQTT_TOPICS, RoteadorTopicos, filtro_mqtt
+
+
+@pytest.mark.unit
+class TestRoteadorTopicos:
+    def test_extrai_parametros_nomeados(self):
+        recebidos = []
+        roteador = RoteadorTopicos()
+        roteador.registrar("estufa/umidade/solo/{canteiro}", lambda data, canteiro: recebidos.append((data, canteiro)))
+
+        assert roteador.despachar("estufa/umidade/solo/3", {"umidade": 40})
+        assert recebidos == [({"umidade": 40}, "3")]
+        assert not roteador.despachar("estufa/umidade/solo/3/extra", {})
+
+    def test_literal_tem_precedencia_sobre_curingas(self):
+        roteador = RoteadorTopicos()
+        literal = roteador.registrar("estufa/ventilacao/status", lambda data: None)
+        roteador.registrar("estufa/+/status", lambda data: None)
+        roteador.registrar("estufa/#", lambda data: None)
+
+        assert roteador.resolver("estufa/ventilacao/status")[0] is literal
+        assert roteador.resolver("estufa/bomba/status")[0].padrao == "estufa/+/status"
+        assert roteador.resolver("estufa/bomba/nivel/agua")[0].padrao == "estufa/#"
+        assert roteador.resolver("estufa")[0].padrao == "estufa/#"
+
+    def test_topicos_de_sistema_nao_casam_com_curinga(self):
+        roteador = RoteadorTopicos()
+        roteador.registrar("#", lambda data: None)
+
+        assert roteador.resolver("$SYS/broker/uptime") == (None, {})
+        assert roteador.resolver("estufa/alerta")[0] is not None
+
+    def test_contadores_por_rota(self):
+        roteador = RoteadorTopicos()
+        roteador.registrar(MQTT_TOPICS["alerta"], lambda data: None)
+
+        roteador.despachar("estufa/alerta", {})
+        roteador.despachar("estufa/alerta", {})
+        roteador.despachar("estufa/desconhecido", {})
+
+        assert roteador.estatisticas() == {"rotas": {"estufa/alerta": 2}, "nao_roteadas": 1}
+
+    def test_registro_invalido(self):
+        roteador = RoteadorTopicos()
+        roteador.registrar("estufa/{canteiro}", lambda data, canteiro: None)
+
+        with pytest.raises(ValueError):
+            roteador.registrar("estufa/+", lambda data: None)
+        with pytest.raises(ValueError):
+            roteador.registrar("estufa/#/status", lambda data: None)
+
+    def test_filtro_mqtt(self):
+        assert filtro_mqtt("estufa/umidade/solo/{canteiro}") == "estufa/umidade/solo/+"
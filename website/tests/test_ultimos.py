@@ -0,0 +1,193 @@
+"""
+Testes para a tabela ultimo_dado_sessao.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from lib.models import Cultura, DadoPeriodico, Sessao, SessaoIrrigacao, SessaoUsuario, UltimoDadoSessao
+from lib.ultimos import estado_irrigacao, linhas_ultimos, preencher, recalcular, registrar
+
+INICIO = datetime(2024, 1, 1, 12)
+
+
+def _leitura(sessao_id, segundos, temperatura, **campos):
+    return dict(
+        sessao_id=sessao_id,
+        data_hora=INICIO + timedelta(seconds=segundos),
+        temperatura=temperatura,
+        umidade_ar=60.0,
+        umidade_solo=40.0,
+        exaustor_ligado=False,
+        **campos,
+    )
+
+
+@pytest.fixture
+def sessao_ultimos(db_session):
+    cultura = Cultura(nome="Alface")
+    db_session.session.add(cultura)
+    db_session.session.commit()
+    sessao = Sessao(nome="Canteiro 1", cultura_id=cultura.id)
+    db_session.session.add(sessao)
+    db_session.session.commit()
+    return sessao
+
+
+def _ultimo(db_session, sessao_id):
+    db_session.session.expire_all()
+    return db_session.session.get(UltimoDadoSessao, sessao_id)
+
+
+@pytest.mark.unit
+class TestLinhasUltimos:
+    def test_leitura_e_imagem_mais_recentes(self):
+        leituras = [
+            _leitura(1, 10, 20.0, imagem_sha256="a" * 64),
+            _leitura(1, 30, 22.0),
+            _leitura(1, 20, 21.0, imagem=b"antiga"),
+        ]
+        (linha,) = linhas_ultimos(leituras, {1: (True, INICIO)})
+
+        assert linha["temperatura"] == 22.0
+        assert linha["data_hora"] == INICIO + timedelta(seconds=30)
+        # A imagem mais recente é a gravada na coluna antiga, sem sha256
+        assert linha["imagem_data_hora"] == INICIO + timedelta(seconds=20)
+        assert linha["imagem_sha256"] is None
+        assert (linha["esta_irrigando"], linha["irrigacao_inicio"]) == (True, INICIO)
+
+    def test_sessoes_sem_leituras(self):
+        (linha,) = linhas_ultimos([], {}, sessoes=(5,))
+
+        assert linha["sessao_id"] == 5
+        assert linha["data_hora"] is None
+        assert linha["esta_irrigando"] is False
+
+
+@pytest.mark.integration
+class TestUltimoDadoSessao:
+    def test_lote_atrasado_nao_substitui(self, db_session, sessao_ultimos):
+        conexao = db_session.session.connection()
+        registrar(conexao, [_leitura(sessao_ultimos.id, 60, 25.0, imagem_sha256="b" * 64)])
+        registrar(conexao, [_leitura(sessao_ultimos.id, 0, 18.0, imagem_sha256="c" * 64)])
+        registrar(conexao, [_leitura(sessao_ultimos.id, 120, 26.0)])
+        db_session.session.commit()
+
+        ultimo = _ultimo(db_session, sessao_ultimos.id)
+        assert ultimo.temperatura == 26.0
+        assert ultimo.data_hora == INICIO + timedelta(seconds=120)
+        # A leitura mais nova não tem imagem: a anterior continua valendo
+        assert ultimo.imagem_sha256 == "b" * 64
+        assert UltimoDadoSessao.query.count() == 1
+
+    def test_orm_e_irrigacao(self, db_session, sessao_ultimos):
+        db_session.session.add(SessaoIrrigacao(sessao_id=sessao_ultimos.id, status=True, data_inicio=INICIO))
+        db_session.session.commit()
+        ultimo = _ultimo(db_session, sessao_ultimos.id)
+        assert ultimo.esta_irrigando is True
+        assert ultimo.data_hora is None
+
+        db_session.session.add(
+            DadoPeriodico(
+                cultura_id=sessao_ultimos.cultura_id,
+                **_leitura(sessao_ultimos.id, 0, 21.0),
+            )
+        )
+        db_session.session.commit()
+        ultimo = _ultimo(db_session, sessao_ultimos.id)
+        assert (ultimo.temperatura, ultimo.esta_irrigando, ultimo.irrigacao_inicio) == (21.0, True, INICIO)
+
+        irrigacao = SessaoIrrigacao.query.filter_by(sessao_id=sessao_ultimos.id).one()
+        irrigacao.status = False
+        db_session.session.commit()
+        ultimo = _ultimo(db_session, sessao_ultimos.id)
+        assert ultimo.esta_irrigando is False
+        assert ultimo.temperatura == 21.0
+
+    def test_leituras_nao_consultam_irrigacao(self, db_session, sessao_ultimos):
+        db_session.session.add(SessaoIrrigacao(sessao_id=sessao_ultimos.id, status=True, data_inicio=INICIO))
+        db_session.session.commit()
+        conexao = db_session.session.connection()
+        instrucoes = []
+
+        def ouvinte(conn, cursor, instrucao, *args):
+            instrucoes.append(instrucao)
+
+        event.listen(conexao.engine, "before_cursor_execute", ouvinte)
+        try:
+            registrar(conexao, [_leitura(sessao_ultimos.id, 0, 21.0)])
+        finally:
+            event.remove(conexao.engine, "before_cursor_execute", ouvinte)
+        db_session.session.commit()
+
+        assert not any("sessao_irrigacao" in instrucao for instrucao in instrucoes)
+        assert _ultimo(db_session, sessao_ultimos.id).esta_irrigando is True
+
+    def test_irrigacao_sem_inicio_e_a_mais_antiga(self, db_session, sessao_ultimos):
+        db_session.session.add(SessaoIrrigacao(sessao_id=sessao_ultimos.id, status=False, data_inicio=INICIO))
+        db_session.session.add(SessaoIrrigacao(sessao_id=sessao_ultimos.id, status=True, data_inicio=None))
+        db_session.session.commit()
+
+        # Mesma ordem do gatilho de init.sql (data_inicio DESC NULLS LAST)
+        assert estado_irrigacao(db_session.session.connection(), [sessao_ultimos.id]) == {sessao_ultimos.id: (False, INICIO)}
+        assert _ultimo(db_session, sessao_ultimos.id).esta_irrigando is False
+
+    def test_ingestao_atualiza(self, cliente_mqtt, db_session, sessao_ultimos):
+        cliente_mqtt.coalescedor.janela_padrao_ms = 0
+        inicio = int(INICIO.timestamp())
+        leituras = [{"timestamp": inicio + i * 20, "temperatura": 20.0 + i} for i in range(3)]
+        cliente_mqtt.process_message("estufa/leituras", json.dumps({"leituras": leituras}).encode())
+
+        mais_recente = DadoPeriodico.query.order_by(DadoPeriodico.data_hora.desc()).first()
+        ultimo = _ultimo(db_session, sessao_ultimos.id)
+        assert ultimo.data_hora == mais_recente.data_hora
+        assert ultimo.temperatura == mais_recente.temperatura == 22.0
+
+    def test_recalcular_e_preencher(self, db_session, sessao_ultimos):
+        vazia = Sessao(nome="Canteiro 2", cultura_id=sessao_ultimos.cultura_id)
+        db_session.session.add(vazia)
+        for segundos, temperatura in ((0, 20.0), (90, 26.0)):
+            db_session.session.add(
+                DadoPeriodico(cultura_id=sessao_ultimos.cultura_id, **_leitura(sessao_ultimos.id, segundos, temperatura))
+            )
+        db_session.session.commit()
+        UltimoDadoSessao.query.delete()
+        db_session.session.commit()
+
+        assert preencher(db_session.session.connection()) == 2
+        assert preencher(db_session.session.connection()) == 0
+        db_session.session.commit()
+        assert _ultimo(db_session, sessao_ultimos.id).temperatura == 26.0
+        assert _ultimo(db_session, vazia.id).data_hora is None
+
+        assert recalcular(db_session.session.connection()) == 2
+        db_session.session.commit()
+        assert UltimoDadoSessao.query.count() == 2
+
+
+@pytest.mark.integration
+class TestPainel:
+    def test_dashboard_e_index(self, client, db_session, sessao_ultimos, usuario_operador):
+        db_session.session.add(
+            SessaoUsuario(
+                token="tok_ultimos", usuario_id=usuario_operador.id, data_expiracao=datetime.now() + timedelta(days=1)
+            )
+        )
+        db_session.session.add(SessaoIrrigacao(sessao_id=sessao_ultimos.id, status=True, data_inicio=datetime.now()))
+        db_session.session.add(DadoPeriodico(cultura_id=sessao_ultimos.cultura_id, **_leitura(sessao_ultimos.id, 0, 23.5)))
+        db_session.session.commit()
+
+        body = client.get("/api/mobile/dashboard", headers={"Authorization": "Bearer tok_ultimos"}).get_json()
+        (sessao,) = body["data"]
+        assert sessao["esta_irrigando"] is True
+        assert sessao["tempo_cultivo"] == 0
+        assert sessao["dados"]["temperatura"] == 23.5
+        assert sessao["dados"]["data_hora"] == INICIO.isoformat()
+        assert sessao["imagem_url"] is None
+
+        res = client.get("/")
+        assert res.status_code == 200
+        assert b"23.5" in res.data